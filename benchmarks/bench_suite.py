@@ -0,0 +1,353 @@
+import argparse
+import itertools
+import json
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+
+SCRIPT_DIR = Path(__file__).resolve().parents[1] / "scripts"
+sys.path.insert(0, str(SCRIPT_DIR))
+
+from _consensus_ import consensus_track
+from _helper_ import LOCAL_TZ, QUADRANT_COLS, knots_to_cat_array
+from _interp_ import interpolate_tracks
+from exposure import LocationIndex, exposure_table
+from geopandas import GeoDataFrame, points_from_xy
+from make_shp import (
+    PROJ_CRS,
+    WIND_RADII,
+    generate_radius,
+    generate_radius_envelope,
+    generate_track_envelope,
+    make_shp,
+)
+from parse_jtwc import proc_tc_data as get_jtwc
+from parse_rammb import proc_tc_data as get_rammb
+from parse_t2k import proc_tc_data as get_t2k
+
+FIXTURE_DIR = Path(__file__).resolve().parent / "fixtures"
+
+# results every run is compared against by default, refreshed with
+# --save benchmarks/baseline.json when a change is expected to be slower
+BASELINE_FILE = Path(__file__).resolve().parent / "baseline.json"
+
+# local time of the run that downloaded the fixtures
+FIXTURE_TIME = pd.Timestamp("2021-09-11 15:00")
+
+CENTERS = ["JTWC", "PAGASA", "JMA", "CMA", "KMA", "HKO"]
+
+# times below this (in s) are too noisy to be compared with the baseline
+MIN_TIME = 0.002
+
+# stage -> module imported by the entry point, measured in a new interpreter
+IMPORT_STAGES = {
+    "import_cron_multi": "cron_multi",
+    "import_make_shp": "make_shp",
+    "import_parse_jtwc": "parse_jtwc",
+    "import_parse_t2k": "parse_t2k",
+    "import_parse_rammb": "parse_rammb",
+    "import_replay": "replay",
+    "import_daemon": "daemon",
+}
+
+# heavy libraries reported when an entry point loads them
+HEAVY_MODULES = ["geopandas", "shapely", "pyproj", "scipy", "lxml"]
+
+IMPORT_CODE = """
+import json, re, sys, time
+sys.path.insert(0, {script_dir!r})
+t0 = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - t0
+print(json.dumps({{
+    "time": elapsed,
+    "peak_mb": int(re.search(r"VmHWM:\\s+(\\d+)", open("/proc/self/status").read())[1])
+    / 1024,
+    "heavy": [m for m in {heavy!r} if m in sys.modules],
+}}))
+"""
+
+
+def synthetic_track(n_centers=8, n_hist=120, n_fcst=10, seed=0):
+    """Positions of many centers with a long track history
+
+    Every center has 6-hourly history, a current position and 12-hourly
+    forecasts. The track starts on Dec 1 so that it crosses the year boundary.
+    JTWC has wind radii.
+
+    Input:
+    n_centers (int) -- number of centers
+    n_hist (int) -- number of past positions of each center
+    n_fcst (int) -- number of forecast positions of each center
+    seed (int) -- seed of the random perturbations
+
+    Output:
+    df (pandas.DataFrame) -- positions with the columns of the cron_multi CSV
+    """
+    rng = np.random.default_rng(seed)
+    centers = CENTERS[:n_centers] + [f"C{k:02}" for k in range(n_centers - 6)]
+    t0 = pd.Timestamp("2021-12-01 08:00", tz=LOCAL_TZ)
+    hrs = np.r_[np.arange(n_hist + 1) * 6, n_hist * 6 + np.arange(1, n_fcst + 1) * 12]
+    n = hrs.size
+    pos_type = np.array(["h"] * n_hist + ["c"] + ["f"] * n_fcst)
+
+    dfs = []
+    for k, center in enumerate(centers):
+        drift = np.where(pos_type == "f", hrs - n_hist * 6, 0) * rng.normal(0, 0.01)
+        vmax = 30 + 90 * np.sin(np.pi * hrs / hrs[-1]) + rng.normal(0, 5, n)
+        df = pd.DataFrame(
+            {
+                "Center": center,
+                "Timestamp": t0 + pd.to_timedelta(hrs, unit="h"),
+                "Lat": 8 + hrs * 0.02 + rng.normal(0, 0.05, n) + drift,
+                "Lon": 140 - hrs * 0.03 + rng.normal(0, 0.05, n) - drift,
+                "PosType": pos_type,
+                "Vmax": vmax * 1.852,
+                "Cat": knots_to_cat_array(vmax),
+            }
+        )
+        if center == "JTWC":
+            for wrad, scale in zip(WIND_RADII, [250, 120, 60]):
+                quads = rng.uniform(0.5, 1, (n, 4)) * scale
+                quads[pos_type == "h"] = np.nan
+                df[wrad] = quads.max(axis=1)
+                for i, col in enumerate(c for c in QUADRANT_COLS if c[:3] == wrad):
+                    df[col] = quads[:, i]
+        dfs.append(df)
+
+    df = pd.concat(dfs, ignore_index=True)
+    df["Date"] = df["Timestamp"].dt.strftime("%b %-d %-I %P")
+    cols = ["Center", "Date", "Lat", "Lon", "PosType", "Vmax", "Cat"]
+    return df.reindex(columns=cols + WIND_RADII + QUADRANT_COLS + ["Timestamp"])
+
+
+def forecast_points(df):
+    """Track points with the '{CENTER}_forecast' tracks, as in make_shp"""
+    fcst = df.loc[df["PosType"] != "h"].copy()
+    fcst["Center"] = fcst["Center"] + "_forecast"
+    df = pd.concat([df.loc[df["PosType"] != "f"], fcst], ignore_index=True)
+    geom = points_from_xy(df["Lon"], df["Lat"], crs=PROJ_CRS)
+    return GeoDataFrame(df, crs=PROJ_CRS, geometry=geom)
+
+
+def synthetic_locations(n_lon=80, n_lat=64):
+    """Grid of small polygons around the synthetic track, like the boundaries
+    of municipalities
+
+    Output:
+    gdf (geopandas.GeoDataFrame) -- n_lon * n_lat polygons with a 'name'
+    """
+    x, y = np.meshgrid(np.linspace(100, 140, n_lon), np.linspace(5, 30, n_lat))
+    x, y = x.ravel(), y.ravel()
+    geom = shapely.box(x, y, x + 0.3, y + 0.25)
+    return GeoDataFrame(
+        {"name": [f"L{i}" for i in range(x.size)]}, geometry=geom, crs=PROJ_CRS
+    )
+
+
+def calibration(n=200_000):
+    """Fixed pure Python and numpy workload, whose time gives the speed of the
+    machine the suite runs on"""
+    values = np.random.default_rng(0).random(n)
+    np.sort(values)
+    return sum(i * i for i in range(n))
+
+
+def make_stages(df, work_dir):
+    """Benchmarked stages, name -> function without arguments"""
+    csv_file = work_dir / "synthetic.csv"
+    df.to_csv(csv_file, index=False)
+    pts_gdf = forecast_points(df)
+    loc_index = LocationIndex(synthetic_locations())
+    rad_gdf = pts_gdf.loc[pts_gdf["Center"] == "JTWC_forecast"]
+    # every call writes into a new directory
+    out_dirs = (work_dir / f"shp{i}" for i in itertools.count())
+
+    return {
+        "parse_jtwc": lambda: get_jtwc(
+            FIXTURE_DIR / "wp1821web.txt",
+            "wp1821",
+            timestamp=FIXTURE_TIME,
+            mode="local",
+        ),
+        "parse_t2k": lambda: get_t2k(
+            FIXTURE_DIR / "CONSON.TXT",
+            "CONSON",
+            exclude="JTWC",
+            timestamp=FIXTURE_TIME,
+            mode="local",
+        ),
+        "parse_rammb": lambda: get_rammb(
+            "wp182021", dload_url=FIXTURE_DIR / "wp182021.html", mode="local"
+        ),
+        "parse_rammb_bdeck": lambda: get_rammb(
+            "wp182021", dload_url=FIXTURE_DIR / "bwp182021.dat", mode="local"
+        ),
+        "track_envelope": lambda: generate_track_envelope(pts_gdf, "JTWC"),
+        "radius_envelope": lambda: generate_radius_envelope(pts_gdf, "JTWC"),
+        "radius": lambda: [generate_radius(rad_gdf, r) for r in WIND_RADII],
+        "interpolate_tracks": lambda: interpolate_tracks(df, "1h"),
+        "consensus_track": lambda: consensus_track(df, "1h"),
+        "exposure": lambda: exposure_table(loc_index, df),
+        "make_shp_csv": lambda: make_shp(csv_file, next(out_dirs), "JTWC"),
+        "make_shp_df": lambda: make_shp(df, next(out_dirs), "JTWC"),
+        "make_shp_df_workers": lambda: make_shp(df, next(out_dirs), "JTWC", workers=4),
+    }
+
+
+def measure(func, repeat=5):
+    """Best time of the repeats and peak memory of a separate traced call
+
+    Output:
+    res (dict) -- 'time' in s and 'peak_mb' as traced by tracemalloc
+    """
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {"time": min(times), "peak_mb": peak / 1e6}
+
+
+def measure_import(module, repeat=5):
+    """Best import time of a module over new interpreters
+
+    Output:
+    res (dict) -- 'time' in s, 'peak_mb' as the peak RSS of the interpreter
+        and the 'heavy' libraries loaded by the import
+    """
+    code = IMPORT_CODE.format(
+        script_dir=str(SCRIPT_DIR), module=module, heavy=HEAVY_MODULES
+    )
+    runs = []
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        runs.append(json.loads(out.stdout.splitlines()[-1]))
+    best = min(runs, key=lambda r: r["time"])
+    return {**best, "peak_mb": max(r["peak_mb"] for r in runs)}
+
+
+def compare(results, baseline, threshold=0.5):
+    """List the stages slower or bigger than the baseline by more than the threshold
+
+    The times of the baseline are scaled by the ratio of the calibration
+    times, so a baseline saved on another (or a less busy) machine still
+    applies.
+    """
+    scale = 1.0
+    if "calibration" in results and "calibration" in baseline:
+        scale = results["calibration"]["time"] / baseline["calibration"]["time"]
+    regressions = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None or name == "calibration":
+            continue
+        base_time = base["time"] * scale
+        if res["time"] > base_time * (1 + threshold) and res["time"] > MIN_TIME:
+            regressions.append(f"{name}: {base_time:.4f}s -> {res['time']:.4f}s")
+        if res["peak_mb"] > base["peak_mb"] * (1 + threshold):
+            regressions.append(
+                f"{name}: {base['peak_mb']:.2f}MB -> {res['peak_mb']:.2f}MB"
+            )
+    return regressions
+
+
+def print_results(results, baseline=None):
+    baseline = {} if baseline is None else baseline
+    print(f"{'stage':<18} {'time (ms)':>10} {'peak (MB)':>10} {'vs baseline':>12}")
+    for name, res in results.items():
+        change = ""
+        if name in baseline:
+            change = f"{res['time'] / baseline[name]['time'] - 1:+.0%}"
+        print(
+            f"{name:<18} {res['time'] * 1e3:>10.2f} {res['peak_mb']:>10.2f}"
+            f" {change:>12}"
+        )
+    for name, res in results.items():
+        if "heavy" in res:
+            print(f"{name} loads: {', '.join(res['heavy']) or '-'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the parsers and the GIS generation offline",
+        epilog="Exits with an error when a stage is slower or bigger than the "
+        "baseline. Refresh the baseline with "
+        "python benchmarks/bench_suite.py --save benchmarks/baseline.json",
+    )
+    parser.add_argument(
+        "--stage", help="Stage to run, can be repeated", action="append"
+    )
+    parser.add_argument("--repeat", help="Number of timed rounds", type=int, default=5)
+    parser.add_argument("--centers", help="Synthetic centers", type=int, default=8)
+    parser.add_argument(
+        "--hist", help="Synthetic past positions per center", type=int, default=120
+    )
+    parser.add_argument(
+        "--fcst", help="Synthetic forecasts per center", type=int, default=10
+    )
+    parser.add_argument(
+        "--baseline",
+        help="Results to compare against (JSON), empty to not compare",
+        default=str(BASELINE_FILE),
+    )
+    parser.add_argument(
+        "--threshold",
+        help="Allowed slowdown/growth relative to the baseline, above the noise "
+        "of a shared machine",
+        type=float,
+        default=0.5,
+    )
+    parser.add_argument("--save", help="Save the results (JSON)")
+    args = parser.parse_args()
+
+    df = synthetic_track(args.centers, args.hist, args.fcst)
+    print(f"Synthetic track: {df.shape[0]} positions, {args.centers} centers")
+    with tempfile.TemporaryDirectory() as work_dir:
+        stages = make_stages(df, Path(work_dir))
+        names = [*stages, *IMPORT_STAGES] if args.stage is None else args.stage
+        results = {"calibration": measure(calibration, args.repeat)}
+        results |= {
+            name: measure_import(IMPORT_STAGES[name], args.repeat)
+            if name in IMPORT_STAGES
+            else measure(stages[name], args.repeat)
+            for name in names
+        }
+
+    # saving over the baseline refreshes it instead of comparing against it
+    baseline = None
+    if args.baseline and not (
+        args.save is not None
+        and Path(args.save).resolve() == Path(args.baseline).resolve()
+    ):
+        if not Path(args.baseline).exists():
+            sys.exit(f"No baseline {args.baseline}, save one with --save")
+        with open(args.baseline, "r") as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    if args.save is not None:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if len(regressions) > 0:
+            sys.exit("Regressions:\n  " + "\n  ".join(regressions))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+import argparse
+import re
+import sys
+import time
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "scripts"))
+
+from _archive_ import RawArchive
+from parse_t2k import proc_tc_data
+
+# multilog files saved by older versions of cron_multi
+T2K_FILE_RE = re.compile(r"([A-Z0-9-]+)_([0-9]{10})\.TXT$")
+
+FIXTURE_DIR = Path(__file__).resolve().parent / "fixtures"
+
+# local time of the run that downloaded the fixtures
+FIXTURE_TIME = pd.Timestamp("2021-09-11 15:00")
+
+
+def find_corpus(paths):
+    """List the Typhoon2000 multilogs of the raw archives (RawArchive) and the
+    multilog files '{NAME}_YYYYMMDDHH.TXT' of older versions
+
+    Input:
+    paths (list) -- files or directories to search, every 'index.sqlite'
+        below a directory is an archive
+
+    Output:
+    corpus (list) -- (file or hash, storm name, timestamp, archive or None,
+        size in bytes) of each multilog
+    """
+    corpus = []
+    for path in map(Path, paths):
+        if not path.is_dir():
+            files, archives = [path], []
+        else:
+            files = sorted(path.rglob("*.TXT"))
+            archives = sorted(p.parent for p in path.rglob("index.sqlite"))
+        for f in files:
+            m = T2K_FILE_RE.search(f.name)
+            if m is not None:
+                timestamp = pd.to_datetime(m.group(2), format="%Y%m%d%H")
+                corpus.append((f, m.group(1), timestamp, None, f.stat().st_size))
+        for archive_dir in archives:
+            archive = RawArchive(archive_dir)
+            for _, storm, fetch_time, sha in archive.entries("Typhoon2k"):
+                size = len(archive.read(sha).encode())
+                corpus.append((sha, storm, fetch_time, archive, size))
+    return corpus
+
+
+def run(corpus, repeat=3, exclude="JTWC"):
+    """Parse the whole corpus and report the throughput of the best round"""
+    n_bytes = sum(size for *_, size in corpus)
+    best = None
+    n_rows = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n_rows = 0
+        for in_file, storm, timestamp, archive, _ in corpus:
+            df = proc_tc_data(
+                in_file,
+                storm,
+                exclude=exclude,
+                timestamp=timestamp,
+                mode="local",
+                archive=archive,
+            )
+            n_rows += df.shape[0]
+        elapsed = time.perf_counter() - t0
+        best = elapsed if best is None else min(best, elapsed)
+    print(f"files: {len(corpus)}, rows: {n_rows}, best of {repeat}: {best:.3f}s")
+    print(
+        f"{len(corpus) / best:.1f} files/s, {n_rows / best:.1f} rows/s,"
+        f" {n_bytes / best / 1e6:.2f} MB/s"
+    )
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Measure the parse throughput of archived Typhoon2000 multilogs"
+    )
+    parser.add_argument(
+        "paths",
+        help="Raw archives, T2K files or directories to search",
+        nargs="*",
+        default=["output"],
+    )
+    parser.add_argument("--repeat", help="Number of rounds", type=int, default=3)
+    args = parser.parse_args()
+    corpus = find_corpus(args.paths)
+    if len(corpus) == 0:
+        print("No archived T2K multilog found, using the fixture")
+        f = FIXTURE_DIR / "CONSON.TXT"
+        corpus = [(f, "CONSON", FIXTURE_TIME, None, f.stat().st_size)]
+    run(corpus, args.repeat)
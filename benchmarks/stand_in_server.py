@@ -0,0 +1,165 @@
+import argparse
+import fnmatch
+import threading
+import time
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import ClassVar
+from urllib.parse import parse_qs, urlsplit
+
+FIXTURE_DIR = Path(__file__).resolve().parent / "fixtures"
+
+
+class StandInHandler(SimpleHTTPRequestHandler):
+    """Serve the fixtures like the sources, with injected delays and errors
+
+    RAMMB's storm.asp?storm_identifier=ID is served from ID.html. Every rule
+    is (glob of the file name, value), the first matching rule applies.
+
+    Input:
+    delays (list) -- seconds to wait before answering
+    drips (list) -- seconds to wait between the lines of the body
+    statuses (list) -- status to answer with instead of the file
+    fail_first (int) -- number of requests of each file answered with 503
+    """
+
+    # requests per file, shared by all handlers
+    counts: ClassVar[dict[str, int]] = {}
+    lock: ClassVar[threading.Lock] = threading.Lock()
+
+    def __init__(self, *args, delays=(), drips=(), statuses=(), fail_first=0, **kwargs):
+        self.delays = delays
+        self.drips = drips
+        self.statuses = statuses
+        self.fail_first = fail_first
+        super().__init__(*args, **kwargs)
+
+    @staticmethod
+    def _match(rules, name):
+        for pattern, value in rules:
+            if fnmatch.fnmatch(name, pattern):
+                return value
+        return None
+
+    def translate_path(self, path):
+        url = urlsplit(path)
+        ids = parse_qs(url.query).get("storm_identifier")
+        if ids:
+            path = f"/{ids[0]}.html"
+        return super().translate_path(path)
+
+    def _file_name(self):
+        return Path(self.translate_path(self.path)).name
+
+    def do_GET(self):
+        name = self._file_name()
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+            count = self.counts[name]
+
+        delay = self._match(self.delays, name)
+        if delay:
+            time.sleep(delay)
+        status = self._match(self.statuses, name)
+        if status is None and count <= self.fail_first:
+            status = 503
+        if status is not None:
+            self.send_error(status)
+            return
+        super().do_GET()
+
+    def copyfile(self, source, outputfile):
+        drip = self._match(self.drips, self._file_name())
+        if not drip:
+            return super().copyfile(source, outputfile)
+        for line in source:
+            outputfile.write(line)
+            outputfile.flush()
+            time.sleep(drip)
+
+
+def serve(
+    directory=FIXTURE_DIR,
+    port=0,
+    delays=(),
+    drips=(),
+    statuses=(),
+    fail_first=0,
+):
+    """Start the stand-in server in a background thread
+
+    Output:
+    server (ThreadingHTTPServer) -- the running server, its base URL is
+        f"http://127.0.0.1:{server.server_port}/", stop it with shutdown()
+    """
+    handler = partial(
+        StandInHandler,
+        directory=str(directory),
+        delays=delays,
+        drips=drips,
+        statuses=statuses,
+        fail_first=fail_first,
+    )
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def _rule(value, cast=float):
+    pattern, _, arg = value.rpartition("=")
+    return (pattern or "*", cast(arg))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stand-in for RAMMB, JTWC and Typhoon2000 serving local files",
+        epilog="Point cron_multi to it with JTWC_BASE_URL=http://127.0.0.1:PORT/, "
+        "T2K_BASE_URL=http://127.0.0.1:PORT/ and "
+        "RAMMB_BASE_URL=http://127.0.0.1:PORT/storm.asp?storm_identifier=",
+    )
+    parser.add_argument(
+        "--dir", help="Directory of the served files", default=str(FIXTURE_DIR)
+    )
+    parser.add_argument("--port", help="Port to listen on", type=int, default=8765)
+    parser.add_argument(
+        "--delay",
+        help="GLOB=SECONDS to wait before answering, can be repeated",
+        action="append",
+        type=_rule,
+        default=[],
+    )
+    parser.add_argument(
+        "--drip",
+        help="GLOB=SECONDS to wait between the lines of the body, can be repeated",
+        action="append",
+        type=_rule,
+        default=[],
+    )
+    parser.add_argument(
+        "--status",
+        help="GLOB=STATUS to answer with instead of the file, can be repeated",
+        action="append",
+        type=partial(_rule, cast=int),
+        default=[],
+    )
+    parser.add_argument(
+        "--fail-first",
+        help="Answer the first N requests of each file with 503",
+        type=int,
+        default=0,
+    )
+    args = parser.parse_args()
+
+    server = serve(
+        args.dir, args.port, args.delay, args.drip, args.status, args.fail_first
+    )
+    print(f"Serving {args.dir} at http://127.0.0.1:{server.server_port}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
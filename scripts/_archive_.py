@@ -0,0 +1,138 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import Path
+
+import pandas as pd
+from _helper_ import LOCAL_TZ
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bulletins (
+    source TEXT NOT NULL,
+    storm TEXT NOT NULL,
+    fetch_time INTEGER NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (source, storm, fetch_time)
+) WITHOUT ROWID;
+"""
+
+
+def _to_epoch(fetch_time):
+    return int(pd.Timestamp(fetch_time).tz_localize(LOCAL_TZ).timestamp())
+
+
+def _from_epoch(value):
+    return (
+        pd.Timestamp(value, unit="s", tz="UTC").tz_convert(LOCAL_TZ).tz_localize(None)
+    )
+
+
+class RawArchive:
+    """Content-addressed store of the raw bulletins
+
+    Every bulletin is stored once, gzipped, under the SHA-256 of its text in
+    blobs/{first 2 hex digits}/{hash}.gz. A small SQLite index maps (source,
+    storm, fetch time) to the hash, so a bulletin that did not change only
+    adds an index row and finding the bulletins of a storm never scans the
+    blobs. The fetch time is the local time of the run, as given to the
+    parsers.
+
+    The index is opened for every operation, so the archive can be used from
+    several threads and processes (and pickled).
+
+    Input:
+    archive_dir (str) -- directory of the archive, created if missing
+    """
+
+    def __init__(self, archive_dir):
+        self.archive_dir = Path(archive_dir)
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        self.index_file = self.archive_dir / "index.sqlite"
+        with self._connect() as con:
+            con.executescript(SCHEMA)
+
+    def _connect(self):
+        return closing(sqlite3.connect(self.index_file, timeout=30))
+
+    def blob_path(self, sha):
+        return self.archive_dir / "blobs" / sha[:2] / f"{sha}.gz"
+
+    def put(self, source, storm, fetch_time, data):
+        """Archive a bulletin
+
+        Input:
+        source (str) -- source name, e.g. 'JTWC'
+        storm (str) -- storm key of the source, e.g. 'wp1821' or 'CONSON'
+        fetch_time (pandas.Timestamp) -- local time of the run
+        data (str) -- the raw text
+
+        Output:
+        sha (str) -- hash of the bulletin
+        """
+        raw = data.encode()
+        sha = hashlib.sha256(raw).hexdigest()
+        blob = self.blob_path(sha)
+        if not blob.exists():
+            blob.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = blob.with_name(f".{blob.name}.{os.getpid()}.tmp")
+            # mtime=0 keeps the blob identical for the same text
+            with open(tmp_file, "wb") as f:
+                f.write(gzip.compress(raw, mtime=0))
+            os.replace(tmp_file, blob)
+        with self._connect() as con, con:
+            con.execute(
+                "INSERT OR REPLACE INTO bulletins VALUES (?, ?, ?, ?)",
+                (source, storm, _to_epoch(fetch_time), sha),
+            )
+        return sha
+
+    def read(self, sha):
+        """Text of an archived bulletin"""
+        with open(self.blob_path(sha), "rb") as f:
+            return gzip.decompress(f.read()).decode()
+
+    def entries(self, source=None, storm=None):
+        """Archived bulletins, oldest first
+
+        Input:
+        source (str) -- only the bulletins of this source
+        storm (str) -- only the bulletins of this storm key
+
+        Output:
+        entries (list) -- (source, storm, fetch time, hash) of every bulletin
+        """
+        where, params = [], []
+        for col, value in (("source", source), ("storm", storm)):
+            if value is not None:
+                where.append(f"{col} = ?")
+                params.append(value)
+        sql = "SELECT source, storm, fetch_time, sha256 FROM bulletins"
+        if len(where) > 0:
+            sql += " WHERE " + " AND ".join(where)
+        with self._connect() as con:
+            rows = con.execute(sql + " ORDER BY fetch_time", params).fetchall()
+        return [(src, stm, _from_epoch(t), sha) for src, stm, t, sha in rows]
+
+    def latest(self, source, storm):
+        """Latest bulletin of a source and storm
+
+        Output:
+        entry (tuple) -- (fetch time, hash), None if there is none
+        """
+        with self._connect() as con:
+            row = con.execute(
+                "SELECT fetch_time, sha256 FROM bulletins "
+                "WHERE source = ? AND storm = ? ORDER BY fetch_time DESC LIMIT 1",
+                (source, storm),
+            ).fetchone()
+        return None if row is None else (_from_epoch(row[0]), row[1])
+
+
+def read_text(in_file, archive=None):
+    """Text of a local bulletin: a file, or the hash of an archived one"""
+    if archive is not None:
+        return archive.read(in_file)
+    with open(in_file, "r") as f:
+        return f.read()
@@ -0,0 +1,176 @@
+import warnings
+
+import numpy as np
+import pandas as pd
+from _helper_ import knots_to_cat_array
+from _interp_ import _wrap_lon, interpolate_tracks
+
+CONSENSUS_CENTER = "CONSENSUS"
+
+CONSENSUS_COLS = [
+    "Center",
+    "Date",
+    "Lat",
+    "Lon",
+    "PosType",
+    "Vmax",
+    "Cat",
+    "Members",
+    "Heading",
+    "Spread",
+    "AlongSprd",
+    "CrossSprd",
+    "VmaxSprd",
+    "VmaxMin",
+    "VmaxMax",
+    "Timestamp",
+]
+
+# length of a degree of latitude (km)
+KM_PER_DEG = 111.195
+
+
+def _wrap(d_lon):
+    return (d_lon + 180) % 360 - 180
+
+
+def _time_gradient(a, hrs, diff=None):
+    """Rate of change of each column per hour, from the neighboring rows
+
+    Central differences where both neighbors have a value, one-sided ones
+    where only one has, NaN where none has.
+
+    Input:
+    a (numpy.ndarray) -- (t, k) values at the times
+    hrs (numpy.ndarray) -- (t,) times in hours
+    diff (function) -- applied to the differences, e.g. to wrap longitudes
+
+    Output:
+    grad (numpy.ndarray) -- (t, k) rates of change
+    """
+    d = a[1:] - a[:-1]
+    if diff is not None:
+        d = diff(d)
+    d = d / np.diff(hrs)[:, None]
+    nan_row = np.full((1, a.shape[1]), np.nan)
+    prev = np.concatenate([nan_row, d])
+    next_ = np.concatenate([d, nan_row])
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        return np.nanmean(np.stack([prev, next_]), axis=0)
+
+
+def consensus_track(df, freq="1h", method="cubic", centers=None, min_members=2):
+    """Consensus of the forecasts of all centers and their spread
+
+    The forecast of every center (from its current position on) is resampled
+    to the shared time grid of interpolate_tracks, so the centers are compared
+    at the same valid times even when their bulletins are issued at different
+    times. The positions and intensities are then arranged as (time, center)
+    arrays and all statistics are computed on them at once:
+    - the consensus position and Vmax are the means of the members
+    - Spread is the mean distance of the members to the consensus
+    - AlongSprd and CrossSprd are the root mean square of the distances
+      along and across the direction of motion of the consensus (Heading),
+      i.e. the spread in timing and in track
+    - VmaxSprd is the standard deviation of Vmax, with its range (the names
+      fit the 10 characters of the Shapefile fields)
+
+    The distances are measured on the plane tangent at the consensus
+    position, which is accurate to well under a percent within the spread of
+    the forecasts.
+
+    Input:
+    df (pandas.DataFrame) -- positions with the tz-aware 'Timestamp' column,
+        one track per center
+    freq (str) -- spacing of the time grid, e.g. '1h'
+    method (str) -- interpolation of the positions, 'cubic' or 'linear'
+    centers (list) -- centers taking part, defaults to all of them
+    min_members (int) -- minimum number of centers with a forecast at a time
+
+    Output:
+    cons_df (pandas.DataFrame) -- consensus positions (center 'CONSENSUS')
+        with the spread statistics, distances in km, Vmax in kph
+    """
+    # only the current positions and forecasts are resampled
+    fcst = interpolate_tracks(df.loc[df["PosType"] != "h"], freq, method)
+    if centers:
+        fcst = fcst.loc[fcst["Center"].isin(centers)]
+    if fcst.shape[0] == 0:
+        return pd.DataFrame(columns=CONSENSUS_COLS)
+
+    wide = fcst.pivot(
+        index="Timestamp", columns="Center", values=["Lat", "Lon", "Vmax"]
+    )
+    lat = wide["Lat"].values
+    vmax = wide["Vmax"].values
+    has_pos = ~np.isnan(lat)
+    n = has_pos.sum(axis=1)
+    keep = n >= max(min_members, 1)
+    if not keep.any():
+        return pd.DataFrame(columns=CONSENSUS_COLS)
+    times = wide.index[keep]
+    lat, vmax, has_pos, n = lat[keep], vmax[keep], has_pos[keep], n[keep]
+
+    # longitudes relative to the first member, across the antimeridian
+    lon = wide["Lon"].values[keep]
+    ref = lon[np.arange(lon.shape[0]), has_pos.argmax(axis=1)]
+    d_lon = _wrap(lon - ref[:, None])
+
+    with warnings.catch_warnings():
+        # times without any Vmax
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        c_lat = np.nanmean(lat, axis=1)
+        c_lon = ref + np.nanmean(d_lon, axis=1)
+        c_vmax = np.nanmean(vmax, axis=1)
+        vmax_spread = np.nanstd(vmax, axis=1)
+        vmax_min = np.nanmin(vmax, axis=1)
+        vmax_max = np.nanmax(vmax, axis=1)
+
+    # offsets of the members from the consensus (km, east and north)
+    cos_lat = np.cos(np.radians(c_lat))
+    dx = (d_lon - (c_lon - ref)[:, None]) * cos_lat[:, None] * KM_PER_DEG
+    dy = (lat - c_lat[:, None]) * KM_PER_DEG
+
+    # direction of motion of the consensus, as the mean motion of the members
+    # (the consensus itself jumps when a member's forecast ends)
+    hrs = (times.asi8 - times.asi8[0]) / 3.6e12
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        vx = np.nanmean(_time_gradient(lon, hrs, _wrap), axis=1)
+        vx *= cos_lat * KM_PER_DEG
+        vy = np.nanmean(_time_gradient(lat, hrs), axis=1) * KM_PER_DEG
+    speed = np.hypot(vx, vy)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tx, ty = vx / speed, vy / speed
+    along = dx * tx[:, None] + dy * ty[:, None]
+    cross = dx * ty[:, None] - dy * tx[:, None]
+
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        spread = np.nanmean(np.hypot(dx, dy), axis=1)
+        along_spread = np.sqrt(np.nanmean(along**2, axis=1))
+        cross_spread = np.sqrt(np.nanmean(cross**2, axis=1))
+
+    times = times.tz_convert(df["Timestamp"].dt.tz)
+    cons_df = pd.DataFrame(
+        {
+            "Center": CONSENSUS_CENTER,
+            "Date": np.asarray(times.strftime("%b %-d %-I %P"), dtype=object),
+            "Lat": c_lat.round(3),
+            "Lon": _wrap_lon(c_lon).round(3),
+            "PosType": "f",
+            "Vmax": c_vmax.round(1),
+            "Cat": knots_to_cat_array(c_vmax / 1.852),
+            "Members": n,
+            "Heading": np.mod(np.degrees(np.arctan2(vx, vy)), 360).round(1),
+            "Spread": spread.round(1),
+            "AlongSprd": along_spread.round(1),
+            "CrossSprd": cross_spread.round(1),
+            "VmaxSprd": vmax_spread.round(1),
+            "VmaxMin": vmax_min.round(1),
+            "VmaxMax": vmax_max.round(1),
+            "Timestamp": times,
+        }
+    )
+    return cons_df[CONSENSUS_COLS]
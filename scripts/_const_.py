@@ -2,10 +2,20 @@ RAMMB_BASE_URL = (
     "https://rammb-data.cira.colostate.edu/tc_realtime/storm.asp?storm_identifier="
 )
 
+# ATCF best-track file of a storm, when RAMMB has one
+RAMMB_BDECK_URL = (
+    "https://rammb-data.cira.colostate.edu/tc_realtime/products/storms/"
+    "{tc_code}/bdeck/b{tc_code}.dat"
+)
+
+RAMMB_INDEX_URL = "https://rammb-data.cira.colostate.edu/tc_realtime/index.asp"
+
 JTWC_BASE_URL = "http://www.metoc.navy.mil/jtwc/products/"
 
 T2K_BASE_URL = "http://www.typhoon2000.ph/multi/data/"
 
+OUTPUT_FORMATS = ["shp", "gpkg", "parquet"]
+
 
 REQ_HEADER = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/93.0.4577.63 Safari/537.36"
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import random
+import time
+from pathlib import Path
+
+import pandas as pd
+import requests
+from _const_ import REQ_HEADER
+from requests.adapters import HTTPAdapter
+
+# bump when the columns returned by the parsers change, so that data cached by
+# an older version is parsed again
+CACHE_VERSION = 2
+
+# (connect, read) timeouts in s of a request without a configured fetcher
+DEFAULT_TIMEOUT = (10, 30)
+
+# statuses worth retrying, anything else is returned to the parser as is
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+
+class BudgetExceeded(requests.Timeout):
+    """The time budget of the run was used up before the request"""
+
+
+class Deadline:
+    """Time budget shared by all the requests of a run
+
+    Input:
+    seconds (float) -- time left, None for no limit
+    """
+
+    def __init__(self, seconds=None):
+        self.end = None if seconds is None else time.monotonic() + seconds
+
+    def remaining(self):
+        if self.end is None:
+            return float("inf")
+        return self.end - time.monotonic()
+
+
+class Fetcher:
+    """HTTP client with timeouts, retries and a run-wide time budget
+
+    Wraps a session (or the requests module) with the same get() interface,
+    so it can be given to the parsers and the cache in place of the session.
+    Connection errors, timeouts and the statuses in RETRY_STATUS are retried
+    after a jittered exponential backoff. No request (or wait) goes past the
+    deadline: the timeouts are cut to the time left and BudgetExceeded is
+    raised once it is used up.
+
+    Input:
+    http (requests.Session) -- session (or the requests module) to use
+    timeout (tuple) -- (connect, read) timeouts in s, the read timeout is
+        the longest wait for the next bytes of the response
+    retries (int) -- number of retries after the first attempt
+    backoff (float) -- base wait in s before a retry, doubled every attempt
+    deadline (Deadline) -- time budget of the run
+    """
+
+    def __init__(
+        self,
+        http=requests,
+        timeout=DEFAULT_TIMEOUT,
+        retries=2,
+        backoff=1.0,
+        deadline=None,
+    ):
+        self.http = http
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.deadline = Deadline() if deadline is None else deadline
+
+    def _wait(self, attempt):
+        delay = random.uniform(0, self.backoff * 2**attempt)
+        time.sleep(max(0, min(delay, self.deadline.remaining())))
+
+    def get(self, url, **kwargs):
+        for attempt in range(self.retries + 1):
+            remaining = self.deadline.remaining()
+            if remaining <= 0:
+                raise BudgetExceeded(f"Time budget exceeded before getting {url}")
+            timeout = tuple(min(t, remaining) for t in self.timeout)
+            try:
+                r = self.http.get(url, timeout=timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.retries:
+                    raise
+            else:
+                if r.status_code not in RETRY_STATUS or attempt == self.retries:
+                    return r
+            self._wait(attempt)
+
+
+def make_session(pool_size=4):
+    """Create an HTTP session with a keep-alive connection pool
+
+    The session is shared by the parsers so that all sources reuse the same
+    pooled connections (and proxy tunnels) within a run.
+
+    Input:
+    pool_size (int) -- number of connections kept alive per host
+
+    Output:
+    session (requests.Session) -- the pooled session
+    """
+    session = requests.Session()
+    session.headers.update(REQ_HEADER)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HttpCache:
+    """Persistent conditional-GET cache keyed by URL
+
+    For every URL the cache keeps the ETag/Last-Modified validators, the hash
+    of the body and the DataFrame parsed from it. A document is unchanged when
+    the server answers 304 or sends back a body with the same hash.
+
+    The entries of changed documents are only written by commit(), once the
+    run has made its products from them. A run that fails after the download
+    leaves the cache as it was, so the next run sees the changes again.
+
+    Input:
+    cache_dir (str) -- directory where the cache entries are stored
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.changed = set()
+        self._pending = {}
+        self._parsed = {}
+
+    def _paths(self, url):
+        key = hashlib.sha1(url.encode()).hexdigest()
+        return self.cache_dir / f"{key}.json", self.cache_dir / f"{key}.pkl"
+
+    def _load_meta(self, url):
+        meta_file, data_file = self._paths(url)
+        if not (meta_file.exists() and data_file.exists()):
+            return None
+        with open(meta_file, "r") as f:
+            meta = json.load(f)
+        if meta.get("version") != CACHE_VERSION:
+            return None
+        return meta
+
+    def _write_meta(self, url, meta):
+        with open(self._paths(url)[0], "w") as f:
+            json.dump(meta, f)
+
+    def get(self, url, http=requests, headers=REQ_HEADER):
+        """Download the URL unless it did not change since the last run
+
+        Input:
+        url (str) -- download url
+        http (requests.Session) -- session (or the requests module) to use
+        headers (dict) -- request headers
+
+        Output:
+        r (requests.Response) -- the response
+        parsed (pandas.DataFrame) -- data parsed in a previous run if the
+            document is unchanged, None otherwise
+        """
+        meta = self._load_meta(url)
+        req_headers = dict(headers)
+        if meta is not None:
+            if meta.get("etag"):
+                req_headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                req_headers["If-Modified-Since"] = meta["last_modified"]
+
+        r = http.get(url, headers=req_headers)
+        if meta is not None and r.status_code == 304:
+            return r, pd.read_pickle(self._paths(url)[1])
+        if r.status_code != 200:
+            return r, None
+
+        new_meta = {
+            "etag": r.headers.get("ETag"),
+            "last_modified": r.headers.get("Last-Modified"),
+            "sha256": hashlib.sha256(r.content).hexdigest(),
+            "version": CACHE_VERSION,
+        }
+        if meta is not None and meta["sha256"] == new_meta["sha256"]:
+            self._write_meta(url, new_meta)
+            return r, pd.read_pickle(self._paths(url)[1])
+
+        self._pending[url] = new_meta
+        self.changed.add(url)
+        return r, None
+
+    def store(self, url, df):
+        """Keep the DataFrame parsed from the latest download of the URL, to
+        be saved by commit()"""
+        meta = self._pending.pop(url, None)
+        if meta is None or not isinstance(df, pd.DataFrame):
+            return
+        self._parsed[url] = (meta, df)
+
+    def commit(self):
+        """Save the entries of the documents parsed by the run"""
+        for url, (meta, df) in self._parsed.items():
+            df.to_pickle(self._paths(url)[1])
+            self._write_meta(url, meta)
+        self._parsed = {}
+
+
+def download(url, session=None, cache=None):
+    """Download the URL, going through the cache if one is given
+
+    Input:
+    url (str) -- download url
+    session (requests.Session) -- session (or Fetcher) to use, defaults to a
+        plain request with DEFAULT_TIMEOUT
+    cache (HttpCache) -- conditional-GET cache
+
+    Output:
+    r (requests.Response) -- the response
+    parsed (pandas.DataFrame) -- cached data if the document is unchanged
+    """
+    http = Fetcher(retries=0) if session is None else session
+    if cache is None:
+        return http.get(url, headers=REQ_HEADER), None
+    return cache.get(url, http, headers=REQ_HEADER)
@@ -1,5 +1,22 @@
 import re
 
+import numpy as np
+import pandas as pd
+
+# upper bounds (inclusive, in knots) of the TC categories
+CAT_BINS = np.array([33, 63, 82, 95, 112, 136])
+CAT_LABELS = np.array(["TD", "TS", "1", "2", "3", "4", "5"], dtype=object)
+
+# time zone of the 'Date' and 'Timestamp' columns
+LOCAL_TZ = "Asia/Manila"
+
+# wind speeds (in knots) of the wind radii
+WIND_RADII = [34, 50, 64]
+
+QUADRANTS = {"NORTHEAST": "NE", "SOUTHEAST": "SE", "SOUTHWEST": "SW", "NORTHWEST": "NW"}
+
+QUADRANT_COLS = [f"R{wrad}_{q}" for wrad in WIND_RADII for q in QUADRANTS.values()]
+
 
 def knots_to_cat(wind_speed):
     """Converts wind speed in knots to equivalent tropical cyclone category
@@ -70,6 +87,102 @@ def vmax_10min_to_1min(wind_speed_10):
     return wind_speed_10 * 1.14
 
 
+def _as_float_array(values):
+    return np.asarray(values, dtype=float)
+
+
+def _like(res, values):
+    """Wrap the result in a Series if the input was a Series"""
+    if isinstance(values, pd.Series):
+        return pd.Series(res, index=values.index, name=values.name)
+    return res
+
+
+def knots_to_cat_array(wind_speed):
+    """Vectorized version of knots_to_cat
+
+    Input:
+    wind_speed (array-like) -- wind speeds in knots
+
+    Output:
+    cat (numpy.ndarray or pandas.Series) -- TC categories
+    """
+    ws = _as_float_array(wind_speed)
+    cat = CAT_LABELS[np.searchsorted(CAT_BINS, ws, side="left")]
+    cat[~(ws >= 15)] = ""
+    return _like(cat, wind_speed)
+
+
+def knots_to_kph_array(wind_speed):
+    """Vectorized version of knots_to_kph
+
+    Input:
+    wind_speed (array-like) -- wind speeds in knots
+
+    Output:
+    kph (numpy.ndarray or pandas.Series) -- wind speeds in kph
+    """
+    return _like(_as_float_array(wind_speed) * 1.852, wind_speed)
+
+
+def nm_to_km_array(dist):
+    """Vectorized version of nm_to_km, missing distances become NaN
+
+    Input:
+    dist (array-like) -- distances in nm
+
+    Output:
+    km (numpy.ndarray or pandas.Series) -- distances in km
+    """
+    return _like(_as_float_array(dist) * 1.852, dist)
+
+
+def vmax_10min_to_1min_array(wind_speed_10):
+    """Vectorized version of vmax_10min_to_1min
+
+    Input:
+    wind_speed_10 (array-like) -- 10-min average winds
+
+    Output:
+    wind_speed_1 (numpy.ndarray or pandas.Series) -- 1-min average winds
+    """
+    return _like(_as_float_array(wind_speed_10) * 1.14, wind_speed_10)
+
+
+def read_timestamps(df, ref_time=None):
+    """Get the tz-aware times of the positions of a CSV
+
+    CSVs written before the 'Timestamp' column was added only have the
+    year-less 'Date' strings. Their year is taken to be the one that puts the
+    date closest to the reference time, so 'Dec 31 8 pm' read on January 1
+    falls in the previous year.
+
+    Input:
+    df (pandas.DataFrame) -- positions read from a CSV
+    ref_time (pandas.Timestamp) -- time the CSV was written, local time if
+        naive. Defaults to now.
+
+    Output:
+    ts (pandas.Series) -- times of the positions in LOCAL_TZ
+    """
+    if "Timestamp" in df.columns:
+        return pd.to_datetime(df["Timestamp"], utc=True).dt.tz_convert(LOCAL_TZ)
+
+    ref_time = pd.Timestamp.now(LOCAL_TZ) if ref_time is None else ref_time
+    ref_time = pd.Timestamp(ref_time)
+    if ref_time.tzinfo is None:
+        ref_time = ref_time.tz_localize(LOCAL_TZ)
+    ts = pd.to_datetime(
+        f"{ref_time.year} " + df["Date"].astype(str),
+        format="%Y %b %d %I %p",
+        errors="coerce",
+    ).dt.tz_localize(LOCAL_TZ)
+    half_year = pd.Timedelta(days=183)
+    ts = ts.where(ts - ref_time <= half_year, ts - pd.DateOffset(years=1))
+    ts = ts.where(ts - ref_time >= -half_year, ts + pd.DateOffset(years=1))
+    return ts
+
+
 def parse_lat(str):
     """Extract latitude information from the string
 
@@ -0,0 +1,185 @@
+import numpy as np
+import pandas as pd
+from _helper_ import QUADRANT_COLS, WIND_RADII, knots_to_cat_array
+
+# interpolated linearly, wind radii only where both fixes have them
+VALUE_COLS = ["Vmax", *[f"R{wrad}" for wrad in WIND_RADII], *QUADRANT_COLS]
+
+# of the rows of a center with the same time, the first of this order is kept
+POS_TYPE_ORDER = {"c": 0, "h": 1, "f": 2}
+
+INTERP_METHODS = ["linear", "cubic"]
+
+
+def _hermite_slopes(t, y, same_prev, same_next):
+    """Slopes of the track at the fixes, averaged over the adjacent segments
+
+    Input:
+    t (numpy.ndarray) -- (n,) times of the fixes in hours
+    y (numpy.ndarray) -- (n, k) values at the fixes
+    same_prev, same_next (numpy.ndarray) -- (n,) whether the previous/next fix
+        belongs to the same center
+
+    Output:
+    m (numpy.ndarray) -- (n, k) slopes per hour
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        secant = np.diff(y, axis=0) / np.diff(t)[:, None]
+    prev = np.concatenate([np.zeros_like(y[:1]), secant])
+    next_ = np.concatenate([secant, np.zeros_like(y[:1])])
+    m = np.where(
+        (same_prev & same_next)[:, None],
+        (prev + next_) / 2,
+        np.where(same_prev[:, None], prev, np.where(same_next[:, None], next_, 0)),
+    )
+    return m
+
+
+def _wrap_lon(lon):
+    """Longitudes unwrapped past the antimeridian back within -180..180"""
+    return np.where(lon > 180, lon - 360, np.where(lon < -180, lon + 360, lon))
+
+
+def interpolate_tracks(df, freq="1h", method="cubic", max_gap=48):
+    """Resample the track of every center onto a shared time grid
+
+    All centers are interpolated in a single vectorized pass: the fixes are
+    sorted by center and time, every grid time is located between two fixes
+    of its center with one search, and all columns are interpolated at once.
+    The grid is aligned to multiples of freq, so all centers have points at
+    the same times. Each center only gets the grid times between its first
+    and last fix.
+
+    The positions follow a cubic Hermite curve through the fixes with 'cubic'
+    (the slope at a fix is the mean of the adjacent segments), or straight
+    segments with 'linear'. Vmax and the wind radii are always interpolated
+    linearly, and the radii only between fixes that both have them.
+
+    Input:
+    df (pandas.DataFrame) -- positions with the tz-aware 'Timestamp' column,
+        one track per center (history, current position and forecast)
+    freq (str) -- spacing of the grid, e.g. '1h' or '30min'
+    method (str) -- interpolation of the positions, 'cubic' or 'linear'
+    max_gap (float) -- hours between two fixes above which no points are
+        interpolated between them
+
+    Output:
+    out_df (pandas.DataFrame) -- positions on the grid with the columns of
+        the input (the category follows the interpolated Vmax) and 'Fix',
+        1 where the grid time is a fix of the center
+    """
+    if method not in INTERP_METHODS:
+        raise ValueError(f"'method' should be one of {INTERP_METHODS}")
+    value_cols = ["Vmax", *[c for c in VALUE_COLS[1:] if c in df.columns]]
+    out_cols = ["Center", "Date", "Lat", "Lon", "PosType", "Vmax", "Cat"]
+    out_cols += [*value_cols[1:], "Fix", "Timestamp"]
+
+    fixes = df.dropna(subset=["Timestamp", "Lat", "Lon"])
+    fixes = fixes.assign(_order=fixes["PosType"].map(POS_TYPE_ORDER).fillna(3))
+    fixes = fixes.sort_values(["Center", "Timestamp", "_order"], kind="stable")
+    fixes = fixes.drop_duplicates(["Center", "Timestamp"])
+    if fixes.shape[0] == 0:
+        return pd.DataFrame(columns=out_cols)
+
+    tz = fixes["Timestamp"].dt.tz
+    step = pd.Timedelta(freq).value
+    code, centers = pd.factorize(fixes["Center"], sort=True)
+    t_ns = fixes["Timestamp"].dt.tz_convert("UTC").astype("int64").values
+    t0 = t_ns.min() // step * step
+    t = (t_ns - t0) / 3.6e12
+    n_fix = t.size
+
+    # grid times of each center, between its first and last fix
+    bounds = np.flatnonzero(np.diff(code)) + 1
+    first = np.r_[0, bounds]
+    last = np.r_[bounds - 1, n_fix - 1]
+    k0 = -(-(t_ns[first] - t0) // step)
+    k1 = (t_ns[last] - t0) // step
+    counts = np.maximum(k1 - k0 + 1, 0)
+    g_center = np.repeat(np.arange(first.size), counts)
+    g_k = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    g_k += np.repeat(k0, counts)
+    g_ns = t0 + g_k * step
+    g_t = (g_ns - t0) / 3.6e12
+
+    # left fix of every grid time, within its center
+    span = t_ns.max() - t0 + 1
+    fix_key = code * span + (t_ns - t0)
+    g_key = g_center * span + (g_ns - t0)
+    left = np.searchsorted(fix_key, g_key, side="right") - 1
+    at_end = left == last[g_center]
+    right = np.where(at_end, left, left + 1)
+    h = t[right] - t[left]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        w = np.where(h > 0, (g_t - t[left]) / h, 0.0)
+    is_fix = w == 0
+    keep = is_fix | (h <= max_gap)
+    left, right, h, w, is_fix = left[keep], right[keep], h[keep], w[keep], is_fix[keep]
+    g_center, g_ns = g_center[keep], g_ns[keep]
+
+    # longitudes are unwrapped along each track, so that a track crossing the
+    # antimeridian is not interpolated the long way around
+    lon = fixes["Lon"].values.astype(float)
+    d_lon = np.diff(lon, prepend=lon[:1])
+    d_lon[first] = 0
+    d_lon -= 360 * np.round(d_lon / 360)
+    cum_lon = np.cumsum(d_lon)
+    lon = lon[first[code]] + cum_lon - cum_lon[first[code]]
+    pos = np.column_stack([fixes["Lat"].values.astype(float), lon])
+
+    if method == "cubic":
+        same_next = np.r_[code[1:] == code[:-1], False]
+        same_prev = np.r_[False, code[1:] == code[:-1]]
+        m = _hermite_slopes(t, pos, same_prev, same_next)
+        s = w[:, None]
+        h00 = 2 * s**3 - 3 * s**2 + 1
+        h10 = s**3 - 2 * s**2 + s
+        h01 = -2 * s**3 + 3 * s**2
+        h11 = s**3 - s**2
+        hh = h[:, None]
+        g_pos = (
+            h00 * pos[left]
+            + h10 * hh * m[left]
+            + h01 * pos[right]
+            + h11 * hh * m[right]
+        )
+    else:
+        g_pos = pos[left] + w[:, None] * (pos[right] - pos[left])
+    g_pos[is_fix] = pos[left[is_fix]]
+
+    values = fixes[value_cols].values.astype(float)
+    g_values = values[left] + w[:, None] * (values[right] - values[left])
+    g_values[is_fix] = values[left[is_fix]]
+
+    # the position type follows the current position of the center
+    pos_type = fixes["PosType"].values
+    cur_ns = np.full(first.size, np.iinfo("int64").max)
+    is_cur = pos_type == "c"
+    cur_ns[code[is_cur]] = t_ns[is_cur]
+    g_cur = cur_ns[g_center]
+    has_cur = g_cur != np.iinfo("int64").max
+    g_type = np.where(g_ns < g_cur, "h", np.where(g_ns == g_cur, "c", "f")).astype(
+        object
+    )
+    # without a current position, the type of the left fix is kept
+    g_type[~has_cur] = pos_type[left[~has_cur]]
+
+    # the centers share the grid times, each is only formatted once
+    grid_ns, g_time = np.unique(g_ns, return_inverse=True)
+    grid = pd.to_datetime(grid_ns, utc=True).tz_convert(tz)
+    timestamp = grid[g_time]
+    out_df = pd.DataFrame(
+        {
+            "Center": centers[g_center],
+            "Date": np.asarray(grid.strftime("%b %-d %-I %P"), dtype=object)[g_time],
+            "Lat": g_pos[:, 0].round(3),
+            "Lon": _wrap_lon(g_pos[:, 1]).round(3),
+            "PosType": g_type,
+        }
+    )
+    for i, col in enumerate(value_cols):
+        out_df[col] = g_values[:, i].round(1)
+    out_df["Cat"] = knots_to_cat_array(out_df["Vmax"].values / 1.852)
+    out_df["Fix"] = is_fix.astype(int)
+    out_df["Timestamp"] = timestamp
+    return out_df[out_cols]
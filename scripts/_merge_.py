@@ -0,0 +1,62 @@
+import pandas as pd
+
+# a position is identified by its center, valid time and type
+KEY = ["Center", "Timestamp", "PosType"]
+
+
+def merge_positions(history, sources):
+    """Combine the track history with the positions of the sources
+
+    All records are indexed by (Center, Timestamp, PosType) and resolved in a
+    single pass, with later sources taking precedence:
+    - a center has a single current position, that of the latest source
+      reporting one, the older ones become part of the history
+    - the current position of a center replaces the older rows (history,
+      or the current position of an earlier source) with the same time
+    - of the rows with the same key, only the one from the latest source is
+      kept
+
+    Input:
+    history (pandas.DataFrame) -- track history, with the 'Timestamp' column
+    sources (list) -- DataFrames of the sources in order of precedence,
+        entries that are not DataFrames (failed sources) are skipped
+
+    Output:
+    out_df (pandas.DataFrame) -- merged positions, in the order of the input
+    counts (dict) -- number of rows 'inserted' from the sources, 'replaced'
+        by a newer current position and 'dropped' as duplicates
+    """
+    parts = [
+        df.assign(_rank=rank)
+        for rank, df in enumerate([history, *sources])
+        if isinstance(df, pd.DataFrame) and df.shape[0] > 0
+    ]
+    if len(parts) == 0:
+        return history.copy(), {"inserted": 0, "replaced": 0, "dropped": 0}
+    all_df = pd.concat(parts, ignore_index=True)
+
+    # e.g. the last fix of RAMMB's track history is JTWC's current position
+    is_current = all_df["PosType"] == "c"
+    latest = all_df.loc[is_current].groupby("Center")["_rank"].max()
+    stale = is_current & (all_df["_rank"] < all_df["Center"].map(latest))
+    all_df.loc[stale, "PosType"] = "h"
+
+    # rank of the newest source reporting a center's current position at a time
+    current = (
+        all_df.loc[all_df["PosType"] == "c"]
+        .groupby(["Center", "Timestamp"])["_rank"]
+        .max()
+        .rename("_current_rank")
+    )
+    all_df = all_df.join(current, on=["Center", "Timestamp"])
+
+    replaced = all_df["_rank"] < all_df["_current_rank"]
+    dropped = all_df.duplicated(KEY, keep="last") & ~replaced
+    keep = ~(replaced | dropped)
+    counts = {
+        "inserted": int((keep & (all_df["_rank"] > 0)).sum()),
+        "replaced": int(replaced.sum()),
+        "dropped": int(dropped.sum()),
+    }
+    out_df = all_df.loc[keep].drop(columns=["_rank", "_current_rank"])
+    return out_df.reset_index(drop=True), counts
@@ -0,0 +1,107 @@
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+PREFIX = "tc_multilog_"
+
+# metric -> help text of the Prometheus textfile
+METRICS = {
+    "run_seconds": "Duration of the run of a storm",
+    "stage_seconds": "Duration of a stage of the run",
+    "download_seconds": "Time to download a source",
+    "download_bytes": "Size of the downloaded source",
+    "parse_seconds": "Time to parse a source",
+    "fallbacks": "Sources taken from their last raw copy",
+    "rows": "Number of merged positions of a center",
+    "merge_rows": "Number of rows inserted, replaced or dropped by the merge",
+    "layer_step_seconds": "Time to generate the GIS layers of a step",
+    "layer_write_seconds": "Time to write a GIS layer",
+    "zip_seconds": "Time to zip the GIS layers",
+    "publish_seconds": "Time to publish the GIS layers",
+    "consensus_seconds": "Time to compute the consensus of the forecasts",
+    "exposure_seconds": "Time to find the locations exposed to the storm",
+    "csv_seconds": "Time to save the CSV",
+    "last_run_timestamp_seconds": "Time of the last run",
+}
+
+
+class Metrics:
+    """Measurements of a run
+
+    Every record is a metric, its labels and a value. The labels given when
+    creating the collector (e.g. the storm) are added to all records.
+    """
+
+    def __init__(self, **labels):
+        self.labels = labels
+        self.records = []
+
+    def add(self, metric, value, **labels):
+        self.records.append(
+            {"metric": metric, "labels": {**self.labels, **labels}, "value": value}
+        )
+
+    @contextmanager
+    def timer(self, metric, **labels):
+        """Record the time spent in the with block"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(metric, time.perf_counter() - t0, **labels)
+
+    def total(self, metric, **labels):
+        """Sum of the values of the records of a metric matching the labels"""
+        return sum(
+            r["value"]
+            for r in self.records
+            if r["metric"] == metric
+            and all(r["labels"].get(k) == v for k, v in labels.items())
+        )
+
+
+def write_jsonl(records, out_file, run_time):
+    """Append the records to a JSON lines file, one record per line"""
+    out_file = Path(out_file)
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_file, "a") as f:
+        f.writelines(
+            json.dumps({"time": run_time.isoformat(), **r}) + "\n" for r in records
+        )
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def write_prom(records, out_file):
+    """Write the records for the Prometheus node exporter textfile collector
+
+    Records of the same metric and labels are summed. The file is written next
+    to the target and renamed, so the collector never reads a partial file.
+    """
+    samples = {}
+    for r in records:
+        key = (r["metric"], tuple(sorted(r["labels"].items())))
+        samples[key] = samples.get(key, 0) + r["value"]
+
+    lines = []
+    for metric in dict.fromkeys(metric for metric, _ in samples):
+        name = PREFIX + metric
+        lines.append(f"# HELP {name} {METRICS.get(metric, metric)}")
+        lines.append(f"# TYPE {name} gauge")
+        for (m, labels), value in samples.items():
+            if m == metric:
+                pairs = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                lines.append(
+                    f"{name}{{{pairs}}} {value}" if pairs else f"{name} {value}"
+                )
+
+    out_file = Path(out_file)
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = out_file.parent / f".{out_file.name}.tmp"
+    with open(tmp_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_file, out_file)
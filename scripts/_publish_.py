@@ -0,0 +1,200 @@
+import os
+import re
+import shutil
+import threading
+import time
+import zipfile
+from pathlib import Path, PurePosixPath
+
+# directory of the published runs, inside the publish directory
+RELEASE_DIR = ".releases"
+
+
+class ZipStream:
+    """Zip of the layers, filled while they are written
+
+    Every layer is added once it is written, while the other layers are
+    still being generated, instead of reading all files again once they are
+    done. The members are written in the order the layers are added, which
+    make_shp keeps the same as in its sequential mode. The zip is written next
+    to the target and renamed when it is complete, so a failed run never
+    leaves a partial zip behind. Layers can be added from several threads.
+    The time spent zipping is kept in 'seconds'.
+
+    Input:
+    out_file (pathlib.Path) -- the zip file
+    """
+
+    def __init__(self, out_file):
+        self.out_file = Path(out_file)
+        self.out_file.parent.mkdir(parents=True, exist_ok=True)
+        self.tmp_file = self.out_file.with_name(f".{self.out_file.name}.tmp")
+        self.zf = zipfile.ZipFile(self.tmp_file, "w", zipfile.ZIP_DEFLATED)
+        self.lock = threading.Lock()
+        self.dirs = set()
+        self.seconds = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        t0 = time.perf_counter()
+        self.zf.close()
+        self.seconds += time.perf_counter() - t0
+        if exc_type is None:
+            os.replace(self.tmp_file, self.out_file)
+        else:
+            self.tmp_file.unlink(missing_ok=True)
+
+    def add(self, root, name):
+        """Add a file or a directory of the root, with its parent directories
+
+        Input:
+        root (pathlib.Path) -- directory the names in the zip are relative to
+        name (str) -- the file or directory, e.g. 'track_bnds/line1'
+        """
+        root = Path(root)
+        with self.lock:
+            t0 = time.perf_counter()
+            parts = PurePosixPath(name).parts
+            for i in range(1, len(parts)):
+                self._add_dir(root, "/".join(parts[:i]))
+            path = root / name
+            if not path.is_dir():
+                self.zf.write(path, name)
+            else:
+                self._add_dir(root, name)
+                for sub_path in sorted(path.rglob("*")):
+                    arcname = sub_path.relative_to(root).as_posix()
+                    if sub_path.is_dir():
+                        self._add_dir(root, arcname)
+                    else:
+                        self.zf.write(sub_path, arcname)
+            self.seconds += time.perf_counter() - t0
+
+    def _add_dir(self, root, name):
+        if name not in self.dirs:
+            self.dirs.add(name)
+            self.zf.write(root / name, name)
+
+
+def _link_tree(src, dst):
+    """Hardlink a file or a directory tree, copying what cannot be linked"""
+    if src.is_dir():
+        dst.mkdir()
+        for sub_src in src.iterdir():
+            _link_tree(sub_src, dst / sub_src.name)
+        return
+    try:
+        os.link(src, dst)
+    except OSError:
+        # e.g. the publish directory is on another file system
+        shutil.copy2(src, dst)
+
+
+def _swap_link(link, target):
+    """Point a symbolic link to the target in a single rename
+
+    A file or directory in place of the link, e.g. left by the copies of the
+    earlier versions, is moved aside to {name}.orig once, never deleted.
+    """
+    if link.is_symlink() and os.readlink(link) == str(target):
+        return
+    if link.exists() and not link.is_symlink():
+        aside = link.with_name(f"{link.name}.orig")
+        if aside.exists() or aside.is_symlink():
+            raise FileExistsError(
+                f"{link} is not a link and {aside} already exists, move one of "
+                "them out of the way"
+            )
+        link.rename(aside)
+        print(f"Moved {link} to {aside}, {link.name} is now a link")
+    tmp_link = link.with_name(f".{link.name}.tmp")
+    tmp_link.unlink(missing_ok=True)
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link)
+
+
+def _run_number(release):
+    return int(release.suffix[1:] or 0)
+
+
+def releases(publish_dir, storm):
+    """Published runs of a storm, oldest first"""
+    pattern = re.compile(rf"{re.escape(storm)}_\d{{10}}(\.\d+)?")
+    release_dir = Path(publish_dir) / RELEASE_DIR
+    if not release_dir.is_dir():
+        return []
+    return sorted(
+        (p for p in release_dir.iterdir() if pattern.fullmatch(p.name)),
+        key=lambda p: (p.stem, _run_number(p)),
+    )
+
+
+def publish(src, publish_dir, storm, run_id, link_entries=False, keep=24):
+    """Publish the products of a run without copying them
+
+    The products are hardlinked into a new run directory, .releases/{storm}_
+    {run_id}, which only takes the space of the directory entries. The link
+    {storm} then switches to it with a single rename, so readers (e.g. QGIS)
+    see either the previous run or the new one, never a partial copy. The
+    writers never change a file in place, so the published files do not
+    change when the next run writes its products.
+
+    With link_entries, every product also gets a link in the publish
+    directory itself, e.g. track_pts -> {storm}/track_pts, the layout of the
+    copies of the earlier versions. These links do not change between runs.
+
+    Input:
+    src (pathlib.Path) -- directory of the products (its content is
+        published), or a single file
+    publish_dir (pathlib.Path) -- the publish directory, e.g. QGIS_DATA_DIR
+    storm (str) -- storm name
+    run_id (str) -- run time as YYYYmmddHH
+    link_entries (bool) -- also link the products in the publish directory
+    keep (int) -- number of published runs of the storm to keep, 0 to keep
+        all of them
+
+    Output:
+    release (pathlib.Path) -- directory of the published run
+    """
+    src, publish_dir = Path(src), Path(publish_dir)
+    release_dir = publish_dir / RELEASE_DIR
+    release_dir.mkdir(parents=True, exist_ok=True)
+
+    stage = release_dir / f".{storm}_{run_id}.tmp"
+    if stage.exists():
+        shutil.rmtree(stage)
+    stage.mkdir()
+    for sub_src in sorted(src.iterdir()) if src.is_dir() else [src]:
+        _link_tree(sub_src, stage / sub_src.name)
+
+    # a run repeated in the same hour gets a new directory, numbered after the
+    # latest one, as the published one may still be read
+    same_run = [
+        p for p in releases(publish_dir, storm) if p.stem == f"{storm}_{run_id}"
+    ]
+    release = release_dir / f"{storm}_{run_id}"
+    if len(same_run) > 0:
+        release = release_dir / f"{storm}_{run_id}.{_run_number(same_run[-1]) + 1}"
+    stage.rename(release)
+
+    _swap_link(publish_dir / storm, Path(RELEASE_DIR) / release.name)
+
+    if link_entries:
+        for entry in sorted(release.iterdir()):
+            _swap_link(publish_dir / entry.name, Path(storm) / entry.name)
+        # products of the earlier runs that the new run does not have
+        for link in publish_dir.iterdir():
+            if (
+                link.is_symlink()
+                and Path(os.readlink(link)).parts[0] == storm
+                and not link.exists()
+            ):
+                link.unlink()
+
+    if keep > 0:
+        for old in releases(publish_dir, storm)[:-keep]:
+            if old != release:
+                shutil.rmtree(old)
+    return release
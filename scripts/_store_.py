@@ -0,0 +1,208 @@
+import sqlite3
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from _helper_ import LOCAL_TZ, QUADRANT_COLS
+
+RADII_COLS = ["R34", "R50", "R64", *QUADRANT_COLS]
+
+# columns of the positions -> columns of the fixes table
+FIX_COLS = {
+    "Center": "center",
+    "PosType": "pos_type",
+    "Lat": "lat",
+    "Lon": "lon",
+    "Vmax": "vmax",
+    "Cat": "cat",
+    **{col: col.lower() for col in RADII_COLS},
+}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS fixes (
+    storm TEXT NOT NULL,
+    center TEXT NOT NULL,
+    valid_time INTEGER NOT NULL,
+    bulletin_time INTEGER NOT NULL,
+    pos_type TEXT NOT NULL,
+    lat REAL,
+    lon REAL,
+    vmax REAL,
+    cat TEXT,
+    {", ".join(f"{col.lower()} REAL" for col in RADII_COLS)},
+    PRIMARY KEY (storm, center, valid_time, bulletin_time)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS analyses
+    ON fixes (storm, center, valid_time, bulletin_time)
+    WHERE pos_type != 'f';
+"""
+
+
+def _to_epoch(ts):
+    return pd.to_datetime(ts, utc=True).astype("datetime64[s, UTC]").astype("int64")
+
+
+def _from_epoch(values):
+    return pd.to_datetime(values, unit="s", utc=True).dt.tz_convert(LOCAL_TZ)
+
+
+class TrackStore:
+    """Persistent store of the positions reported by every center
+
+    A fix is keyed by (storm, center, valid time, bulletin time). The bulletin
+    time of a center is the valid time of its current position, so storing
+    the same bulletin again replaces its rows instead of adding new ones,
+    while a new bulletin keeps the previous ones. Analyses (current and past
+    positions) have their own index, which makes the latest analysis of a
+    center a single index lookup.
+
+    Input:
+    db_file (str) -- path of the SQLite database, created if missing, or
+        ':memory:' for a temporary store
+    """
+
+    def __init__(self, db_file):
+        self.db_file = Path(db_file)
+        self.db_file.parent.mkdir(parents=True, exist_ok=True)
+        self.con = sqlite3.connect(self.db_file)
+        self.con.executescript(SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def close(self):
+        self.con.close()
+
+    def save(self, db_file):
+        """Copy the store into another database file, replacing its content"""
+        db_file = Path(db_file)
+        db_file.parent.mkdir(parents=True, exist_ok=True)
+        dst = sqlite3.connect(db_file)
+        try:
+            self.con.backup(dst)
+        finally:
+            dst.close()
+
+    def has_fixes(self, storm):
+        cur = self.con.execute("SELECT 1 FROM fixes WHERE storm = ? LIMIT 1", (storm,))
+        return cur.fetchone() is not None
+
+    def upsert(self, storm, df, bulletin_time=None):
+        """Add the positions of a run, replacing those of the same bulletin
+
+        Input:
+        storm (str) -- storm id, e.g. 'wp182021'
+        df (pandas.DataFrame) -- positions with the 'Timestamp' column, of the
+            rows with the same key the last one is kept
+        bulletin_time (pandas.Timestamp) -- bulletin time of the centers
+            without a current position. Defaults to now.
+
+        Output:
+        n (int) -- number of rows written
+        """
+        df = df.loc[df["Timestamp"].notna()]
+        if df.shape[0] == 0:
+            return 0
+        if bulletin_time is None:
+            bulletin_time = pd.Timestamp.now(LOCAL_TZ)
+
+        valid = _to_epoch(df["Timestamp"])
+        is_current = (df["PosType"] == "c").values
+        bulletin = (
+            pd.Series(np.where(is_current, valid, np.nan), index=df.index)
+            .groupby(df["Center"])
+            .transform("max")
+            .fillna(_to_epoch(pd.Series([bulletin_time])).iloc[0])
+            .astype("int64")
+        )
+
+        cols = [col for col in FIX_COLS if col in df.columns]
+        data = df[cols].astype(object).where(df[cols].notna(), None)
+        data.insert(0, "storm", storm)
+        data.insert(2, "valid_time", valid.values)
+        data.insert(3, "bulletin_time", bulletin.values)
+        names = ["storm", FIX_COLS[cols[0]], "valid_time", "bulletin_time"] + [
+            FIX_COLS[col] for col in cols[1:]
+        ]
+        with self.con:
+            self.con.executemany(
+                f"INSERT OR REPLACE INTO fixes ({', '.join(names)}) "
+                f"VALUES ({', '.join('?' * len(names))})",
+                data.itertuples(index=False, name=None),
+            )
+        return data.shape[0]
+
+    def history(self, storm):
+        """Track history of every center
+
+        For every center and valid time, the analysis of the latest bulletin.
+
+        Input:
+        storm (str) -- storm id
+
+        Output:
+        df (pandas.DataFrame) -- positions as 'h', sorted by center and time
+        """
+        df = pd.read_sql_query(
+            "SELECT center, valid_time, lat, lon, vmax, cat, MAX(bulletin_time) "
+            "FROM fixes WHERE storm = ? AND pos_type != 'f' "
+            "GROUP BY center, valid_time ORDER BY center, valid_time",
+            self.con,
+            params=(storm,),
+        )
+        return self._to_positions(df, "h")
+
+    def latest(self, storm, center=None):
+        """Latest analysis of every center (or of a single center)
+
+        Input:
+        storm (str) -- storm id
+        center (str) -- center name, defaults to all centers
+
+        Output:
+        df (pandas.DataFrame) -- one position per center as 'c'
+        """
+        if center is None:
+            centers = [
+                row[0]
+                for row in self.con.execute(
+                    "SELECT DISTINCT center FROM fixes "
+                    "WHERE storm = ? AND pos_type != 'f'",
+                    (storm,),
+                )
+            ]
+        else:
+            centers = [center]
+        rows = []
+        for c in centers:
+            rows += self.con.execute(
+                "SELECT center, valid_time, lat, lon, vmax, cat, bulletin_time "
+                "FROM fixes INDEXED BY analyses "
+                "WHERE storm = ? AND center = ? AND pos_type != 'f' "
+                "ORDER BY valid_time DESC, bulletin_time DESC LIMIT 1",
+                (storm, c),
+            ).fetchall()
+        df = pd.DataFrame(
+            rows,
+            columns=["center", "valid_time", "lat", "lon", "vmax", "cat", "_"],
+        )
+        return self._to_positions(df, "c")
+
+    @staticmethod
+    def _to_positions(df, pos_type):
+        ts = _from_epoch(df["valid_time"])
+        return pd.DataFrame(
+            {
+                "Center": df["center"],
+                "Date": ts.dt.strftime("%b %-d %-I %P"),
+                "Lat": df["lat"],
+                "Lon": df["lon"],
+                "PosType": pos_type,
+                "Vmax": df["vmax"],
+                "Cat": df["cat"],
+                "Timestamp": ts,
+            }
+        )
@@ -1,117 +1,787 @@
+import argparse
+import cProfile
+import importlib.util
 import os
 import shutil
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
 from datetime import datetime
+from functools import partial
 from pathlib import Path
 
 import pandas as pd
-from _const_ import JTWC_BASE_URL, T2K_BASE_URL
+import requests
+from _archive_ import RawArchive
+from _consensus_ import consensus_track
+from _const_ import (
+    JTWC_BASE_URL,
+    OUTPUT_FORMATS,
+    RAMMB_BASE_URL,
+    RAMMB_BDECK_URL,
+    RAMMB_INDEX_URL,
+    T2K_BASE_URL,
+)
+from _fetch_ import Deadline, Fetcher, HttpCache, make_session
+from _helper_ import LOCAL_TZ, QUADRANT_COLS, read_timestamps
+from _merge_ import merge_positions
+from _metrics_ import Metrics, write_jsonl, write_prom
+from _publish_ import ZipStream, publish
+from _store_ import TrackStore
 from dotenv import dotenv_values
-from make_shp import make_shp
 from parse_jtwc import proc_tc_data as get_jtwc
-from parse_rammb import proc_tc_data as get_rammb
 from parse_t2k import proc_tc_data as get_t2k
 
 CONFIG = dotenv_values()
 
+# a source that cannot be downloaded or parsed is taken from its fallback,
+# anything else is a bug and fails the run
+SOURCE_ERRORS = (requests.RequestException, OSError, ValueError, IndexError, KeyError)
 
-def main():
-    # Load TC information
-    print("Loading TC information...")
-    dt_now = pd.to_datetime(datetime.now())
-    tc_info = {
-        "name": CONFIG.get("TC_NAME", ""),
-        "yr": int(CONFIG.get("TC_YEAR", f"{dt_now:'%Y'}")),
-        "cy": int(CONFIG.get("TC_CY", "1")),
-        "basin": CONFIG.get("TC_BASIN", "wp").lower(),
-    }
+# sources in order of precedence, e.g. JTWC's warning replaces the fix of
+# RAMMB's track history with the same time
+SOURCES = ["RAMMB", "JTWC", "Typhoon2k"]
 
-    out_dir = Path(CONFIG.get("OUT_DIR", "output"))
-    out_dir.mkdir(parents=True, exist_ok=True)
+OUT_COLS = [
+    "Center",
+    "Date",
+    "Lat",
+    "Lon",
+    "PosType",
+    "Vmax",
+    "Cat",
+    "R34",
+    "R50",
+    "R64",
+    *QUADRANT_COLS,
+    "Timestamp",
+]
+
+
+def _to_bool(value):
+    return str(value).strip().lower() in ("1", "true", "yes", "on")
+
+
+def _timed(func, *args, **kwargs):
+    """Call the function and measure how long it took
+
+    Output:
+    res (tuple) -- the function's return value and the elapsed time in seconds
+    """
+    t0 = time.perf_counter()
+    res = func(*args, **kwargs)
+    return res, time.perf_counter() - t0
+
+
+# name of the source fetched by the current thread
+_source = threading.local()
+
+
+def _fetch_source(name, func, *args, **kwargs):
+    _source.name = name
+    try:
+        return _timed(func, *args, **kwargs)
+    finally:
+        _source.name = None
+
+
+def _download_hook(metrics):
+    """Session hook recording the latency and size of every download
+
+    The latency is the time until the headers arrived plus the time to read
+    the body, which the hook reads before the parser does.
+    """
+
+    def hook(r, *args, **kwargs):
+        t0 = time.perf_counter()
+        n_bytes = len(r.content)
+        latency = r.elapsed.total_seconds() + time.perf_counter() - t0
+        source = getattr(_source, "name", None) or r.url
+        metrics.add("download_seconds", latency, source=source)
+        metrics.add("download_bytes", n_bytes, source=source)
+
+    return hook
+
+
+def make_fetcher(source, http, deadline=None):
+    """Fetcher of a source with the timeouts and retries of the config
+
+    FETCH_TIMEOUT_{SOURCE} (e.g. FETCH_TIMEOUT_JTWC) overrides the
+    'connect,read' timeouts of FETCH_TIMEOUT for a single source.
+    """
+    timeout = CONFIG.get(
+        f"FETCH_TIMEOUT_{source.upper()}", CONFIG.get("FETCH_TIMEOUT", "10,30")
+    )
+    return Fetcher(
+        http,
+        timeout=tuple(float(t) for t in timeout.split(",")),
+        retries=int(CONFIG.get("FETCH_RETRIES", "2")),
+        backoff=float(CONFIG.get("FETCH_BACKOFF", "1")),
+        deadline=deadline,
+    )
+
+
+def run_deadline(dt_now):
+    """Time left of the FETCH_BUDGET of a run started at dt_now"""
+    budget = CONFIG.get("FETCH_BUDGET", "300")
+    if not budget:
+        return Deadline()
+    return Deadline(float(budget) - (datetime.now() - dt_now).total_seconds())
+
+
+def from_archive(func, archive, source, storm, *args, **kwargs):
+    """Parse the latest raw copy of a source archived by an earlier run
+
+    Input:
+    func (function) -- parser with the 'local' mode
+    archive (RawArchive) -- archive of the raw bulletins
+    source (str) -- source name in the archive
+    storm (str) -- storm key of the source in the archive
+    args, kwargs -- other arguments of the parser
 
+    Output:
+    df (pandas.DataFrame) -- the parsed data
+    """
+    entry = archive.latest(source, storm)
+    if entry is None:
+        raise FileNotFoundError(f"No raw copy of {source} {storm} in the archive")
+    fetch_time, sha = entry
+    print(f"Using the raw copy of {source} from {fetch_time:%Y-%m-%d %H:%M}")
+    return func(
+        sha, *args, timestamp=fetch_time, mode="local", archive=archive, **kwargs
+    )
+
+
+def fetch_sources(tasks, metrics=None, deadline=None, fallbacks=None):
+    """Download and parse all sources concurrently
+
+    Each source is fetched and parsed in its own thread, so parsing starts as
+    soon as its response arrives. All sources share one keep-alive session,
+    each with its own timeouts and retries, within the time budget of the run.
+    A source that fails to download or parse (SOURCE_ERRORS) or returns
+    nothing is taken from its fallback, other errors are raised.
+
+    Input:
+    tasks (dict) -- source name -> (parser function, args, kwargs)
+    metrics (Metrics) -- records the download latency and size and the parse
+        time of every source, and the sources that fell back
+    deadline (Deadline) -- time budget of the run
+    fallbacks (dict) -- source name -> function without arguments returning
+        the data, e.g. parsing the last raw copy
+
+    Output:
+    res (dict) -- source name -> parsed data (or None on failure)
+    status (dict) -- source name -> 'ok', 'fallback' (taken from its
+        fallback) or 'failed' (no data)
+    """
+    res = {}
+    if len(tasks) == 0:
+        return res, {}
+    fallbacks = {} if fallbacks is None else fallbacks
+    with make_session(pool_size=len(tasks)) as session:
+        if metrics is not None:
+            session.hooks["response"].append(_download_hook(metrics))
+        with ThreadPoolExecutor(max_workers=len(tasks)) as executor:
+            futures = {
+                executor.submit(
+                    _fetch_source,
+                    name,
+                    func,
+                    *args,
+                    **{**kwargs, "session": make_fetcher(name, session, deadline)},
+                ): name
+                for name, (func, args, kwargs) in tasks.items()
+            }
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    res[name], elapsed = future.result()
+                    print(f"Fetched {name} in {elapsed:.2f}s")
+                except SOURCE_ERRORS as e:
+                    res[name] = None
+                    print(f"Failed to fetch {name}: {e}")
+                    continue
+                if metrics is not None:
+                    download = metrics.total("download_seconds", source=name)
+                    metrics.add(
+                        "parse_seconds", max(elapsed - download, 0), source=name
+                    )
+
+    status = {name: "ok" for name in tasks}
+    for name, fallback in fallbacks.items():
+        if name not in tasks or isinstance(res.get(name), pd.DataFrame):
+            continue
+        try:
+            res[name] = fallback()
+        except SOURCE_ERRORS as e:
+            print(f"No fallback for {name}: {e}")
+            continue
+        status[name] = "fallback"
+        if metrics is not None:
+            metrics.add("fallbacks", 1, source=name)
+
+    for name in tasks:
+        if not isinstance(res.get(name), pd.DataFrame):
+            status[name] = "failed"
+    return res, status
+
+
+def make_consensus(out_df):
+    """Consensus of the forecasts with the settings of the config
+
+    Output:
+    cons_df (pandas.DataFrame) -- see consensus_track, None if CONSENSUS is
+        disabled
+    """
+    if not _to_bool(CONFIG.get("CONSENSUS", "true")):
+        return None
+    centers = [c.strip() for c in CONFIG.get("CONSENSUS_CENTERS", "").split(",")]
+    return consensus_track(
+        out_df,
+        freq=CONFIG.get("INTERP_FREQ") or "1h",
+        method=CONFIG.get("INTERP_METHOD", "cubic"),
+        centers=[c for c in centers if c != ""],
+        min_members=int(CONFIG.get("CONSENSUS_MIN_MEMBERS", "2")),
+    )
+
+
+def make_exposure(out_df):
+    """Locations of EXPOSURE_FILE exposed to the storm
+
+    The locations are indexed once per process and cached in OUT_DIR/cache
+    for the next runs (see load_index).
+
+    Output:
+    exp_df (pandas.DataFrame) -- see exposure_table, None if EXPOSURE_FILE is
+        not set
+    """
+    if not CONFIG.get("EXPOSURE_FILE"):
+        return None
+    from exposure import exposure_table, load_index
+
+    index = load_index(
+        CONFIG["EXPOSURE_FILE"], Path(CONFIG.get("OUT_DIR", "output")) / "cache"
+    )
+    return exposure_table(
+        index,
+        out_df,
+        main_track=CONFIG["MAIN_TRACK"],
+        center=CONFIG.get("EXPOSURE_CENTER") or "JTWC",
+        freq=CONFIG.get("INTERP_FREQ") or "1h",
+        method=CONFIG.get("INTERP_METHOD", "cubic"),
+    )
+
+
+def check_out_format():
+    """Format of the layers set by OUT_FORMAT, checked before the run starts
+    so that a missing optional dependency does not fail it halfway
+
+    Output:
+    out_format (str) -- 'shp', 'gpkg' or 'parquet'
+    """
+    out_format = CONFIG.get("OUT_FORMAT", "shp").lower()
+    if out_format not in OUTPUT_FORMATS:
+        raise ValueError(f"OUT_FORMAT should be one of {OUTPUT_FORMATS}")
+    if out_format == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise ImportError("OUT_FORMAT=parquet requires pyarrow, which is not installed")
+    return out_format
+
+
+def make_products(
+    out_df,
+    tc_info,
+    out_dir,
+    dt_now,
+    metrics=None,
+    csv_only=False,
+    publish_dir=None,
+    publish_links=False,
+):
+    """Save the CSV and generate the GIS layers of a run, with the consensus
+    of the forecasts
+
+    make_shp (and geopandas, shapely and pyproj with it) is only imported when
+    the GIS layers are generated. The Shapefiles are written into a staging
+    directory, which replaces the run's directory when it is complete, and
+    zipped while they are written. The locations exposed to the storm are
+    saved in csv/exposure (see make_exposure). The layers are then published
+    to the publish directory, if given (see publish).
+
+    Input:
+    out_df (pandas.DataFrame) -- merged positions
+    tc_info (dict) -- storm name, year, cyclone number and basin
+    out_dir (pathlib.Path) -- output directory of the storm
+    dt_now (pandas.Timestamp) -- run time, used to name the outputs
+    metrics (Metrics) -- records the time to save the CSV, to write each
+        layer, to zip them, to find the exposed locations and to publish the
+        layers
+    csv_only (bool) -- only save the CSV
+    publish_dir (str) -- directory the layers are published to, e.g.
+        QGIS_DATA_DIR
+    publish_links (bool) -- also link every layer in the publish directory
+        itself
+    """
+    metrics = Metrics() if metrics is None else metrics
     out_csv = out_dir / f"csv/{tc_info['name']}_{dt_now:%Y%m%d%H}.csv"
     out_csv.parent.mkdir(parents=True, exist_ok=True)
+    # kept apart, the track history starts from the latest CSV in csv/
+    cons_csv = out_dir / f"csv/consensus/{tc_info['name']}_{dt_now:%Y%m%d%H}.csv"
 
-    out_shp_dir = out_dir / f"shp/{tc_info['name']}_{dt_now:%Y%m%d%H}/"
-    out_shp_dir.mkdir(parents=True, exist_ok=True)
-
-    out_zip = out_dir / f"{tc_info['name']}_{dt_now:%Y%m%d%H}"
-    out_zip.parent.mkdir(parents=True, exist_ok=True)
-
-    out_cols = [
-        "Center",
-        "Date",
-        "Lat",
-        "Lon",
-        "PosType",
-        "Vmax",
-        "Cat",
-        "R34",
-        "R50",
-        "R64",
-    ]
-    empty_df = pd.DataFrame(columns=out_cols)
+    with metrics.timer("consensus_seconds"):
+        cons_df = make_consensus(out_df)
 
-    # Initialize the csv
-    print("Initializing CSV...")
-    init_df = empty_df.copy()
-    csvs = sorted(out_csv.parent.glob("*.csv"), key=os.path.getmtime, reverse=True)
+    if csv_only:
+        print("Saving CSV...")
+        with metrics.timer("csv_seconds"):
+            out_df.to_csv(out_csv, index=False)
+            if cons_df is not None:
+                cons_csv.parent.mkdir(parents=True, exist_ok=True)
+                cons_df.to_csv(cons_csv, index=False)
+        return
 
-    if len(csvs) > 0:  # There is a csv, update it
-        init_df = pd.read_csv(csvs[0])
-        init_df = init_df.loc[init_df["PosType"] != "f", out_cols[:7]].copy()
-        init_df["PosType"] = "h"
-    else:
-        tc_code = f"{tc_info['basin']}{tc_info['cy']:02}{tc_info['yr']}"
-        init_df = get_rammb(tc_code)
+    out_format = check_out_format()
+    from make_shp import make_shp
 
-    if isinstance(init_df, pd.DataFrame):
-        out_df = init_df.copy()
+    append_runs = out_format != "shp" and _to_bool(CONFIG.get("APPEND_RUNS", "false"))
+    if out_format == "shp":
+        out_shp_dir = out_dir / f"shp/{tc_info['name']}_{dt_now:%Y%m%d%H}/"
+    elif append_runs:
+        # a single GeoPackage/GeoParquet set per storm, one layer set per run
+        out_shp_dir = out_dir / f"{out_format}/{tc_info['name']}"
     else:
-        out_df = empty_df.copy()
+        out_shp_dir = out_dir / f"{out_format}/{tc_info['name']}_{dt_now:%Y%m%d%H}"
+    if out_format == "gpkg":
+        out_shp_dir = out_shp_dir.with_name(f"{out_shp_dir.name}.gpkg")
+
+    # the GeoPackage/GeoParquet writers replace their files themselves
+    stage_dir = out_shp_dir
+    if out_format == "shp":
+        stage_dir = out_shp_dir.with_name(f".{out_shp_dir.name}.tmp")
+        if stage_dir.exists():
+            shutil.rmtree(stage_dir)
+        stage_dir.mkdir(parents=True)
+
+    # The SHPs are generated from the data directly, the CSV is saved meanwhile
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        csv_futures = []
+        if _to_bool(CONFIG.get("SAVE_CSV", "true")):
+            print("Saving CSV...")
+            csv_futures.append(
+                executor.submit(_timed, out_df.to_csv, out_csv, index=False)
+            )
+            if cons_df is not None:
+                cons_csv.parent.mkdir(parents=True, exist_ok=True)
+                csv_futures.append(
+                    executor.submit(_timed, cons_df.to_csv, cons_csv, index=False)
+                )
+
+        print(f"Creating {out_format.upper()}s...")
+        # the GeoPackage is already a single file
+        with (
+            ZipStream(out_dir / f"{tc_info['name']}_{dt_now:%Y%m%d%H}.zip")
+            if out_format == "shp"
+            else nullcontext()
+        ) as zip_stream:
+            timings = make_shp(
+                out_df,
+                stage_dir,
+                main_track=CONFIG["MAIN_TRACK"],
+                all_envelopes=_to_bool(CONFIG.get("ALL_ENVELOPES", "false")),
+                out_format=out_format,
+                run_id=f"{dt_now:%Y%m%d%H}" if append_runs else None,
+                workers=int(CONFIG.get("LAYER_WORKERS") or min(4, os.cpu_count() or 1)),
+                zip_stream=zip_stream,
+                interp_freq=CONFIG.get("INTERP_FREQ", "1h"),
+                interp_method=CONFIG.get("INTERP_METHOD", "cubic"),
+                consensus=cons_df,
+            )
+        for step, elapsed in timings["steps"].items():
+            metrics.add("layer_step_seconds", elapsed, step=step)
+        for layer, elapsed in timings["layers"].items():
+            metrics.add("layer_write_seconds", elapsed, layer=layer)
+        if zip_stream is not None:
+            metrics.add("zip_seconds", zip_stream.seconds)
+        if stage_dir != out_shp_dir:
+            if out_shp_dir.exists():
+                shutil.rmtree(out_shp_dir)
+            stage_dir.rename(out_shp_dir)
 
-    raw_out_dir = Path(out_dir) / "multi"
-    raw_out_dir.mkdir(parents=True, exist_ok=True)
+        if len(csv_futures) > 0:
+            metrics.add("csv_seconds", sum(f.result()[1] for f in csv_futures))
+
+    if CONFIG.get("EXPOSURE_FILE"):
+        print("Finding exposed locations...")
+        with metrics.timer("exposure_seconds"):
+            exp_df = make_exposure(out_df)
+        exp_csv = out_dir / f"csv/exposure/{tc_info['name']}_{dt_now:%Y%m%d%H}.csv"
+        exp_csv.parent.mkdir(parents=True, exist_ok=True)
+        exp_df.to_csv(exp_csv, index=False)
+        print(f"{exp_df.shape[0]} exposed locations")
+
+    if publish_dir:
+        print(f"Publishing to {publish_dir}...")
+        with metrics.timer("publish_seconds"):
+            release = publish(
+                out_shp_dir,
+                publish_dir,
+                tc_info["name"],
+                f"{dt_now:%Y%m%d%H}",
+                link_entries=publish_links,
+                keep=int(CONFIG.get("PUBLISH_KEEP", "24")),
+            )
+        print(f"Published {release}")
+
+
+def run_storm(tc_info, out_dir, dt_now, csv_only=False, publish_links=False):
+    """Fetch, parse and generate the products of a single storm, and publish
+    them to QGIS_DATA_DIR if set
+
+    Input:
+    tc_info (dict) -- storm name, year, cyclone number and basin
+    out_dir (pathlib.Path) -- output directory of the storm
+    dt_now (pandas.Timestamp) -- run time, used to name the outputs
+    csv_only (bool) -- only save the CSV
+    publish_links (bool) -- also link every layer in QGIS_DATA_DIR itself
+
+    Output:
+    summary (dict) -- status, number of rows, elapsed time and metrics of the
+        run
+    """
+    t0 = time.perf_counter()
+    summary = {"name": tc_info["name"], "status": "ok", "rows": 0}
+    metrics = Metrics(storm=tc_info["name"])
+    if not csv_only:
+        check_out_format()
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    empty_df = pd.DataFrame(columns=OUT_COLS)
+
+    archive = RawArchive(out_dir / "raw")
+
+    cache = HttpCache(out_dir / "cache")
+    tasks = {}
+
+    # Load the track history
+    print("Loading track history...")
+    t_stage = time.perf_counter()
+    storm_id = f"{tc_info['basin']}{tc_info['cy']:02}{tc_info['yr']}"
+    store_file = out_dir / f"store/{storm_id}.sqlite"
+    init_df = empty_df.copy()
+    with TrackStore(store_file) as store:
+        if not store.has_fixes(storm_id):
+            # start from the latest CSV written before there was a store
+            csvs = sorted((out_dir / "csv").glob(f"{tc_info['name']}_*.csv"))
+            if len(csvs) > 0:
+                csv_df = pd.read_csv(csvs[-1])
+                csv_df["Timestamp"] = read_timestamps(csv_df, dt_now)
+                csv_time = pd.to_datetime(
+                    csvs[-1].stem.rsplit("_", 1)[-1], format="%Y%m%d%H"
+                )
+                store.upsert(storm_id, csv_df, csv_time.tz_localize(LOCAL_TZ))
+        has_history = store.has_fixes(storm_id)
+        if has_history:
+            init_df = store.history(storm_id)
+
+    metrics.add("stage_seconds", time.perf_counter() - t_stage, stage="history")
+
+    if not has_history:
+        # only needed to start the track history, lxml is loaded on demand
+        from parse_rammb import proc_tc_data as get_rammb
+
+        tasks["RAMMB"] = (
+            get_rammb,
+            (storm_id,),
+            {
+                "base_url": CONFIG.get("RAMMB_BASE_URL", RAMMB_BASE_URL),
+                "bdeck_url": CONFIG.get("RAMMB_BDECK_URL", RAMMB_BDECK_URL),
+                "cache": cache,
+            },
+        )
 
     # Get forecast data from JTWC
-    print("Getting forecast from JTWC...")
     tc_code = f"{tc_info['basin']}{tc_info['cy']:02}{tc_info['yr'] % 100}"
-    in_file = JTWC_BASE_URL + tc_code + "web.txt"
-    jtwc_df = get_jtwc(in_file, tc_code, raw_out_dir=raw_out_dir)
-    if isinstance(jtwc_df, pd.DataFrame):
-        c_date = jtwc_df.loc[jtwc_df["PosType"] == "c", "Date"].values
-        if len(c_date) > 0:
-            c_date = c_date[0]
-            out_df = out_df.loc[
-                ~((out_df["Center"] == "JTWC") & (out_df["Date"] == c_date))
-            ].copy()
-        out_df = pd.concat([out_df, jtwc_df], ignore_index=True)
-    else:
-        out_df = pd.concat([out_df, empty_df], ignore_index=True)
+    in_file = CONFIG.get("JTWC_BASE_URL", JTWC_BASE_URL) + tc_code + "web.txt"
+    tasks["JTWC"] = (
+        get_jtwc,
+        (in_file, tc_code),
+        {"archive": archive, "cache": cache},
+    )
 
     # Get multilog from Typhoon2000
-    print("Getting TC data from Typhoon2k...")
-    in_file = T2K_BASE_URL + tc_info["name"] + ".TXT"
-    t2k_df = get_t2k(in_file, tc_info["name"], exclude="JTWC", raw_out_dir=raw_out_dir)
-    if isinstance(t2k_df, pd.DataFrame):
-        for center_name in t2k_df["Center"].unique():
-            c_date = jtwc_df.loc[t2k_df["PosType"] == "c", "Date"].values
-            if len(c_date) > 0:
-                c_date = c_date[0]
-                out_df = out_df.loc[
-                    ~((out_df["Center"] == center_name) & (out_df["Date"] == c_date))
-                ].copy()
-        out_df = pd.concat([out_df, t2k_df], ignore_index=True)
-    else:
-        out_df = pd.concat([out_df, empty_df], ignore_index=True)
+    in_file = CONFIG.get("T2K_BASE_URL", T2K_BASE_URL) + tc_info["name"] + ".TXT"
+    tasks["Typhoon2k"] = (
+        get_t2k,
+        (in_file, tc_info["name"]),
+        {"exclude": "JTWC", "archive": archive, "cache": cache},
+    )
+
+    # A source that misses its deadline is parsed from its last raw copy
+    fallbacks = {
+        "JTWC": partial(from_archive, get_jtwc, archive, "JTWC", tc_code, tc_code),
+        "Typhoon2k": partial(
+            from_archive,
+            get_t2k,
+            archive,
+            "Typhoon2k",
+            tc_info["name"].upper(),
+            tc_info["name"],
+            exclude="JTWC",
+        ),
+    }
+
+    print(f"Getting TC data from {', '.join(tasks.keys())}...")
+    with metrics.timer("stage_seconds", stage="fetch"):
+        src_dfs, src_status = fetch_sources(
+            tasks, metrics, run_deadline(dt_now), fallbacks
+        )
+
+    # a source that failed or fell back says nothing about its changes, only
+    # sources that all answered 304 or the same body are skipped
+    degraded = [name for name, status in src_status.items() if status != "ok"]
+    if (
+        _to_bool(CONFIG.get("SKIP_UNCHANGED", "true"))
+        and has_history
+        and len(degraded) == 0
+        and len(cache.changed) == 0
+    ):
+        print("No source has changed since the last run, skipping...")
+        summary["status"] = "unchanged"
+        return _finish(summary, metrics, t0, dt_now)
+    if all(status == "failed" for status in src_status.values()):
+        summary["status"] = "failed (no source)"
+    elif len(degraded) > 0:
+        summary["status"] = f"degraded ({', '.join(sorted(degraded))})"
+
+    # RAMMB's track history is only fetched when there is no history yet
+    if isinstance(src_dfs.get("RAMMB"), pd.DataFrame):
+        init_df = src_dfs["RAMMB"]
+
+    # Current positions replace the history with the same center and time
+    print("Merging sources...")
+    t_stage = time.perf_counter()
+    out_df, counts = merge_positions(init_df, [src_dfs["JTWC"], src_dfs["Typhoon2k"]])
+    print(
+        f"{counts['inserted']} rows inserted, {counts['replaced']} replaced,"
+        f" {counts['dropped']} dropped"
+    )
+
+    out_df = out_df.reindex(columns=OUT_COLS)
+    out_df["Timestamp"] = read_timestamps(out_df)
+    metrics.add("stage_seconds", time.perf_counter() - t_stage, stage="merge")
+    for action, n in counts.items():
+        metrics.add("merge_rows", n, action=action)
+    for center, n in out_df.groupby("Center").size().items():
+        metrics.add("rows", n, center=center)
+
+    # Keep the new fixes for the next runs
+    new_dfs = [
+        src_dfs[name] for name in SOURCES if isinstance(src_dfs.get(name), pd.DataFrame)
+    ]
+    if len(new_dfs) > 0:
+        with (
+            metrics.timer("stage_seconds", stage="store"),
+            TrackStore(store_file) as store,
+        ):
+            n = store.upsert(
+                storm_id,
+                pd.concat(new_dfs, ignore_index=True),
+                dt_now.tz_localize(LOCAL_TZ),
+            )
+        print(f"Stored {n} fixes")
+
+    with metrics.timer("stage_seconds", stage="products"):
+        make_products(
+            out_df,
+            tc_info,
+            out_dir,
+            dt_now,
+            metrics,
+            csv_only,
+            publish_dir=CONFIG.get("QGIS_DATA_DIR"),
+            publish_links=publish_links,
+        )
+    # only now the sources count as processed, see HttpCache
+    cache.commit()
+
+    summary["rows"] = out_df.shape[0]
+    return _finish(summary, metrics, t0, dt_now)
+
+
+def _finish(summary, metrics, t0, dt_now):
+    summary["elapsed"] = time.perf_counter() - t0
+    metrics.add("run_seconds", summary["elapsed"])
+    metrics.add("last_run_timestamp_seconds", dt_now.tz_localize(LOCAL_TZ).timestamp())
+    summary["metrics"] = metrics.records
+    return summary
+
+
+def _profiled(prof_file, func, *args):
+    """Run the function under cProfile and save the stats to a file"""
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        prof_file.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(prof_file)
+        print(f"Saved profile to {prof_file}")
+
+
+def _run_storm(tc_info, out_dir, dt_now, profile=False, csv_only=False):
+    """Run a storm in a worker process"""
+    if profile:
+        prof_file = out_dir / f"profile/{tc_info['name']}_{dt_now:%Y%m%d%H}.prof"
+        return _profiled(prof_file, run_storm, tc_info, out_dir, dt_now, csv_only)
+    return run_storm(tc_info, out_dir, dt_now, csv_only)
+
+
+def _storm_summary(tc_info, future):
+    """Summary of a storm run in a worker process, a failure does not break
+    the other storms"""
+    e = future.exception()
+    if e is None:
+        return future.result()
+    # the traceback of the worker process is the cause
+    print(f"{tc_info['name']} failed:\n{e.__cause__ or repr(e)}")
+    return {
+        "name": tc_info["name"],
+        "status": f"failed ({e})",
+        "rows": 0,
+        "elapsed": None,
+    }
+
+
+def parse_storm(str):
+    """Parse a storm given as 'NAME:CY:YEAR[:BASIN]'
+
+    Input:
+    str (str) -- the string input
+
+    Output:
+    tc_info (dict) -- storm name, year, cyclone number and basin
+    """
+    parts = str.split(":")
+    if len(parts) not in (3, 4):
+        raise argparse.ArgumentTypeError(f"expected NAME:CY:YEAR[:BASIN], got '{str}'")
+    return {
+        "name": parts[0].upper(),
+        "yr": int(parts[2]),
+        "cy": int(parts[1]),
+        "basin": (parts[3] if len(parts) == 4 else "wp").lower(),
+    }
+
+
+def export_metrics(summaries, out_dir, dt_now):
+    """Append the metrics of the runs to METRICS_FILE (JSON lines) and write
+    them to PROM_FILE for the Prometheus textfile collector, if set"""
+    records = [r for s in summaries for r in s.get("metrics", [])]
+    if len(records) == 0:
+        return
+    metrics_file = CONFIG.get("METRICS_FILE", str(out_dir / "metrics.jsonl"))
+    if metrics_file:
+        write_jsonl(records, metrics_file, dt_now.tz_localize(LOCAL_TZ))
+    if CONFIG.get("PROM_FILE"):
+        write_prom(records, CONFIG["PROM_FILE"])
+
+
+def print_summary(summaries):
+    print("Summary:")
+    for s in summaries:
+        elapsed = "-" if s["elapsed"] is None else f"{s['elapsed']:.2f}s"
+        print(f"  {s['name']:<12} {s['status']:<12} {s['rows']:>5} rows {elapsed:>9}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate the TC multilog products")
+    parser.add_argument(
+        "--storm",
+        help="Storm to process as NAME:CY:YEAR[:BASIN], can be repeated",
+        action="append",
+        type=parse_storm,
+        default=[],
+    )
+    parser.add_argument(
+        "--active",
+        help="Process every active storm listed by RAMMB",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Maximum number of storms processed at the same time",
+        type=int,
+        default=int(CONFIG.get("MAX_WORKERS", "2")),
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile each storm with cProfile, saved in OUT_DIR/profile",
+        action="store_true",
+        default=_to_bool(CONFIG.get("PROFILE", "false")),
+    )
+    parser.add_argument(
+        "--csv-only",
+        help="Only save the CSV, without loading the GIS libraries",
+        action="store_true",
+        default=_to_bool(CONFIG.get("CSV_ONLY", "false")),
+    )
+    args = parser.parse_args(argv)
+
+    # Load TC information
+    print("Loading TC information...")
+    dt_now = pd.to_datetime(datetime.now())
+    out_dir = Path(CONFIG.get("OUT_DIR", "output"))
+
+    storms = list(args.storm)
+    if args.active:
+        from parse_rammb import get_active_storms
 
-    # Save CSV
-    print("Saving CSV...")
-    out_df[out_cols].to_csv(out_csv, index=False)
+        with make_session() as session:
+            storms += get_active_storms(
+                CONFIG.get("TC_BASIN", "wp").lower(),
+                url=CONFIG.get("RAMMB_INDEX_URL", RAMMB_INDEX_URL),
+                session=make_fetcher("RAMMB", session, run_deadline(dt_now)),
+            )
+    unique = {}
+    for tc_info in storms:
+        unique.setdefault((tc_info["basin"], tc_info["cy"], tc_info["yr"]), tc_info)
+    storms = list(unique.values())
+    if len(storms) == 0:
+        tc_info = {
+            "name": CONFIG.get("TC_NAME", ""),
+            "yr": int(CONFIG.get("TC_YEAR", f"{dt_now:%Y}")),
+            "cy": int(CONFIG.get("TC_CY", "1")),
+            "basin": CONFIG.get("TC_BASIN", "wp").lower(),
+        }
+        if args.profile:
+            prof_file = out_dir / f"profile/{tc_info['name']}_{dt_now:%Y%m%d%H}.prof"
+            summary = _profiled(
+                prof_file, run_storm, tc_info, out_dir, dt_now, args.csv_only, True
+            )
+        else:
+            summary = run_storm(tc_info, out_dir, dt_now, args.csv_only, True)
+        print_summary([summary])
+        export_metrics([summary], out_dir, dt_now)
+        return
 
-    # Create SHP
-    print("Creating SHPs...")
-    make_shp(out_csv, out_shp_dir, main_track=CONFIG["MAIN_TRACK"])
-    shutil.make_archive(out_zip, "zip", out_shp_dir)
+    # Each storm gets its own output directory
+    print(f"Processing {', '.join(s['name'] for s in storms)}...")
+    with ProcessPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = [
+            executor.submit(
+                _run_storm,
+                tc_info,
+                out_dir / tc_info["name"],
+                dt_now,
+                args.profile,
+                args.csv_only,
+            )
+            for tc_info in storms
+        ]
+        summaries = [
+            _storm_summary(tc_info, future) for tc_info, future in zip(storms, futures)
+        ]
+    print_summary(summaries)
+    export_metrics(summaries, out_dir, dt_now)
 
 
 if __name__ == "__main__":
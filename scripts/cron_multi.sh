@@ -2,10 +2,6 @@
 
 cd $MAIN_DIR
 
-mkdir -p $QGIS_DATA_DIR
-
+# The layers are published to QGIS_DATA_DIR by cron_multi.py (hardlinked,
+# then switched in a single rename), nothing is copied here
 $PYTHON $MAIN_DIR/scripts/cron_multi.py
-
-# Copy to QGIS directory
-echo "Copying files to QGIS directory..."
-cp -rp ${OUT_SHP_DIR}/* ${QGIS_DATA_DIR}
\ No newline at end of file
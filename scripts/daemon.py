@@ -0,0 +1,345 @@
+import argparse
+import json
+import multiprocessing
+import os
+import selectors
+import signal
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+# loads pandas, geopandas, shapely and lxml once for all runs, cron_multi
+# itself imports make_shp and parse_rammb only when they are needed
+import cron_multi
+import make_shp  # noqa: F401
+import parse_rammb  # noqa: F401
+from dotenv import dotenv_values
+
+# the runs are forked from the daemon, which already has the libraries loaded
+MP_CONTEXT = multiprocessing.get_context("fork")
+
+# how often the trigger file and the timeout of a run are checked (s)
+POLL_INTERVAL = 1.0
+
+
+def log(msg):
+    print(f"[{datetime.now():%Y-%m-%d %H:%M:%S}] {msg}", flush=True)
+
+
+def next_run_time(now, interval, offset=0):
+    """Next scheduled run after now
+
+    The runs are aligned to multiples of the interval since the epoch, e.g.
+    with an interval of 60 min and an offset of 5 min, at 5 past every hour.
+
+    Input:
+    now (float) -- current time as a UNIX timestamp
+    interval (float) -- minutes between runs
+    offset (float) -- minutes after the aligned time
+
+    Output:
+    t (float) -- UNIX timestamp of the next run
+    """
+    interval, offset = interval * 60, offset * 60
+    t = now // interval * interval + offset
+    while t <= now:
+        t += interval
+    return t
+
+
+def _run_child(cron_args):
+    """Run cron_multi in the forked child, with the current .env"""
+    # the child inherits the signal handling of the daemon
+    signal.set_wakeup_fd(-1)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+    cron_multi.CONFIG = dotenv_values()
+    cron_multi.main(cron_args)
+
+
+class Daemon:
+    """Warm worker running cron_multi on a schedule or on a trigger
+
+    Each run is forked from the daemon, so it starts with the libraries
+    already imported, and a crash, a hang (killed after the timeout) or a
+    leak of a run does not affect the daemon or the next runs. Triggers that
+    arrive during a run are combined into a single run after it.
+
+    A run is triggered by:
+    - the schedule, every interval minutes
+    - SIGUSR1
+    - creating the trigger file, which is deleted when the run starts
+    - the line 'run' sent to the control socket, which also answers 'status'
+      with the last run as JSON
+
+    Input:
+    cron_args (list) -- arguments of cron_multi, e.g. ['--active']
+    interval (float) -- minutes between scheduled runs, 0 to disable
+    offset (float) -- minutes after the aligned time of the scheduled runs
+    timeout (float) -- seconds before a run is killed
+    trigger_file (str) -- path of the trigger file
+    socket_file (str) -- path of the control socket (UNIX domain)
+    post_run (str) -- shell command run after every successful run
+    """
+
+    def __init__(
+        self,
+        cron_args,
+        interval=60,
+        offset=0,
+        timeout=3000,
+        trigger_file=None,
+        socket_file=None,
+        post_run=None,
+    ):
+        self.cron_args = cron_args
+        self.interval = interval
+        self.offset = offset
+        self.timeout = timeout
+        self.trigger_file = None if not trigger_file else Path(trigger_file)
+        self.socket_file = None if not socket_file else Path(socket_file)
+        self.post_run = post_run
+
+        self.proc = None
+        self.started = None
+        self.pending = False
+        self.stopping = False
+        self.last = {}
+        self.next_run = None
+        self.sel = None
+
+    def trigger(self, reason):
+        if not self.pending:
+            log(f"Run requested ({reason})")
+        self.pending = True
+
+    def _on_signal(self, signum, frame):
+        if signum == signal.SIGUSR1:
+            self.trigger("signal")
+        else:
+            self.stopping = True
+
+    def _open_socket(self):
+        self.socket_file.parent.mkdir(parents=True, exist_ok=True)
+        self.socket_file.unlink(missing_ok=True)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(str(self.socket_file))
+        server.listen()
+        server.setblocking(False)
+        self.sel.register(server, selectors.EVENT_READ, self._accept)
+        return server
+
+    def _accept(self, server):
+        conn, _ = server.accept()
+        with conn:
+            conn.settimeout(1.0)
+            try:
+                cmd = conn.makefile().readline().strip().lower()
+                if cmd == "run":
+                    self.trigger("socket")
+                    reply = "queued"
+                elif cmd == "status":
+                    reply = json.dumps(
+                        {"running": self.proc is not None, "pending": self.pending}
+                        | self.last
+                    )
+                else:
+                    reply = f"unknown command: {cmd}"
+                conn.sendall(f"{reply}\n".encode())
+            except OSError as e:
+                log(f"Control socket error: {e}")
+
+    def _start(self):
+        self.pending = False
+        log(f"Starting run: cron_multi {' '.join(self.cron_args)}".rstrip())
+        # unflushed output would be written again by the child
+        sys.stdout.flush()
+        sys.stderr.flush()
+        self.proc = MP_CONTEXT.Process(target=_run_child, args=(self.cron_args,))
+        self.proc.start()
+        self.started = time.monotonic()
+        # wake up the selector when the run ends
+        self.sel.register(self.proc.sentinel, selectors.EVENT_READ, lambda fd: None)
+
+    def _check(self):
+        """Collect the finished run, or kill it after the timeout"""
+        elapsed = time.monotonic() - self.started
+        if self.proc.is_alive():
+            if elapsed < self.timeout:
+                return
+            log(f"Run exceeded {self.timeout:.0f}s, killing it")
+            self.proc.terminate()
+            self.proc.join(5)
+            if self.proc.is_alive():
+                self.proc.kill()
+        self.proc.join()
+        self.sel.unregister(self.proc.sentinel)
+
+        code = self.proc.exitcode
+        self.proc = None
+        self.last = {
+            "last_run": datetime.now().isoformat(timespec="seconds"),
+            "exit_code": code,
+            "elapsed": round(elapsed, 2),
+        }
+        if code != 0:
+            log(f"Run failed with exit code {code} after {elapsed:.2f}s")
+            return
+        log(f"Run finished in {elapsed:.2f}s")
+        if self.post_run:
+            res = subprocess.run(self.post_run, shell=True, check=False)
+            if res.returncode != 0:
+                log(f"Post-run command failed with exit code {res.returncode}")
+
+    def _poll_timeout(self):
+        if self.pending and self.proc is None:
+            return 0
+        timeouts = []
+        if self.next_run is not None:
+            timeouts.append(max(0, self.next_run - time.time()))
+        if self.proc is not None or self.trigger_file is not None:
+            timeouts.append(POLL_INTERVAL)
+        return min(timeouts, default=None)
+
+    def serve(self, run_now=False):
+        self.sel = selectors.DefaultSelector()
+        # wake up the selector when a signal arrives
+        wakeup_r, wakeup_w = socket.socketpair()
+        wakeup_r.setblocking(False)
+        wakeup_w.setblocking(False)
+        self.sel.register(wakeup_r, selectors.EVENT_READ, lambda s: s.recv(4096))
+        old_fd = signal.set_wakeup_fd(wakeup_w.fileno())
+        for signum in (signal.SIGUSR1, signal.SIGTERM, signal.SIGINT):
+            signal.signal(signum, self._on_signal)
+
+        server = None if self.socket_file is None else self._open_socket()
+        if self.interval > 0:
+            self.next_run = next_run_time(time.time(), self.interval, self.offset)
+            log(f"Next scheduled run at {datetime.fromtimestamp(self.next_run)}")
+        if run_now:
+            self.trigger("startup")
+
+        log(f"Daemon started (pid {os.getpid()})")
+        try:
+            while not (self.stopping and self.proc is None):
+                for key, _ in self.sel.select(self._poll_timeout()):
+                    key.data(key.fileobj)
+
+                if self.trigger_file is not None and self.trigger_file.exists():
+                    self.trigger_file.unlink(missing_ok=True)
+                    self.trigger("trigger file")
+                if self.next_run is not None and time.time() >= self.next_run:
+                    self.next_run = next_run_time(
+                        time.time(), self.interval, self.offset
+                    )
+                    self.trigger("schedule")
+
+                if self.proc is not None:
+                    self._check()
+                if self.pending and self.proc is None and not self.stopping:
+                    self._start()
+        finally:
+            signal.set_wakeup_fd(old_fd)
+            if server is not None:
+                server.close()
+                self.socket_file.unlink(missing_ok=True)
+            self.sel.close()
+            wakeup_r.close()
+            wakeup_w.close()
+        log("Daemon stopped")
+
+
+def send_command(socket_file, cmd):
+    """Send a command to the control socket of a running daemon"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as conn:
+        conn.connect(str(socket_file))
+        conn.sendall(f"{cmd}\n".encode())
+        return conn.makefile().readline().strip()
+
+
+def main():
+    config = cron_multi.CONFIG
+    parser = argparse.ArgumentParser(
+        description="Keep the libraries loaded and run cron_multi on a schedule "
+        "or on a trigger",
+        epilog="The remaining arguments are passed to cron_multi, "
+        "e.g. 'daemon.py -- --active'",
+    )
+    parser.add_argument(
+        "--interval",
+        help="Minutes between scheduled runs, 0 to run only on a trigger",
+        type=float,
+        default=float(config.get("DAEMON_INTERVAL", "60")),
+    )
+    parser.add_argument(
+        "--offset",
+        help="Minutes after the hour (or the interval) of the scheduled runs",
+        type=float,
+        default=float(config.get("DAEMON_OFFSET", "0")),
+    )
+    parser.add_argument(
+        "--timeout",
+        help="Seconds before a run is killed",
+        type=float,
+        default=float(config.get("DAEMON_TIMEOUT", "3000")),
+    )
+    parser.add_argument(
+        "--trigger-file",
+        help="Run when this file is created",
+        default=config.get("DAEMON_TRIGGER_FILE"),
+    )
+    parser.add_argument(
+        "--socket",
+        help="Control socket accepting 'run' and 'status'",
+        default=config.get("DAEMON_SOCKET"),
+    )
+    parser.add_argument(
+        "--post-run",
+        help="Shell command run after every successful run",
+        default=config.get("DAEMON_POST_RUN"),
+    )
+    parser.add_argument(
+        "--run-now", help="Run once when the daemon starts", action="store_true"
+    )
+    parser.add_argument(
+        "--send",
+        help="Send a command to a running daemon through the control socket",
+        choices=["run", "status"],
+    )
+    args, cron_args = parser.parse_known_args()
+    if len(cron_args) > 0 and cron_args[0] == "--":
+        cron_args = cron_args[1:]
+
+    if args.send is not None:
+        if not args.socket:
+            sys.exit("--send needs --socket or DAEMON_SOCKET")
+        print(send_command(args.socket, args.send))
+        return
+
+    # the runs inherit the indexed locations
+    if config.get("EXPOSURE_FILE"):
+        from exposure import load_index
+
+        load_index(
+            config["EXPOSURE_FILE"], Path(config.get("OUT_DIR", "output")) / "cache"
+        )
+        log(f"Loaded {config['EXPOSURE_FILE']}")
+
+    daemon = Daemon(
+        cron_args,
+        interval=args.interval,
+        offset=args.offset,
+        timeout=args.timeout,
+        trigger_file=args.trigger_file,
+        socket_file=args.socket,
+        post_run=args.post_run,
+    )
+    daemon.serve(run_now=args.run_now)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+import argparse
+import hashlib
+import os
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import shapely
+from _helper_ import read_timestamps
+from _interp_ import interpolate_tracks
+from geopandas import GeoDataFrame, points_from_xy, read_file
+from make_shp import (
+    PROJ_CRS,
+    WIND_RADII,
+    generate_radii,
+    generate_track_envelope,
+    split_forecasts,
+)
+
+# version of the cached locations, bumped when their format changes
+INDEX_VERSION = 1
+
+# path -> (file key, LocationIndex) of the loaded locations, the runs forked
+# from the daemon inherit them
+_INDEXES = {}
+
+LON_COLS = ["lon", "longitude", "x"]
+LAT_COLS = ["lat", "latitude", "y"]
+
+
+class LocationIndex:
+    """Locations with an STRtree over their geometries
+
+    Input:
+    gdf (geopandas.GeoDataFrame) -- the locations (points or polygons) in
+        PROJ_CRS
+    """
+
+    def __init__(self, gdf):
+        self.gdf = gdf
+        self.tree = shapely.STRtree(gdf.geometry.values)
+
+    def query(self, geoms):
+        """Locations intersecting each of the geometries, in one bulk query
+
+        Input:
+        geoms (array-like) -- shapely geometries in PROJ_CRS
+
+        Output:
+        geom_idx, loc_idx (numpy.ndarray) -- indices of the intersecting
+            geometries and locations
+        """
+        geom_idx, loc_idx = self.tree.query(np.asarray(geoms), predicate="intersects")
+        return geom_idx, loc_idx
+
+
+def read_locations(in_file):
+    """Read the locations from any file OGR can read, or from a CSV with
+    longitude and latitude columns (e.g. 'Lon' and 'Lat')
+
+    Output:
+    gdf (geopandas.GeoDataFrame) -- valid, non-empty geometries in PROJ_CRS
+    """
+    in_file = Path(in_file)
+    if in_file.suffix.lower() == ".csv":
+        df = pd.read_csv(in_file)
+        cols = {c.lower(): c for c in df.columns}
+        lon = next((cols[c] for c in LON_COLS if c in cols), None)
+        lat = next((cols[c] for c in LAT_COLS if c in cols), None)
+        if lon is None or lat is None:
+            raise ValueError(f"No longitude/latitude columns in {in_file}")
+        gdf = GeoDataFrame(df, geometry=points_from_xy(df[lon], df[lat]), crs=PROJ_CRS)
+    else:
+        gdf = read_file(in_file)
+        if gdf.crs is None:
+            gdf = gdf.set_crs(PROJ_CRS)
+        elif gdf.crs != PROJ_CRS:
+            gdf = gdf.to_crs(PROJ_CRS)
+    gdf = gdf.loc[~(gdf.geometry.isna() | gdf.geometry.is_empty)]
+    invalid = ~gdf.geometry.is_valid
+    if invalid.any():
+        gdf.loc[invalid, "geometry"] = shapely.make_valid(gdf.geometry[invalid].values)
+    return gdf.reset_index(drop=True)
+
+
+def _file_key(in_file):
+    st = os.stat(in_file)
+    return (str(Path(in_file).resolve()), st.st_mtime_ns, st.st_size)
+
+
+def load_index(in_file, cache_dir=None):
+    """Load the locations once and index them
+
+    The index is kept in memory for the next calls, and the locations, as
+    read and reprojected, are also cached in cache_dir for the next runs. Both
+    are reloaded when the file changes.
+
+    Input:
+    in_file (str) -- locations file, see read_locations
+    cache_dir (pathlib.Path) -- directory of the cached locations
+
+    Output:
+    index (LocationIndex) -- the indexed locations
+    """
+    key = _file_key(in_file)
+    loaded = _INDEXES.get(key[0])
+    if loaded is not None and loaded[0] == key:
+        return loaded[1]
+
+    gdf, cache_file = None, None
+    if cache_dir is not None:
+        name = hashlib.sha1(key[0].encode()).hexdigest()
+        cache_file = Path(cache_dir) / f"locations-{name}.pkl"
+        if cache_file.exists():
+            with open(cache_file, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("version") == INDEX_VERSION and cached.get("key") == key:
+                gdf = cached["gdf"]
+    if gdf is None:
+        gdf = read_locations(in_file)
+        if cache_file is not None:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_name(f".{cache_file.name}.{os.getpid()}.tmp")
+            with open(tmp_file, "wb") as f:
+                pickle.dump(
+                    {"version": INDEX_VERSION, "key": key, "gdf": gdf},
+                    f,
+                    protocol=pickle.HIGHEST_PROTOCOL,
+                )
+            os.replace(tmp_file, cache_file)
+
+    index = LocationIndex(gdf)
+    _INDEXES[key[0]] = (key, index)
+    return index
+
+
+def _points(df):
+    geom = points_from_xy(df["Lon"], df["Lat"], crs=PROJ_CRS)
+    return GeoDataFrame(df, crs=PROJ_CRS, geometry=geom)
+
+
+def exposure_table(
+    index, df, main_track="JTWC", center="JTWC", freq="1h", method="cubic"
+):
+    """Locations inside the wind radii swaths and the track envelope
+
+    The wind radii of the center are drawn along its forecast every freq
+    (see interpolate_tracks), and all of them are queried against the index
+    at once. The first entry of a location into the 34/50/64-kt swath is the
+    time of the first wind radius that reaches it. The track envelope around
+    the main track is queried the same way.
+
+    Input:
+    index (LocationIndex) -- the indexed locations
+    df (pandas.DataFrame) -- positions with the tz-aware 'Timestamp' column
+    main_track (str) -- center whose forecast the track envelope follows
+    center (str) -- center whose wind radii make the swaths
+    freq (str) -- spacing of the wind radii along the forecast, empty to
+        only use the forecast positions
+    method (str) -- interpolation of the positions, 'cubic' or 'linear'
+
+    Output:
+    exp_df (pandas.DataFrame) -- attributes of the exposed locations with the
+        first entry time into every swath ('R34_First', ...) and whether they
+        are in the track envelope ('InEnvelope'), by first entry
+    """
+    n = index.gdf.shape[0]
+    exp_df = pd.DataFrame(index.gdf.drop(columns=index.gdf.geometry.name))
+    exposed = np.zeros(n, dtype=bool)
+
+    # the swaths, as the wind radii every freq
+    fcst = df.loc[(df["Center"] == center) & (df["PosType"] != "h")]
+    if freq and fcst.shape[0] > 0:
+        fcst = interpolate_tracks(fcst, freq, method)
+    rings = generate_radii(_points(fcst)) if fcst.shape[0] > 0 else {}
+    for radius in WIND_RADII:
+        first = pd.Series(pd.NaT, index=range(n), dtype=df["Timestamp"].dtype)
+        if radius in rings:
+            ring_idx, loc_idx = index.query(rings[radius].geometry.values)
+            times = rings[radius]["Timestamp"].iloc[ring_idx].reset_index(drop=True)
+            first.update(times.groupby(loc_idx).min())
+        exp_df[f"{radius}_First"] = first.array
+        exposed |= first.notna().values
+
+    # the track envelope, as drawn by make_shp, which only uses the forecasts
+    fcst = split_forecasts(df.loc[df["PosType"] != "h"])
+    envelope = generate_track_envelope(_points(fcst), main_track)
+    polys = [g.geometry.values for g in envelope[1::2]]
+    in_envelope = np.zeros(n, dtype=bool)
+    if len(polys) > 0:
+        _, loc_idx = index.query(np.concatenate(polys))
+        in_envelope[loc_idx] = True
+    exp_df["InEnvelope"] = in_envelope
+    exposed |= in_envelope
+
+    first_cols = [f"{radius}_First" for radius in WIND_RADII]
+    return (
+        exp_df.loc[exposed]
+        .sort_values(first_cols, na_position="last", kind="stable")
+        .reset_index(drop=True)
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="List the locations inside the wind radii swaths and the "
+        "track envelope"
+    )
+    parser.add_argument("input", help="Input CSV generated by cron_multi")
+    parser.add_argument(
+        "locations", help="Points/polygons file, or a CSV with Lon and Lat"
+    )
+    parser.add_argument("--out", help="Output CSV, printed if not given")
+    parser.add_argument("--main-track", help="Main track", default="JTWC")
+    parser.add_argument(
+        "--center", help="Center whose wind radii make the swaths", default="JTWC"
+    )
+    parser.add_argument(
+        "--freq", help="Spacing of the wind radii along the forecast", default="1h"
+    )
+    parser.add_argument("--cache-dir", help="Directory of the cached locations")
+    args = parser.parse_args()
+
+    in_df = pd.read_csv(args.input)
+    in_df["Timestamp"] = read_timestamps(in_df)
+    exp_df = exposure_table(
+        load_index(args.locations, args.cache_dir),
+        in_df,
+        args.main_track,
+        args.center,
+        args.freq,
+    )
+    if args.out is None:
+        print(exp_df.to_string())
+    else:
+        exp_df.to_csv(args.out, index=False)
@@ -1,80 +1,124 @@
 import argparse
+import os
+import shutil
+import sqlite3
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
+import shapely
+from _consensus_ import consensus_track
+from _const_ import OUTPUT_FORMATS
+from _helper_ import read_timestamps
+from _interp_ import INTERP_METHODS, interpolate_tracks
 from geopandas import GeoDataFrame, points_from_xy
-from scipy.optimize import curve_fit
+from pyproj import Geod
 from shapely.geometry import LineString, Polygon
 
 OUTPUT_DIR = Path("output/shp")
 
 PROJ_CRS = 4326
 
+GEOD = Geod(ellps="WGS84")
 
-def generate_track_envelope(pts_gdf, main_track="JTWC"):
+WIND_RADII = ["R34", "R50", "R64"]
+
+QUADRANTS = ["NE", "SE", "SW", "NW"]
+
+# GeoPackage tables describing the layers, see append_gpkg
+GPKG_META_TABLES = [
+    "gpkg_spatial_ref_sys",
+    "gpkg_contents",
+    "gpkg_geometry_columns",
+    "gpkg_extensions",
+    "gpkg_ogr_contents",
+]
+
+
+def _forecast_pts(pts_gdf):
     gdf = pts_gdf.loc[pts_gdf["Center"].str.contains("forecast")].copy()
-    gdf["ts"] = pd.to_datetime(gdf["Date"], format="%b %d %I %p")
-    gdf.sort_values(["Center", "ts"], inplace=True)
-    gdf.drop(columns="ts", inplace=True)
-
-    main_pts = (
-        gdf.loc[gdf["Center"].str.contains(main_track)].reset_index(drop=True).copy()
-    )
-    bnd_pts1 = [[], []]
-    bnd_pts2 = [[], []]
-    for i, r in main_pts.iterrows():
-        if i == 0:
-            u = np.array(r.geometry.coords[0])
-            bnd_pts1[0].append(u)
-            bnd_pts1[1].append(u)
-            bnd_pts2[0].append(u)
-            bnd_pts2[1].append(u)
-            continue
+    gdf.sort_values(["Center", "Timestamp"], inplace=True)
+    return gdf
 
-        # slope m of tangent line at current point
-        X = np.array([pt.coords[0][0] for pt in main_pts.iloc[i - 1 : i + 2].geometry])
-        Y = np.array([pt.coords[0][1] for pt in main_pts.iloc[i - 1 : i + 2].geometry])
-        u = np.array(r.geometry.coords[0])
-        (m,), pcov = curve_fit(lambda x, m: m * (x - u[0]) + u[1], X, Y)
-        m = np.abs(m)
-
-        # unit vector normal to the current point
-        n = np.array((1, -1 / m))
-        n_hat = n / np.linalg.norm(n)
-
-        pts = gdf.loc[gdf["Date"] == r["Date"]].copy()
-        X = np.array([pt.coords[0][0] for pt in pts.geometry])
-        Y = np.array([pt.coords[0][1] for pt in pts.geometry])
-        if len(X) == 1:
-            continue
-        # projection to the normal line
-        d_proj = np.array([np.dot(pt - u, n_hat) for pt in zip(X, Y)])
-
-        # keep only the edges
-        bnd_pts1[0].append(
-            next(
-                pt.coords[0]
-                for i, pt in enumerate(pts.geometry)
-                if d_proj[i] == d_proj.min()
-            )
-        )
-        bnd_pts1[1].append(
-            next(
-                pt.coords[0]
-                for i, pt in enumerate(pts.geometry)
-                if d_proj[i] == d_proj.max()
-            )
-        )
-        bnd_pts2[0].append(u + d_proj.min() * n_hat)
-        bnd_pts2[1].append(u + d_proj.max() * n_hat)
-
-    if (
-        (len(bnd_pts1[0]) < 2)
-        or (len(bnd_pts1[1]) < 2)
-        or (len(bnd_pts2[0]) < 2)
-        or (len(bnd_pts2[1]) < 2)
-    ):
+
+def track_normals(xy):
+    """Unit vectors normal to a track at each of its points
+
+    The tangent at a point is the least-squares line through the point and
+    its neighbors. As before, the absolute value of its slope is used, so the
+    normals always point to the same side.
+
+    Input:
+    xy (numpy.ndarray) -- (n, 2) coordinates of the track
+
+    Output:
+    n_hat (numpy.ndarray) -- (n, 2) unit normals
+    """
+    d_prev = np.zeros_like(xy, dtype=float)
+    d_next = np.zeros_like(xy, dtype=float)
+    d_prev[1:] = xy[:-1] - xy[1:]
+    d_next[:-1] = xy[1:] - xy[:-1]
+    s_xx = d_prev[:, 0] ** 2 + d_next[:, 0] ** 2
+    s_xy = d_prev[:, 0] * d_prev[:, 1] + d_next[:, 0] * d_next[:, 1]
+
+    # (1, -1 / m) scaled by m * s_xx, which also covers m = 0 and vertical tracks
+    n = np.column_stack([np.abs(s_xy), -s_xx])
+    norm = np.hypot(n[:, 0], n[:, 1])
+    n_hat = np.full_like(n, np.sqrt(0.5))
+    n_hat[:, 1] *= -1
+    ok = norm > 0
+    n_hat[ok] = n[ok] / norm[ok, None]
+    # vertical track
+    s_yy = d_prev[:, 1] ** 2 + d_next[:, 1] ** 2
+    n_hat[~ok & (s_yy > 0)] = (1.0, 0.0)
+    return n_hat
+
+
+def _track_envelope(gdf, main_pts):
+    if main_pts.shape[0] == 0:
+        return ()
+
+    u = np.column_stack([main_pts.geometry.x, main_pts.geometry.y])
+    n_hat = track_normals(u)
+
+    # project the points of every center to the normal line of the main track
+    # point with the same time, for all times at once
+    pts = pd.DataFrame(
+        {
+            "Timestamp": gdf["Timestamp"].values,
+            "x": gdf.geometry.x.values,
+            "y": gdf.geometry.y.values,
+            "order": np.arange(gdf.shape[0]),
+        }
+    )
+    main = pd.DataFrame(
+        {"Timestamp": main_pts["Timestamp"].values, "i": np.arange(len(u))}
+    )
+    pts = main.iloc[1:].merge(pts, on="Timestamp").sort_values(["i", "order"])
+    i = pts["i"].values
+    xy = pts[["x", "y"]].values
+    pts["d"] = np.einsum("ij,ij->i", xy - u[i], n_hat[i])
+
+    # keep only the edges
+    groups = pts.groupby("i", sort=True)["d"]
+    edges = pd.DataFrame({"min": groups.idxmin(), "max": groups.idxmax()})
+    edges = edges.loc[groups.size() > 1]
+    i = edges.index.values
+    d_min = pts.loc[edges["min"], "d"].values
+    d_max = pts.loc[edges["max"], "d"].values
+
+    bnd_pts1 = [
+        [u[0]] + list(pts.loc[edges["min"], ["x", "y"]].values),
+        [u[0]] + list(pts.loc[edges["max"], ["x", "y"]].values),
+    ]
+    bnd_pts2 = [
+        [u[0]] + list(u[i] + d_min[:, None] * n_hat[i]),
+        [u[0]] + list(u[i] + d_max[:, None] * n_hat[i]),
+    ]
+
+    if (len(bnd_pts1[0]) < 2) or (len(bnd_pts1[1]) < 2):
         return ()
 
     return (
@@ -107,43 +151,129 @@ def generate_track_envelope(pts_gdf, main_track="JTWC"):
     )
 
 
+def generate_track_envelope(pts_gdf, main_track="JTWC"):
+    gdf = _forecast_pts(pts_gdf)
+    main_pts = gdf.loc[gdf["Center"].str.contains(main_track)]
+    return _track_envelope(gdf, main_pts)
+
+
+def generate_track_envelopes(pts_gdf, centers=None):
+    """Generate the track envelope around the forecast of every center
+
+    Input:
+    pts_gdf (geopandas.GeoDataFrame) -- track points
+    centers (list) -- centers to use as main track, defaults to all centers
+
+    Output:
+    envelopes (dict) -- center -> envelope layers (see generate_track_envelope)
+    """
+    gdf = _forecast_pts(pts_gdf)
+    if centers is None:
+        centers = [c.replace("_forecast", "") for c in gdf["Center"].unique()]
+    envelopes = {}
+    for center in centers:
+        main_pts = gdf.loc[gdf["Center"] == f"{center}_forecast"]
+        track_bnds = _track_envelope(gdf, main_pts)
+        if len(track_bnds) > 0:
+            envelopes[center] = track_bnds
+    return envelopes
+
+
+def quadrant_radii(gdf, radius):
+    """Wind radii of each quadrant
+
+    Points without per-quadrant radii use the radius in all quadrants and
+    missing quadrants of the other points get a radius of 0.
+
+    Input:
+    gdf (geopandas.GeoDataFrame) -- track points
+    radius (str) -- 'R34', 'R50' or 'R64'
+
+    Output:
+    radii (numpy.ndarray) -- (n, 4) radii in km of the NE, SE, SW and NW quadrants
+    """
+    r = gdf[radius].values.astype(float)
+    radii = np.repeat(r[:, None], 4, axis=1)
+    cols = [f"{radius}_{q}" for q in QUADRANTS]
+    if all(c in gdf.columns for c in cols):
+        quad = gdf[cols].values.astype(float)
+        has_quad = ~np.isnan(quad).all(axis=1)
+        radii[has_quad] = np.nan_to_num(quad[has_quad])
+    return radii
+
+
+def geodesic_offsets(lon, lat, az, dist):
+    """Points at the given bearings and distances from the centers
+
+    Input:
+    lon, lat (numpy.ndarray) -- (n,) coordinates of the centers in degrees
+    az (numpy.ndarray) -- (n, m) bearings in degrees clockwise from north
+    dist (numpy.ndarray) -- (n, m) distances in km
+
+    Output:
+    lon2, lat2 (numpy.ndarray) -- (n, m) coordinates of the points
+    """
+    az, dist = np.broadcast_arrays(az, dist)
+    lon = np.broadcast_to(np.asarray(lon, dtype=float)[:, None], az.shape)
+    lat = np.broadcast_to(np.asarray(lat, dtype=float)[:, None], az.shape)
+    lon2, lat2, _ = GEOD.fwd(
+        lon.ravel(), lat.ravel(), az.ravel(), dist.ravel() * 1000.0
+    )
+    return lon2.reshape(az.shape), lat2.reshape(az.shape)
+
+
+def geodesic_rings(lon, lat, radii, quad_segs=16):
+    """Polygons enclosing the wind radii of each center on the ellipsoid
+
+    Input:
+    lon, lat (numpy.ndarray) -- (n,) coordinates of the centers in degrees
+    radii (numpy.ndarray) -- (n, 4) radii in km of the NE, SE, SW and NW quadrants
+    quad_segs (int) -- number of segments per quadrant
+
+    Output:
+    rings (numpy.ndarray) -- (n,) shapely Polygons
+    """
+    q = np.repeat(np.arange(4), quad_segs + 1)
+    az = np.concatenate(
+        [np.linspace(90 * i, 90 * (i + 1), quad_segs + 1) for i in range(4)]
+    )
+    lon2, lat2 = geodesic_offsets(lon, lat, az[None, :], radii[:, q])
+    return shapely.polygons(np.stack([lon2, lat2], axis=-1))
+
+
 def generate_radius_envelope(pts_gdf, main_track="JTWC"):
-    gdf = pts_gdf.loc[pts_gdf["Center"].str.contains("forecast")].copy()
-    gdf["ts"] = pd.to_datetime(gdf["Date"], format="%b %d %I %p")
-    gdf.sort_values(["Center", "ts"], inplace=True)
-    gdf.drop(columns="ts", inplace=True)
-
-    main_pts = (
-        gdf.loc[gdf["Center"].str.contains(main_track)].reset_index(drop=True).copy()
-    )
-    bnd_r = {k: [[], []] for k in ["R34", "R50", "R64"]}
-    for i, r in main_pts.iterrows():
-        i_min = i - 1
-        if i == 0:
-            i_min = i
-        i_max = i + 2
-        # slope m of tangent line at current point
-        X = np.array([pt.coords[0][0] for pt in main_pts.iloc[i_min:i_max].geometry])
-        Y = np.array([pt.coords[0][1] for pt in main_pts.iloc[i_min:i_max].geometry])
-        u = np.array(r.geometry.coords[0])
-        (m,), pcov = curve_fit(lambda x, m: m * (x - u[0]) + u[1], X, Y)
-        m = np.abs(m)
-
-        # unit vector normal to the current point
-        n = np.array((1, -1 / m))
-        n_hat = n / np.linalg.norm(n)
-
-        for k in bnd_r.keys():
-            if not np.isnan(r[k]):
-                d_r = r[k] / 111
-                bnd_r[k][0].append(u + d_r * n_hat)
-                bnd_r[k][1].append(u - d_r * n_hat)
-
-    bnd_r = [
-        {"name": k, "geometry": Polygon(v[0] + v[1][::-1])}
-        for k, v in bnd_r.items()
-        if len(v[0]) > 0
-    ]
+    gdf = _forecast_pts(pts_gdf)
+    main_pts = gdf.loc[gdf["Center"].str.contains(main_track)]
+    if main_pts.shape[0] == 0:
+        return None
+
+    u = np.column_stack([main_pts.geometry.x, main_pts.geometry.y])
+    n_hat = track_normals(u)
+
+    # bearings of both sides of the normal, the radius is taken from the
+    # quadrant the bearing falls in
+    az = np.degrees(np.arctan2(n_hat[:, 0], n_hat[:, 1]))
+    az = np.mod(np.column_stack([az, az + 180]), 360)
+    q = np.minimum((az // 90).astype(int), 3)
+
+    bnd_r = []
+    for k in WIND_RADII:
+        radii = quadrant_radii(main_pts, k)
+        ok = ~np.isnan(main_pts[k].values.astype(float))
+        n_ok = np.count_nonzero(ok)
+        if n_ok == 0:
+            continue
+        if n_ok == 1:
+            # a single point has no envelope, only its own wind radius
+            geom = generate_radius(main_pts.loc[ok], k).geometry.iloc[0]
+        else:
+            dist = np.take_along_axis(radii[ok], q[ok], axis=1)
+            lon2, lat2 = geodesic_offsets(u[ok, 0], u[ok, 1], az[ok], dist)
+            bnd1 = np.column_stack([lon2[:, 0], lat2[:, 0]])
+            bnd2 = np.column_stack([lon2[:, 1], lat2[:, 1]])
+            geom = Polygon(np.concatenate([bnd1, bnd2[::-1]]))
+        bnd_r.append({"name": k, "geometry": geom})
+
     if len(bnd_r) > 0:
         return GeoDataFrame(
             bnd_r,
@@ -153,17 +283,306 @@ def generate_radius_envelope(pts_gdf, main_track="JTWC"):
     return None
 
 
+def generate_radii(gdf, radii=WIND_RADII):
+    """Generate the wind radii polygons of all points in one batch
+
+    Input:
+    gdf (geopandas.GeoDataFrame) -- track points
+    radii (list) -- wind radii columns
+
+    Output:
+    res (dict) -- radius -> GeoDataFrame of the points with that radius
+    """
+    subsets = {}
+    for radius in radii:
+        if radius in gdf.columns:
+            subset = gdf.dropna(subset=[radius])
+            if subset.shape[0] > 0:
+                subsets[radius] = subset
+    if len(subsets) == 0:
+        return {}
+
+    lon = np.concatenate([s.geometry.x.values for s in subsets.values()])
+    lat = np.concatenate([s.geometry.y.values for s in subsets.values()])
+    rad = np.concatenate([quadrant_radii(s, k) for k, s in subsets.items()])
+    rings = geodesic_rings(lon, lat, rad)
+
+    res = {}
+    i = 0
+    for radius, subset in subsets.items():
+        n = subset.shape[0]
+        res[radius] = GeoDataFrame(subset, geometry=rings[i : i + n], crs=PROJ_CRS)
+        i += n
+    return res
+
+
 def generate_radius(gdf, radius):
-    if radius in gdf.columns:
-        gdf = gdf.dropna(subset=[radius])
-        if gdf.shape[0] > 0:
-            geometry = gdf.apply(lambda x: x.geometry.buffer(x[radius] / 111.0), axis=1)
-            return GeoDataFrame(gdf, geometry=geometry, crs=PROJ_CRS)
-    return None
+    return generate_radii(gdf, [radius]).get(radius)
+
+
+def generate_consensus(cons_df):
+    """Generate the consensus layers
+
+    Input:
+    cons_df (pandas.DataFrame) -- consensus positions, see consensus_track
+
+    Output:
+    layers (list) -- (name, GeoDataFrame) of the consensus points, its track
+        and the band of the cross-track spread on both sides of the track
+    """
+    if cons_df.shape[0] == 0:
+        return []
+    geom = points_from_xy(cons_df["Lon"], cons_df["Lat"], crs=PROJ_CRS)
+    pts_gdf = GeoDataFrame(cons_df, crs=PROJ_CRS, geometry=geom)
+    layers = [("consensus/pts", pts_gdf)]
+    if cons_df.shape[0] < 2:
+        return layers
+    layers.append(
+        (
+            "consensus/line",
+            GeoDataFrame(
+                [{"Center": "CONSENSUS", "geometry": LineString(geom)}], crs=PROJ_CRS
+            ),
+        )
+    )
+
+    ok = cons_df[["Heading", "CrossSprd"]].notna().all(axis=1).values
+    if ok.sum() < 2:
+        return layers
+    heading = cons_df["Heading"].values[ok]
+    az = np.column_stack([heading - 90, heading + 90])
+    dist = np.repeat(cons_df["CrossSprd"].values[ok, None], 2, axis=1)
+    lon2, lat2 = geodesic_offsets(
+        cons_df["Lon"].values[ok], cons_df["Lat"].values[ok], az, dist
+    )
+    bnd1 = np.column_stack([lon2[:, 0], lat2[:, 0]])
+    bnd2 = np.column_stack([lon2[:, 1], lat2[:, 1]])
+    layers.append(
+        (
+            "consensus/bnds",
+            GeoDataFrame(
+                [
+                    {
+                        "name": "cross_spread",
+                        # the band pinches where the spread is 0
+                        "geometry": shapely.make_valid(
+                            Polygon(np.concatenate([bnd1, bnd2[::-1]]))
+                        ),
+                    }
+                ],
+                crs=PROJ_CRS,
+            ),
+        )
+    )
+    return layers
+
+
+def append_gpkg(src, dst):
+    """Add the layers of a GeoPackage to another one in a single transaction
+
+    The tables of the layers (with their spatial indexes and triggers) are
+    created in dst and filled from src, and their rows of the GeoPackage
+    tables are added, all within one SQLite transaction: readers see either
+    none or all of the new layers, and a failure leaves dst as it was. Only
+    the new layers are written, the others are kept as they are. Layers of
+    dst with the same names are replaced.
 
+    Input:
+    src (pathlib.Path) -- GeoPackage with the new layers
+    dst (pathlib.Path) -- the GeoPackage they are added to
+    """
+    con = sqlite3.connect(dst, isolation_level=None)
 
-def make_shp(in_file, out_dir=OUTPUT_DIR, main_track="JTWC"):
-    df = pd.read_csv(in_file)
+    def objects(schema):
+        return con.execute(
+            f"SELECT type, name, sql FROM {schema}.sqlite_master"
+            " WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+
+    def tables(schema):
+        return {name for obj_type, name, _ in objects(schema) if obj_type == "table"}
+
+    try:
+        con.execute("ATTACH DATABASE ? AS src", (str(src),))
+        layers = [r[0] for r in con.execute("SELECT table_name FROM src.gpkg_contents")]
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            # the layers of an earlier run with the same names
+            for name in layers:
+                # dropping a spatial index also drops its shadow tables
+                for _, table, sql in objects("main"):
+                    if sql.upper().startswith("CREATE VIRTUAL") and table.startswith(
+                        f"rtree_{name}_"
+                    ):
+                        con.execute(f'DROP TABLE main."{table}"')
+                con.execute(f'DROP TABLE IF EXISTS main."{name}"')
+                for meta in GPKG_META_TABLES[1:]:
+                    if meta in tables("main"):
+                        con.execute(
+                            f'DELETE FROM main."{meta}" WHERE table_name = ?', (name,)
+                        )
+
+            existing = {name for _, name, _ in objects("main")}
+            new = [obj for obj in objects("src") if obj[1] not in existing]
+            virtual = [
+                obj for obj in new if obj[2].upper().startswith("CREATE VIRTUAL")
+            ]
+            # the spatial indexes create their own shadow tables
+            for _, _, sql in virtual:
+                con.execute(sql)
+            created = tables("main")
+            new_tables = [
+                (name, sql)
+                for obj_type, name, sql in new
+                if obj_type == "table" and name not in created
+            ]
+            for _, sql in new_tables:
+                con.execute(sql)
+            for name in [name for name, _ in new_tables] + [o[1] for o in virtual]:
+                con.execute(f'INSERT INTO main."{name}" SELECT * FROM src."{name}"')
+            for meta in GPKG_META_TABLES:
+                if meta in created:
+                    con.execute(
+                        f'INSERT OR IGNORE INTO main."{meta}" SELECT * FROM src."{meta}"'
+                    )
+            # the triggers only apply to the next changes
+            for obj_type, _, sql in new:
+                if obj_type in ("index", "trigger"):
+                    con.execute(sql)
+            con.execute("COMMIT")
+        except BaseException:
+            con.execute("ROLLBACK")
+            raise
+    finally:
+        con.close()
+
+
+class LayerWriter:
+    """Write the layers of a run
+
+    'shp' writes every layer into its own Shapefile directory, as before.
+    'gpkg' collects the layers and writes them into a single GeoPackage when
+    the writer is closed: the layers go into a new file which then replaces
+    the original, or with a run id are added to a copy of it (see append_gpkg),
+    so a failed run never leaves a partially written GeoPackage behind.
+    'parquet' writes a GeoParquet file per layer (requires pyarrow).
+    The time spent writing each layer is kept in 'timings'.
+
+    Files are not changed in place: a layer replaces the files of an earlier
+    layer with the same name, so that they can be hardlinked when published.
+    The layers of a run id are added to a copy of the GeoPackage, which then
+    replaces it, so the GeoPackage published by the earlier runs keeps its
+    layers.
+
+    Input:
+    out_dir (pathlib.Path) -- output directory, or the GeoPackage file
+    out_format (str) -- 'shp', 'gpkg' or 'parquet'
+    run_id (str) -- appended to the layer names, so that every run adds a new
+        set of layers to the existing GeoPackage/GeoParquet files instead of
+        replacing them
+    zip_stream (ZipStream) -- zip the Shapefile layers are added to, see
+        archive()
+    """
+
+    def __init__(self, out_dir, out_format="shp", run_id=None, zip_stream=None):
+        if out_format not in OUTPUT_FORMATS:
+            raise ValueError(f"'out_format' should be one of {OUTPUT_FORMATS}")
+        out_dir = Path(out_dir)
+        if out_format == "gpkg" and out_dir.suffix != ".gpkg":
+            out_dir = out_dir / "layers.gpkg"
+        self.out_dir = out_dir
+        self.out_format = out_format
+        self.run_id = run_id
+        self.zip_stream = zip_stream
+        self.layers = {}
+        self.timings = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+
+    def layer_name(self, name):
+        """Name of the layer in the GeoPackage/GeoParquet output
+
+        'track_bnds/line1' becomes 'track_bnds_line1', followed by the run id
+        if there is one.
+        """
+        name = name.replace("/", "_")
+        if self.run_id is not None:
+            name = f"{name}_{self.run_id}"
+        return name
+
+    def write(self, name, gdf):
+        t0 = time.perf_counter()
+        if self.out_format == "shp":
+            _out_dir = self.out_dir / name
+            _out_dir.parent.mkdir(parents=True, exist_ok=True)
+            # the layer of an earlier run with the same name is replaced
+            if _out_dir.is_dir():
+                shutil.rmtree(_out_dir)
+            # Shapefiles have no datetime type, the 'Date' label is kept instead
+            gdf.drop(columns="Timestamp", errors="ignore").to_file(_out_dir)
+        elif self.out_format == "parquet":
+            self.out_dir.mkdir(parents=True, exist_ok=True)
+            out_file = self.out_dir / f"{self.layer_name(name)}.parquet"
+            out_file.unlink(missing_ok=True)
+            gdf.to_parquet(out_file)
+        else:
+            # GeoPackage datetimes are in UTC
+            if "Timestamp" in gdf.columns:
+                gdf = gdf.assign(Timestamp=gdf["Timestamp"].dt.tz_convert("UTC"))
+            self.layers[name] = gdf
+        self.timings[name] = time.perf_counter() - t0
+
+    def archive(self, name):
+        """Add a written Shapefile layer to the zip, timed by the zip itself"""
+        if self.out_format == "shp" and self.zip_stream is not None:
+            self.zip_stream.add(self.out_dir, name)
+
+    def close(self):
+        if self.out_format != "gpkg" or len(self.layers) == 0:
+            return
+        out_file = self.out_dir
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = out_file.parent / f".{out_file.stem}.tmp.gpkg"
+        copy_file = out_file.parent / f".{out_file.stem}.append.gpkg"
+        tmp_file.unlink(missing_ok=True)
+        try:
+            for name, gdf in self.layers.items():
+                t0 = time.perf_counter()
+                gdf.to_file(tmp_file, layer=self.layer_name(name), driver="GPKG")
+                self.timings[name] += time.perf_counter() - t0
+            if self.run_id is not None and out_file.exists():
+                # the published runs hardlink the GeoPackage, it is not added to
+                shutil.copyfile(out_file, copy_file)
+                append_gpkg(tmp_file, copy_file)
+                os.replace(copy_file, out_file)
+                tmp_file.unlink()
+            else:
+                os.replace(tmp_file, out_file)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            copy_file.unlink(missing_ok=True)
+            raise
+        self.layers = {}
+
+
+def split_forecasts(df):
+    """Positions with the forecast of every center as a separate track
+
+    The forecast of a center with a current position becomes the
+    '{CENTER}_forecast' track, which starts at the current position.
+
+    Input:
+    df (pandas.DataFrame) -- positions, one track per center
+
+    Output:
+    df (pandas.DataFrame) -- positions with the '{CENTER}_forecast' tracks
+    """
+    df = df.reset_index(drop=True)
     for center_name in df["Center"].unique():
         row_to_insert = df[
             (df["Center"] == center_name) & (df["PosType"] == "c")
@@ -180,52 +599,253 @@ def make_shp(in_file, out_dir=OUTPUT_DIR, main_track="JTWC"):
                 [df.iloc[0 : row_split_index + 1], row_to_insert], ignore_index=True
             )
             df = pd.concat([df2, df.iloc[row_split_index + 1 :]], ignore_index=True)
+    return df
 
-    out_dir.mkdir(parents=True, exist_ok=True)
-    # generate spatial points from dataframe
-    geom = points_from_xy(df["Lon"], df["Lat"], crs=PROJ_CRS)
-    pts_gdf = GeoDataFrame(df.copy(), crs=PROJ_CRS, geometry=geom)
-    _out_dir = out_dir / "track_pts"
-    pts_gdf.to_file(_out_dir)
-
-    # connect the dots
-    lns_gdf = pts_gdf.copy().groupby("Center").filter(lambda x: len(x) > 1)
-    lns_gdf = lns_gdf.groupby("Center")["geometry"].apply(
-        lambda x: LineString(x.tolist())
-    )
-    lns_gdf = GeoDataFrame(lns_gdf.reset_index(), geometry="geometry", crs=PROJ_CRS)
-    _out_dir = out_dir / "track_line"
-    lns_gdf.to_file(_out_dir)
-
-    # generate envelope from multitrack
-    track_bnds = generate_track_envelope(pts_gdf, main_track)
-    for i, track_bnd in enumerate(track_bnds):
-        if (i % 2) == 0:
-            _out_dir = out_dir / f"track_bnds/line{int(i / 2) + 1}"
-        else:
-            _out_dir = out_dir / f"track_bnds/poly{int(i / 2) + 1}"
-        _out_dir.parent.mkdir(parents=True, exist_ok=True)
-        track_bnd.to_file(_out_dir)
-
-    # generate concentric circles from wind radii
-    rad_gdf = pts_gdf[pts_gdf["Center"] == "JTWC_forecast"].copy()
-    for r in ["R34", "R50", "R64"]:
-        s = generate_radius(rad_gdf, r)
-        if s is not None:
-            _out_dir = out_dir / f"jtwc_rad/{r.lower()}"
-            _out_dir.parent.mkdir(parents=True, exist_ok=True)
-            s.to_file(_out_dir)
-            _s = s.dissolve("Center")
-            _out_dir = out_dir / f"jtwc_rad2/{r.lower()}"
-            _out_dir.parent.mkdir(parents=True, exist_ok=True)
-            _s.to_file(_out_dir)
 
-    # generate envelope from wind radii
-    rad_bnds = generate_radius_envelope(pts_gdf, main_track)
-    if rad_bnds is not None:
-        _out_dir = out_dir / "track_bnds/wind_radii"
-        _out_dir.parent.mkdir(parents=True, exist_ok=True)
-        rad_bnds.to_file(_out_dir)
+def make_shp(
+    in_file,
+    out_dir=OUTPUT_DIR,
+    main_track="JTWC",
+    all_envelopes=False,
+    out_format="shp",
+    run_id=None,
+    workers=1,
+    zip_stream=None,
+    interp_freq=None,
+    interp_method="cubic",
+    consensus=None,
+):
+    """Generate the track, envelope and wind radii layers
+
+    Independent layers (see layer_steps) can be generated and written
+    concurrently, with the same output as the sequential mode.
+
+    Input:
+    in_file (str or pandas.DataFrame) -- the CSV generated by cron_multi, or
+        its data with the tz-aware 'Timestamp' column
+    out_dir (pathlib.Path) -- output directory, or the GeoPackage file
+    main_track (str) -- center whose forecast the track envelope follows
+    all_envelopes (bool) -- also generate the envelope of every center
+    out_format (str) -- 'shp', 'gpkg' or 'parquet', see LayerWriter
+    run_id (str) -- if given, the layers of the run are added to the existing
+        GeoPackage/GeoParquet output under names ending with the run id
+    workers (int) -- number of threads generating and writing the layers
+    zip_stream (ZipStream) -- zip the Shapefile layers are added to as they
+        are written, in the order of the steps
+    interp_freq (str) -- if given, e.g. '1h', also write the track of every
+        center resampled to this spacing (see interpolate_tracks)
+    interp_method (str) -- interpolation of the positions, 'cubic' or 'linear'
+    consensus (pandas.DataFrame) -- if given, also write the consensus layers
+        (see consensus_track)
+
+    Output:
+    timings (dict) -- 'steps': step -> time spent computing it, 'layers':
+        layer -> time spent writing it, in s
+    """
+    if isinstance(in_file, pd.DataFrame):
+        df = in_file.reset_index(drop=True)
+    else:
+        df = pd.read_csv(in_file)
+        df["Timestamp"] = read_timestamps(df)
+    track_df = df
+    df = split_forecasts(df)
+
+    with LayerWriter(out_dir, out_format, run_id, zip_stream) as writer:
+        steps = layer_steps(
+            df,
+            main_track,
+            all_envelopes,
+            track_df,
+            interp_freq,
+            interp_method,
+            consensus,
+        )
+        step_timings = run_steps(steps, writer, workers)
+    return {"steps": step_timings, "layers": writer.timings}
+
+
+def _track_bnds_layers(prefix, track_bnds):
+    return [
+        (f"{prefix}/{'line' if i % 2 == 0 else 'poly'}{i // 2 + 1}", track_bnd)
+        for i, track_bnd in enumerate(track_bnds)
+    ]
+
+
+def layer_steps(
+    df,
+    main_track="JTWC",
+    all_envelopes=False,
+    track_df=None,
+    interp_freq=None,
+    interp_method="cubic",
+    cons_df=None,
+):
+    """Steps generating the layers, as a dependency graph
+
+    Every step takes the values of the steps it depends on and returns its
+    own value with the layers it produced. The steps are listed in the order
+    of the sequential mode, which is also the order of the GeoPackage layers.
+
+    Input:
+    df (pandas.DataFrame) -- positions, with the '{CENTER}_forecast' tracks
+    main_track (str) -- center whose forecast the track envelope follows
+    all_envelopes (bool) -- also generate the envelope of every center
+    track_df (pandas.DataFrame) -- positions without the '{CENTER}_forecast'
+        tracks, resampled when interp_freq is given
+    interp_freq (str) -- spacing of the resampled tracks, e.g. '1h'
+    interp_method (str) -- interpolation of the positions, 'cubic' or 'linear'
+    cons_df (pandas.DataFrame) -- consensus positions, see consensus_track
+
+    Output:
+    steps (dict) -- name -> (names of the dependencies, function)
+    """
+
+    def track_pts():
+        # generate spatial points from dataframe
+        geom = points_from_xy(df["Lon"], df["Lat"], crs=PROJ_CRS)
+        pts_gdf = GeoDataFrame(df.copy(), crs=PROJ_CRS, geometry=geom)
+        return pts_gdf, [("track_pts", pts_gdf)]
+
+    def track_line(pts_gdf):
+        # connect the dots
+        lns_gdf = pts_gdf.copy().groupby("Center").filter(lambda x: len(x) > 1)
+        lns_gdf = lns_gdf.groupby("Center")["geometry"].apply(
+            lambda x: LineString(x.tolist())
+        )
+        lns_gdf = GeoDataFrame(lns_gdf.reset_index(), geometry="geometry", crs=PROJ_CRS)
+        return None, [("track_line", lns_gdf)]
+
+    def track_bnds(pts_gdf):
+        # generate envelope from multitrack
+        track_bnds = generate_track_envelope(pts_gdf, main_track)
+        return None, _track_bnds_layers("track_bnds", track_bnds)
+
+    def center_bnds(pts_gdf):
+        # generate envelopes around the forecast of every center
+        layers = []
+        for center, track_bnds in generate_track_envelopes(pts_gdf).items():
+            layers += _track_bnds_layers(f"track_bnds/{center}", track_bnds)
+        return None, layers
+
+    def radii(pts_gdf):
+        # generate concentric circles from wind radii
+        rad_gdf = pts_gdf[pts_gdf["Center"] == "JTWC_forecast"].copy()
+        return generate_radii(rad_gdf), []
+
+    def radius(r):
+        def step(rad_gdfs):
+            s = rad_gdfs.get(r)
+            if s is None:
+                return None, []
+            return None, [
+                (f"jtwc_rad/{r.lower()}", s),
+                (f"jtwc_rad2/{r.lower()}", s.dissolve("Center")),
+            ]
+
+        return step
+
+    def wind_radii(pts_gdf):
+        # generate envelope from wind radii
+        rad_bnds = generate_radius_envelope(pts_gdf, main_track)
+        if rad_bnds is None:
+            return None, []
+        return None, [("track_bnds/wind_radii", rad_bnds)]
+
+    def track_interp():
+        # resample the track of every center to a shared time grid
+        interp_df = interpolate_tracks(track_df, interp_freq, interp_method)
+        geom = points_from_xy(interp_df["Lon"], interp_df["Lat"], crs=PROJ_CRS)
+        interp_gdf = GeoDataFrame(interp_df, crs=PROJ_CRS, geometry=geom)
+        return None, [("track_interp", interp_gdf)]
+
+    def consensus():
+        # consensus of the forecasts of all centers and its spread
+        return None, generate_consensus(cons_df)
+
+    steps = {
+        "track_pts": ((), track_pts),
+        "track_line": (("track_pts",), track_line),
+        "track_bnds": (("track_pts",), track_bnds),
+    }
+    if all_envelopes:
+        steps["center_bnds"] = (("track_pts",), center_bnds)
+    steps["radii"] = (("track_pts",), radii)
+    for r in WIND_RADII:
+        steps[f"radius_{r.lower()}"] = (("radii",), radius(r))
+    steps["wind_radii"] = (("track_pts",), wind_radii)
+    if interp_freq and track_df is not None:
+        steps["track_interp"] = ((), track_interp)
+    if cons_df is not None:
+        steps["consensus"] = ((), consensus)
+    return steps
+
+
+def run_steps(steps, writer, workers=1):
+    """Run the steps and write their layers
+
+    With more than one worker, every step runs (and writes its layers) as
+    soon as its dependencies are done, in a thread pool. Each layer is still
+    written by a single call, so the files are the same as in the sequential
+    mode. The layers are handed over in the order of the steps, as soon as a
+    step and the ones before it are done: the GeoPackage layers are only
+    collected by the writer, the Shapefile layers are added to the zip, which
+    is then the same as in the sequential mode.
+
+    Input:
+    steps (dict) -- name -> (names of the dependencies, function), see
+        layer_steps
+    writer (LayerWriter) -- writer of the layers
+    workers (int) -- number of threads, 1 to run the steps in order
+
+    Output:
+    timings (dict) -- step -> time spent computing its value and layers, in s
+    """
+    values = {}
+    timings = {}
+    results = {}
+
+    def run(name):
+        deps, func = steps[name]
+        t0 = time.perf_counter()
+        values[name], layers = func(*[values[dep] for dep in deps])
+        timings[name] = time.perf_counter() - t0
+        if writer.out_format != "gpkg":
+            for layer, gdf in layers:
+                writer.write(layer, gdf)
+        return layers
+
+    def hand_over(name):
+        for layer, gdf in results[name]:
+            if writer.out_format == "gpkg":
+                writer.write(layer, gdf)
+            else:
+                writer.archive(layer)
+
+    order = list(steps)
+    if workers <= 1:
+        for name in order:
+            results[name] = run(name)
+            hand_over(name)
+        return timings
+
+    pending = dict(steps)
+    n_done = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        running = {}
+        while len(pending) > 0 or len(running) > 0:
+            for name, (deps, _) in list(pending.items()):
+                if all(dep in results for dep in deps):
+                    running[executor.submit(run, name)] = name
+                    del pending[name]
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                # a failed step stops the run once the running steps are done
+                results[running.pop(future)] = future.result()
+            while n_done < len(order) and order[n_done] in results:
+                hand_over(order[n_done])
+                n_done += 1
+
+    return {name: timings[name] for name in steps}
 
 
 if __name__ == "__main__":
@@ -234,5 +854,67 @@ if __name__ == "__main__":
     parser.add_argument(
         "--out-dir", help="Output directory of the shp files", default=OUTPUT_DIR
     )
+    parser.add_argument("--main-track", help="Main track", default="JTWC")
+    parser.add_argument(
+        "--all-envelopes",
+        help="Also generate the track envelope of every center",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--format",
+        help="Output format of the layers",
+        choices=OUTPUT_FORMATS,
+        default="shp",
+    )
+    parser.add_argument(
+        "--run-id",
+        help="Add the layers to the existing GeoPackage/GeoParquet output, "
+        "with names ending with the run id",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of threads generating and writing the layers",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--interp-freq",
+        help="Also write the tracks resampled to this spacing, e.g. 1h",
+    )
+    parser.add_argument(
+        "--interp-method",
+        help="Interpolation of the resampled positions",
+        choices=INTERP_METHODS,
+        default="cubic",
+    )
+    parser.add_argument(
+        "--consensus",
+        help="Also write the consensus of the forecasts and their spread",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--timings", help="Print the time spent on every layer", action="store_true"
+    )
     args = parser.parse_args()
-    make_shp(args.input, args.out_dir)
+    consensus = None
+    if args.consensus:
+        in_df = pd.read_csv(args.input)
+        in_df["Timestamp"] = read_timestamps(in_df)
+        consensus = consensus_track(in_df, args.interp_freq or "1h", args.interp_method)
+    timings = make_shp(
+        args.input,
+        Path(args.out_dir),
+        args.main_track,
+        args.all_envelopes,
+        args.format,
+        args.run_id,
+        args.workers,
+        interp_freq=args.interp_freq,
+        interp_method=args.interp_method,
+        consensus=consensus,
+    )
+    if args.timings:
+        for kind, times in timings.items():
+            print(f"{kind}:")
+            for name, elapsed in times.items():
+                print(f"  {name:<32} {elapsed * 1e3:8.1f} ms")
@@ -1,79 +1,133 @@
 import re
 from datetime import datetime
 
+import numpy as np
 import pandas as pd
-import requests
-from _const_ import REQ_HEADER
-from _helper_ import knots_to_cat, knots_to_kph, nm_to_km, parse_lat, parse_lon
-
-
-def parse_time(str):
-    """Extract Timestamp information from the string
-
-    Input:
-    str (str) -- the string input
-
-    Output:
-    timestamp (str) -- timestamp
-    """
-    res = re.search(r"([0-9]{6})Z", str)
-    if res is not None:
-        return res.group(1)
-
-
-def parse_vmax(str):
-    """Extract maximum sustained wind speed from the string
-
-    Input:
-    str (str) -- the string input
-
-    Output:
-    vmax (int) -- maximum sustained winds in knots
-    """
-    res = re.search(r"MAX\ SUSTAINED\ WINDS\ - ([0-9]*)\ KT", str)
-    if res is not None:
-        return int(res.group(1))
-
-
-def parse_wind_rad(str):
-    """Extract wind radius from the string
-
-    Input:
-    str (str) -- the string input
-
-    Output:
-    rad_wind (pandas.core.series.Series) -- series containing wind information
-    """
-    wind_df = pd.DataFrame(
-        columns=["WRAD", "NORTHEAST", "SOUTHEAST", "SOUTHWEST", "NORTHWEST"]
-    )
-    wind_arr = []
-    for m in re.finditer(
-        r"RADIUS OF ([0-9]*) KT WINDS - ([0-9]* NM [A-Z]{9} QUADRANT ){1,4}", str
-    ):
-        d = {"WRAD": int(m.group(1))}
-        str2 = str[m.start() : m.end()]
-        for n in re.finditer(r"([0-9]*) NM ([A-Z]{9}) QUADRANT", str2):
-            d[n.group(2)] = int(n.group(1))
-        wind_arr.append(d)
-        # wind_df = pd.concat([wind_df, pd.DataFrame(d, index=0)], ignore_index=True)
-    wind_df = pd.concat([wind_df, pd.DataFrame(wind_arr)], ignore_index=True)
-    wind_df.set_index("WRAD", inplace=True)
-    return wind_df.max(axis=1)
-
-
-def parse_forecast_time(str):
-    """Extract forecast time from the string
+from _archive_ import read_text
+from _fetch_ import download
+from _helper_ import (
+    LOCAL_TZ,
+    QUADRANT_COLS,
+    QUADRANTS,
+    WIND_RADII,
+    knots_to_cat_array,
+    knots_to_kph_array,
+    nm_to_km_array,
+)
+
+# Tokens of a JTWC warning, matched in a single scan of the text
+TOKEN_RE = re.compile(
+    r"(?P<warn>WARNING\s+POSITION)"
+    r"|(?P<fcst>FORECASTS)"
+    r"|(?P<sep>---)"
+    r"|(?P<rad>RADIUS\s+OF\s+(?P<wrad>[0-9]*)\s+KT\s+WINDS\s+-\s+"
+    r"(?:[0-9]*\s+NM\s+[A-Z]{9}\s+QUADRANT\s+){1,4})"
+    r"|(?P<vmax>MAX\s+SUSTAINED\s+WINDS\s+-\s+(?P<vmax_val>[0-9]*)\s+KT)"
+    r"|(?P<wind>WIND)"
+    r"|(?P<tau>(?P<tau_val>[0-9]{2,})\s+HRS)"
+    r"|(?P<hrs>HRS)"
+    r"|(?P<time>(?P<time_val>[0-9]{6})Z)"
+    r"|(?P<coord>(?P<coord_val>[0-9]+\.[0-9]+)(?P<hemi>[NSEW]))"
+)
+
+QUADRANT_RE = re.compile(r"([0-9]*)\s+NM\s+([A-Z]{9})\s+QUADRANT")
+
+
+def _new_block():
+    return {
+        "hrs": False,
+        "tau": None,
+        "wind": False,
+        "time": None,
+        "lat": None,
+        "lon": None,
+        "vmax": None,
+        "rad": {},
+    }
+
+
+def parse_warning(data):
+    """Extract the warning position and the forecasts from a JTWC warning
+
+    The text is scanned once. The forecast section is split into blocks at
+    '---': blocks mentioning 'HRS' give the forecast times and blocks
+    mentioning 'WIND' give the forecast positions, which are paired in order.
 
     Input:
-    str (str) -- the string input
+    data (str) -- the warning text
 
     Output:
-    toff (int) -- forecast time in hr
+    time (str) -- time of the warning position as 'DDHHMM'
+    cols (dict) -- columns 'Tau', 'Lat', 'Lon', 'Vmax', 'R34', 'R50' and 'R64'
+        with the warning position in the first row; radii are the maximum over
+        the quadrants in nm and the radius of each quadrant is in 'R34_NE',
+        'R34_SE', 'R34_SW', 'R34_NW', etc.
     """
-    res = re.search(r"([0-9]{2,}) HRS", str)
-    if res is not None:
-        return int(res.group(1))
+    warn = None
+    block = None
+    blocks = []
+    section = None
+    for m in TOKEN_RE.finditer(data):
+        kind = m.lastgroup
+        if section is None:
+            if kind == "warn":
+                section = "warn"
+                warn = block = _new_block()
+            continue
+        if kind == "fcst" and section == "warn":
+            section = "fcst"
+            block = _new_block()
+        elif kind == "sep":
+            if section == "fcst":
+                blocks.append(block)
+                block = _new_block()
+        elif kind == "tau":
+            block["hrs"] = True
+            if block["tau"] is None:
+                block["tau"] = int(m.group("tau_val"))
+        elif kind == "hrs":
+            block["hrs"] = True
+        elif kind == "wind":
+            block["wind"] = True
+        elif kind == "vmax":
+            block["wind"] = True
+            if block["vmax"] is None:
+                block["vmax"] = int(m.group("vmax_val"))
+        elif kind == "rad":
+            block["wind"] = True
+            rad = block["rad"].setdefault(int(m.group("wrad")), {})
+            for dist, quadrant in QUADRANT_RE.findall(m.group("rad")):
+                rad[quadrant] = max(int(dist), rad.get(quadrant, 0))
+        elif kind == "time":
+            if block["time"] is None:
+                block["time"] = m.group("time_val")
+        elif kind == "coord":
+            key = "lat" if m.group("hemi") in "NS" else "lon"
+            if block[key] is None:
+                block[key] = float(m.group("coord_val"))
+
+    if warn is None:
+        return None, None
+
+    taus = [b["tau"] for b in blocks if b["hrs"]]
+    fcsts = [b for b in blocks if b["wind"]]
+    rows = [warn] + fcsts[: len(taus)]
+    cols = {
+        "Tau": np.array([0] + taus[: len(rows) - 1], dtype=float),
+        "Lat": np.array([b["lat"] for b in rows], dtype=float),
+        "Lon": np.array([b["lon"] for b in rows], dtype=float),
+        "Vmax": np.array([b["vmax"] for b in rows], dtype=float),
+    }
+    for wrad in WIND_RADII:
+        rads = [b["rad"].get(wrad, {}) for b in rows]
+        cols[f"R{wrad}"] = np.array(
+            [max(r.values()) if len(r) > 0 else None for r in rads], dtype=float
+        )
+        for quadrant, q in QUADRANTS.items():
+            cols[f"R{wrad}_{q}"] = np.array(
+                [r.get(quadrant) for r in rads], dtype=float
+            )
+    return warn["time"], cols
 
 
 def proc_tc_data(
@@ -81,20 +135,29 @@ def proc_tc_data(
     tc_code,
     timestamp=None,
     mode="download",
-    raw_out_dir=None,
+    archive=None,
+    session=None,
+    cache=None,
 ):
     """Parse tropical cyclone data from JTWC warning
 
     Args:
-        in_file (str): Valid download url or local file path
+        in_file (str): Valid download url, local file path or, in 'local' mode with
+            an archive, the hash of an archived warning
         tc_code (str): TC code '{BASIN}{CY}{yy}'
         timestamp (pandas.Timestamp, optional): Required if mode is 'local'. Defaults to None.
         mode (str, optional): 'download' or 'local'. Defaults to "download".
-        raw_out_dir (str, optional): Directory where the downloaded raw txt will be stored.
-            Ignored in 'local' mode. Defaults to None.
+        archive (RawArchive, optional): Archive where the downloaded raw text is
+            stored, or read from in 'local' mode. Defaults to None.
+        session (requests.Session, optional): Session used for the download.
+            Defaults to None.
+        cache (HttpCache, optional): Conditional-GET cache. If the warning did not
+            change since the last download, the previously parsed data is returned.
+            Defaults to None.
 
     Returns:
-        pandas.Dataframe
+        pandas.Dataframe: 'Date' is the label of the position in local time and
+            'Timestamp' the tz-aware time
     """
     if timestamp is None:
         if mode == "local":
@@ -106,99 +169,44 @@ def proc_tc_data(
 
     data = ""
     if mode == "download":
-        r = requests.get(in_file, headers=REQ_HEADER)
+        r, parsed = download(in_file, session, cache)
+        if parsed is not None:
+            return parsed
         if r.status_code != 200:
             return None
         data = r.text
-        if raw_out_dir is not None:
-            out_file_name = raw_out_dir / f"{tc_code}web_{timestamp:%Y%m%d%H}.txt"
-            out_file = open(out_file_name, "w")
-            out_file.write(data)
-            out_file.close()
+        if archive is not None:
+            archive.put("JTWC", tc_code, timestamp, data)
     elif mode == "local":
-        text_file = open(in_file, "r")
-        data = text_file.read()
-        text_file.close()
+        data = read_text(in_file, archive)
     else:
         return None
 
-    forecast_df = pd.DataFrame(
-        columns=[
-            "Center",
-            "Date",
-            "Lat",
-            "Lon",
-            "PosType",
-            "Vmax",
-            "Cat",
-            "R34",
-            "R50",
-            "R64",
-        ]
-    )
-    res = re.sub(r"\s+", " ", data).strip()
-    res1 = re.search(r"WARNING\ POSITION(.*)FORECASTS", res).group(1)
+    warn_time, cols = parse_warning(data)
+    if warn_time is None:
+        return None
+
     date0 = pd.to_datetime(
-        timestamp_utc.strftime("%Y%m") + parse_time(res1), format="%Y%m%d%H%M"
+        timestamp_utc.strftime("%Y%m") + warn_time, format="%Y%m%d%H%M"
     )
-    wind_df = parse_wind_rad(res1)
-    forecast_df = pd.concat(
-        [
-            forecast_df,
-            pd.DataFrame(
-                [
-                    {
-                        "Center": "JTWC",
-                        "Date": date0,
-                        "Lat": parse_lat(res1),
-                        "Lon": parse_lon(res1),
-                        "PosType": "c",
-                        "Vmax": parse_vmax(res1),
-                        "R34": wind_df.loc[34] if 34 in wind_df.index else None,
-                        "R50": wind_df.loc[50] if 50 in wind_df.index else None,
-                        "R64": wind_df.loc[64] if 64 in wind_df.index else None,
-                    }
-                ]
-            ),
-        ],
-        ignore_index=True,
-    )
-
-    res2 = re.search(r"FORECASTS(.*)---", res).group(1).split("---")
-    res3 = [s for s in res2 if re.search(r"HRS", s)]
-    res4 = [s for s in res2 if re.search(r"WIND", s)]
-    forecast_arr = []
-    for i, s in enumerate(res4):
-        wind_df = parse_wind_rad(s)
-        forecast_arr.append(
-            {
-                "Center": "JTWC",
-                "Date": date0 + pd.to_timedelta(parse_forecast_time(res3[i]), unit="h"),
-                "Lat": parse_lat(s),
-                "Lon": parse_lon(s),
-                "PosType": "f",
-                "Vmax": parse_vmax(s),
-                "R34": wind_df.loc[34] if 34 in wind_df.index else None,
-                "R50": wind_df.loc[50] if 50 in wind_df.index else None,
-                "R64": wind_df.loc[64] if 64 in wind_df.index else None,
-            }
-        )
-
-    forecast_df = pd.concat(
-        [forecast_df, pd.DataFrame(forecast_arr)], ignore_index=True
+    forecast_df = pd.DataFrame(
+        {
+            "Center": "JTWC",
+            "Timestamp": date0 + pd.to_timedelta(cols.pop("Tau"), unit="h"),
+            **cols,
+            "PosType": "f",
+        }
     )
-    forecast_df["Date"] = (
-        forecast_df["Date"]
-        .dt.tz_localize("UTC")
-        .dt.tz_convert("Asia/Manila")
-        .dt.strftime("%b %-d %-I %P")
+    forecast_df.loc[0, "PosType"] = "c"
+    forecast_df["Timestamp"] = (
+        forecast_df["Timestamp"].dt.tz_localize("UTC").dt.tz_convert(LOCAL_TZ)
     )
-    forecast_df["Cat"] = forecast_df["Vmax"].apply(knots_to_cat)
-    forecast_df["Vmax"] = forecast_df["Vmax"].apply(knots_to_kph)
-    forecast_df["R34"] = forecast_df["R34"].apply(nm_to_km)
-    forecast_df["R50"] = forecast_df["R50"].apply(nm_to_km)
-    forecast_df["R64"] = forecast_df["R64"].apply(nm_to_km)
-    return forecast_df[
+    forecast_df["Date"] = forecast_df["Timestamp"].dt.strftime("%b %-d %-I %P")
+    forecast_df["Cat"] = knots_to_cat_array(forecast_df["Vmax"])
+    forecast_df["Vmax"] = knots_to_kph_array(forecast_df["Vmax"])
+    for col in [f"R{wrad}" for wrad in WIND_RADII] + QUADRANT_COLS:
+        forecast_df[col] = nm_to_km_array(forecast_df[col])
+    forecast_df = forecast_df[
         [
             "Center",
             "Date",
@@ -210,5 +218,10 @@ def proc_tc_data(
             "R34",
             "R50",
             "R64",
+            *QUADRANT_COLS,
+            "Timestamp",
         ]
     ]
+    if cache is not None:
+        cache.store(in_file, forecast_df)
+    return forecast_df
@@ -1,43 +1,270 @@
 import re
-import requests
-from bs4 import BeautifulSoup
+from io import BytesIO
+import numpy as np
 import pandas as pd
 import argparse
+import requests
+from lxml import etree
+
+from _const_ import RAMMB_BASE_URL, RAMMB_BDECK_URL, RAMMB_INDEX_URL
+from _fetch_ import download
+from _helper_ import (
+    LOCAL_TZ,
+    QUADRANT_COLS,
+    QUADRANTS,
+    WIND_RADII,
+    knots_to_cat_array,
+    knots_to_kph_array,
+    nm_to_km_array,
+)
+
+# a line of an ATCF best-track (b-deck) file
+BDECK_LINE_RE = re.compile(r"^\s*[A-Z]{2},\s*[0-9]+,\s*[0-9]{10},", re.MULTILINE)
+
+
+def _to_positions(timestamp, lat, lon, vmax, radii=None):
+    """Positions of the track history, the latest one as the current position
+
+    Input:
+    timestamp (pandas.DatetimeIndex) -- UTC times of the positions
+    lat, lon, vmax (numpy.ndarray) -- position and intensity in knots
+    radii (dict) -- optional 'R34', 'R34_NE', etc. in nm
+
+    Output:
+    df (pandas.DataFrame) -- positions sorted by time
+    """
+    df = pd.DataFrame(
+        {
+            "Center": "JTWC",
+            "Timestamp": timestamp.tz_convert(LOCAL_TZ),
+            "Lat": lat,
+            "Lon": lon,
+            "Vmax": vmax,
+            **({} if radii is None else radii),
+        }
+    )
+    df.sort_values("Timestamp", inplace=True, kind="stable")
+    df.reset_index(drop=True, inplace=True)
+    df["Date"] = df["Timestamp"].dt.strftime("%b %-d %-I %P")
+    df["Cat"] = knots_to_cat_array(df["Vmax"])
+    df["Vmax"] = knots_to_kph_array(df["Vmax"])
+    df["PosType"] = "h"
+    df.loc[df.shape[0] - 1, "PosType"] = "c"
+    cols = ["Center", "Date", "Lat", "Lon", "PosType", "Vmax", "Cat"]
+    if radii is not None:
+        for col in radii:
+            df[col] = nm_to_km_array(df[col])
+        cols += [f"R{wrad}" for wrad in WIND_RADII] + QUADRANT_COLS
+    return df[cols + ["Timestamp"]].copy()
+
+
+def _cell_text(cell):
+    return "".join(cell.itertext()).strip()
+
+
+def parse_track_history(data):
+    """Extract the track history table from a RAMMB storm page
+
+    The page is parsed incrementally and only until the end of the table
+    that follows the 'Track History' heading, whose cells are converted to
+    typed columns directly. Rows that are not positions, like the header row
+    (with 'th' or 'td' cells), are dropped.
+
+    Input:
+    data (str) -- the storm page
+
+    Output:
+    df (pandas.DataFrame) -- positions of the track history, the latest one
+        as the current position
+    """
+    rows = None
+    found = False
+    for _, elem in etree.iterparse(
+        BytesIO(data.encode()), events=("end",), tag=("h3", "table"), html=True
+    ):
+        if elem.tag == "h3":
+            found = "Track History" in _cell_text(elem)
+        elif found:
+            rows = [
+                [_cell_text(cell) for cell in tr.iterchildren("td", "th")]
+                for tr in elem.iter("tr")
+            ]
+            break
+    if rows is None:
+        return None
+    rows = [row[:4] for row in rows if len(row) >= 4]
+    if len(rows) == 0:
+        return None
+
+    cols = [np.array(col, dtype=object) for col in zip(*rows)]
+    lat, lon, vmax = [pd.to_numeric(col, errors="coerce") for col in cols[1:]]
+    is_pos = ~(np.isnan(lat) | np.isnan(lon))
+    timestamp = pd.DatetimeIndex(
+        pd.to_datetime(cols[0][is_pos], utc=True, errors="coerce")
+    )
+    is_time = ~timestamp.isna()
+    if not is_time.any():
+        return None
+    return _to_positions(
+        timestamp[is_time],
+        lat[is_pos][is_time],
+        lon[is_pos][is_time],
+        vmax[is_pos][is_time],
+    )
+
+
+def _coord(values, neg):
+    """ATCF coordinates in tenths of a degree, e.g. '125N' -> 12.5"""
+    values = np.char.strip(np.asarray(values, dtype=str))
+    deg = np.char.rstrip(values, "NSEW").astype(float) / 10
+    return np.where(np.char.endswith(values, neg), -deg, deg)
+
+
+def parse_best_track(data):
+    """Extract the track history from an ATCF best-track (b-deck) file
+
+    Every line is a position with the radii of one wind threshold (34, 50 or
+    64 kt), so a time has as many lines as it has thresholds.
+
+    Input:
+    data (str) -- the best-track file
+
+    Output:
+    df (pandas.DataFrame) -- positions of the track history with the wind
+        radii, the latest one as the current position
+    """
+    rows = [
+        (line.split(",") + [""] * 17)[:17]
+        for line in data.splitlines()
+        if BDECK_LINE_RE.match(line)
+    ]
+    if len(rows) == 0:
+        return None
+    cols = [np.char.strip(np.array(col, dtype=str)) for col in zip(*rows)]
+    times, wrads, codes = cols[2], cols[11], cols[12]
+    quads = np.column_stack(
+        [np.where(c == "", "0", c).astype(float) for c in cols[13:17]]
+    )
+    quads[quads == 0] = np.nan
+    # a full circle has the radius in the first quadrant
+    full = codes == "AAA"
+    quads[full] = quads[full, :1]
+
+    _, first = np.unique(times, return_index=True)
+    radii = {}
+    for wrad in WIND_RADII:
+        sel = wrads == str(wrad)
+        idx = np.searchsorted(times[first], times[sel])
+        rad = np.full((first.size, 4), np.nan)
+        rad[idx] = quads[sel]
+        radii[f"R{wrad}"] = pd.DataFrame(rad).max(axis=1).to_numpy()
+        for i, q in enumerate(QUADRANTS.values()):
+            radii[f"R{wrad}_{q}"] = rad[:, i]
+
+    return _to_positions(
+        pd.DatetimeIndex(pd.to_datetime(times[first], format="%Y%m%d%H", utc=True)),
+        _coord(cols[6][first], "S"),
+        _coord(cols[7][first], "W"),
+        cols[8][first].astype(float),
+        radii,
+    )
+
+
+def parse_storm_data(data):
+    """Parse a best-track file or a storm page, whichever the data is"""
+    if BDECK_LINE_RE.search(data[:4096]):
+        return parse_best_track(data)
+    return parse_track_history(data)
+
+
+def _get(url, session, cache):
+    r, parsed = download(url, session, cache)
+    if parsed is not None:
+        return parsed
+    if r.status_code != 200:
+        return None
+    df = parse_storm_data(r.text)
+    if cache is not None:
+        cache.store(url, df)
+    return df
+
+
+def proc_tc_data(
+    tc_code,
+    base_url=RAMMB_BASE_URL,
+    dload_url=None,
+    session=None,
+    cache=None,
+    mode="download",
+    bdeck_url=RAMMB_BDECK_URL,
+):
+    """Get the track history of a storm from RAMMB
+
+    The best-track file is used when RAMMB has one, it is smaller than the
+    storm page and has the wind radii. Otherwise the track history table of
+    the storm page is used.
+
+    Input:
+    tc_code (str) -- storm id '{basin}{CY}{YYYY}', e.g. 'wp182021'
+    base_url (str) -- url of the storm page without the storm id
+    dload_url (str) -- url of the storm page or best-track file, replaces
+        both; a file path in 'local' mode
+    session (requests.Session) -- session used for the download
+    cache (HttpCache) -- conditional-GET cache
+    mode (str) -- 'download' or 'local'
+    bdeck_url (str) -- template of the best-track url with {tc_code}, None
+        to only use the storm page
+
+    Output:
+    df (pandas.DataFrame) -- positions of the track history
+    """
+    if mode == "local":
+        with open(dload_url, "r") as f:
+            return parse_storm_data(f.read())
+    if dload_url is not None:
+        return _get(dload_url, session, cache)
+
+    if bdeck_url:
+        try:
+            df = _get(bdeck_url.format(tc_code=tc_code.lower()), session, cache)
+        except requests.RequestException as e:
+            print(f"Failed to get the RAMMB best track, using the storm page: {e}")
+            df = None
+        if df is not None:
+            return df
+    return _get(base_url + tc_code, session, cache)
+
+
+def get_active_storms(basin="wp", url=RAMMB_INDEX_URL, session=None):
+    """List the active storms of a basin from the RAMMB storm list
+
+    Input:
+    basin (str) -- basin code, e.g. 'wp'
+    url (str) -- url of the RAMMB storm list
+    session (requests.Session) -- session used for the download
 
-from _const_ import RAMMB_BASE_URL, REQ_HEADER
-from _helper_ import knots_to_cat, knots_to_kph
-
-
-def proc_tc_data(tc_code, base_url=RAMMB_BASE_URL, dload_url=None):
-    if dload_url is None:
-        url = base_url + tc_code
-    else:
-        url = dload_url
-
-    r = requests.get(url, headers=REQ_HEADER)
-    if r.status_code == 200:
-        soup = BeautifulSoup(r.text, "lxml")
-        tab = soup.find("h3", text=re.compile(r"Track History")).find_next_sibling(
-            "table"
-        )
-        if tab is None:
-            return None
-        df = pd.read_html(str(tab), header=0)[0]
-        df.columns = ["Timestamp", "Lat", "Lon", "Vmax"]
-        df["Center"] = "JTWC"
-        # df['Timestamp'] = pd.to_datetime(df['Timestamp'], format='%Y%m%d%H%M', utc=True).dt.tz_convert('Asia/Manila')
-        df["Timestamp"] = pd.to_datetime(df["Timestamp"], utc=True).dt.tz_convert(
-            "Asia/Manila"
-        )
-        df.sort_values("Timestamp", inplace=True)
-        df.reset_index(drop=True, inplace=True)
-        df["Date"] = df["Timestamp"].dt.strftime("%b %-d %-I %P")
-        df["Cat"] = df["Vmax"].apply(knots_to_cat)
-        df["Vmax"] = df["Vmax"].apply(knots_to_kph)
-        df["PosType"] = "h"
-        df.loc[df.shape[0] - 1, "PosType"] = "c"
-        return df[["Center", "Date", "Lat", "Lon", "PosType", "Vmax", "Cat"]].copy()
-    return None
+    Output:
+    storms (list) -- storm name, year, cyclone number and basin of each storm
+    """
+    r, _ = download(url, session)
+    if r.status_code != 200:
+        return []
+    storms = {}
+    for m in re.finditer(
+        r"storm_identifier=([a-z]{2})([0-9]{2})([0-9]{4})[^>]*>([^<]*)<",
+        r.text,
+        re.IGNORECASE,
+    ):
+        names = re.findall(r"[A-Za-z]+", m.group(4))
+        if m.group(1).lower() != basin.lower() or len(names) == 0:
+            continue
+        storms[(m.group(1) + m.group(2) + m.group(3)).lower()] = {
+            "name": names[-1].upper(),
+            "yr": int(m.group(3)),
+            "cy": int(m.group(2)),
+            "basin": m.group(1).lower(),
+        }
+    return list(storms.values())
 
 
 if __name__ == "__main__":
@@ -1,31 +1,94 @@
 import re
 from datetime import datetime
-from io import StringIO
 
+import numpy as np
 import pandas as pd
-import requests
-from _const_ import REQ_HEADER
+from _archive_ import read_text
+from _fetch_ import download
 from _helper_ import (
-    knots_to_cat,
-    knots_to_kph,
-    parse_lat,
-    parse_lon,
-    vmax_10min_to_1min,
+    LOCAL_TZ,
+    knots_to_cat_array,
+    knots_to_kph_array,
+    vmax_10min_to_1min_array,
 )
 
+UPDATE_TIME_RE = re.compile(r"\((.*UTC)\)", re.DOTALL)
+HEADER_END_RE = re.compile(r"=+")
+CENTER_RE = re.compile(r"[A-Z]{3,}")
+ROW_RE = re.compile(r"(\S+)\s+(\S+)\s+(\S+)\s+(\S*?)KT")
+LAT_RE = re.compile(r"([0-9]+\.[0-9]+)[NS]")
+LON_RE = re.compile(r"([0-9]+\.[0-9]+)[WE]")
+TAU_RE = re.compile(r"([0-9]+)H")
 
-def parse_forecast_time(str):
-    """Extract forecast time from the string
+
+def _search_float(pattern, str):
+    res = pattern.search(str)
+    if res is not None:
+        return float(res.group(1))
+    return np.nan
+
+
+def parse_multilog(data, exclude=()):
+    """Extract the positions of all centers from a Typhoon2000 multilog
+
+    The multilog block is tokenized once and the rows of every center are
+    written into preallocated columns.
 
     Input:
-    str (str) -- the string input
+    data (str) -- the multilog text
+    exclude (list) -- centers to leave out
 
     Output:
-    toff (int) -- forecast time in hr
+    update_time (pandas.Timestamp) -- update time of the multilog
+    centers (list) -- names of the centers, in the order they appear
+    cols (dict) -- columns 'Center' (index into centers), 'Start' ('DDHH' of
+        the current position of the center), 'Tau' (forecast time in hr, 0 for
+        the current position), 'Lat', 'Lon' and 'Vmax'
     """
-    res = re.search("([0-9]+)H", str)
-    if res is not None:
-        return int(res.group(1))
+    update_time = pd.to_datetime(" ".join(UPDATE_TIME_RE.search(data).group(1).split()))
+
+    body = data[HEADER_END_RE.search(data).end() :]
+    segments = body.split(":")
+    names = [m.group(0) for m in map(CENTER_RE.search, segments) if m is not None]
+    infos = [s[: s.rfind("KT") + 2] for s in segments if "KT" in s]
+
+    n = body.count("KT")
+    center = np.empty(n, dtype=int)
+    start = np.empty(n, dtype=object)
+    tau = np.empty(n, dtype=float)
+    lat = np.empty(n, dtype=float)
+    lon = np.empty(n, dtype=float)
+    vmax = np.empty(n, dtype=float)
+
+    centers = []
+    i = 0
+    for name, info in zip(names, infos):
+        if name in exclude:
+            continue
+        k = len(centers)
+        centers.append(name)
+        for j, m in enumerate(ROW_RE.finditer(info)):
+            t, la, lo, v = m.groups()
+            center[i] = k
+            if j == 0:
+                start[i] = t[:4]
+                tau[i] = 0
+            else:
+                tau[i] = _search_float(TAU_RE, t)
+            lat[i] = _search_float(LAT_RE, la)
+            lon[i] = _search_float(LON_RE, lo)
+            vmax[i] = np.nan if v == "---" else float(v)
+            i += 1
+
+    cols = {
+        "Center": center[:i],
+        "Start": start[:i],
+        "Tau": tau[:i],
+        "Lat": lat[:i],
+        "Lon": lon[:i],
+        "Vmax": vmax[:i],
+    }
+    return update_time, centers, cols
 
 
 def proc_tc_data(
@@ -34,7 +97,9 @@ def proc_tc_data(
     exclude=[],
     timestamp=None,
     mode="download",
-    raw_out_dir=None,
+    archive=None,
+    session=None,
+    cache=None,
 ):
     if isinstance(exclude, str):
         exclude = [exclude]
@@ -49,68 +114,54 @@ def proc_tc_data(
 
     data = ""
     if mode == "download":
-        r = requests.get(in_file, headers=REQ_HEADER)
+        r, parsed = download(in_file, session, cache)
+        if parsed is not None:
+            return parsed
         if r.status_code != 200:
             return None
         data = r.text
-        if raw_out_dir is not None:
-            out_file_name = raw_out_dir / f"{tc_name.upper()}_{timestamp:%Y%m%d%H}.TXT"
-            out_file = open(out_file_name, "w")
-            out_file.write(data)
-            out_file.close()
+        if archive is not None:
+            archive.put("Typhoon2k", tc_name.upper(), timestamp, data)
     elif mode == "local":
-        text_file = open(in_file, "r")
-        data = text_file.read()
-        text_file.close()
+        data = read_text(in_file, archive)
     else:
         return None
 
-    res = re.sub(r"\s+", " ", data).strip()
-
-    update_time = pd.to_datetime(re.search(r"\((.*UTC)\)", res).group(1))
-
-    res1 = re.search(r"=+(.*)", res).group(1).strip().split(":")
-    centers = [
-        re.search(r"[A-Z]{3,}", s).group(0) for s in res1 if re.match(r".*[A-Z]{3,}", s)
-    ]
-    info = [
-        re.search(r".*KT", s).group(0).strip() for s in res1 if re.match(r".*KT", s)
-    ]
+    update_time, centers, cols = parse_multilog(data, exclude)
 
+    # the first row of each center is its current position
+    is_start = np.r_[True, cols["Center"][1:] != cols["Center"][:-1]]
+    start_time = pd.to_datetime(
+        update_time.strftime("%Y%m") + cols["Start"][is_start].astype(str),
+        format="%Y%m%d%H",
+        utc=True,
+    )
     out_df = pd.DataFrame(
-        columns=["Center", "Date", "Lat", "Lon", "PosType", "Vmax", "Cat"]
+        {
+            "Center": np.array(centers, dtype=object)[cols["Center"]],
+            "Timestamp": start_time[np.cumsum(is_start) - 1]
+            + pd.to_timedelta(cols["Tau"], unit="h"),
+            "Lat": cols["Lat"],
+            "Lon": cols["Lon"],
+            "Vmax": cols["Vmax"],
+            "Order": cols["Center"],
+        }
     )
-    for i, f in enumerate(info):
-        if centers[i] not in exclude:
-            df = pd.read_csv(
-                StringIO(re.sub(r"KT\ ?", "\n", f)),
-                sep=" ",
-                header=None,
-                na_values="---",
-            )
-            df.columns = ["Timestamp", "Lat", "Lon", "Vmax"]
-            df["Lat"] = df["Lat"].apply(parse_lat)
-            df["Lon"] = df["Lon"].apply(parse_lon)
-            df.loc[0, "Timestamp"] = pd.to_datetime(
-                update_time.strftime("%Y%m") + df.loc[0, "Timestamp"][:4],
-                format="%Y%m%d%H",
-                utc=True,
-            )
-            df.loc[1:, "Timestamp"] = df.loc[0, "Timestamp"] + pd.to_timedelta(
-                df.loc[1:, "Timestamp"].apply(parse_forecast_time), unit="h"
-            )
-            df.sort_values("Timestamp", inplace=True)
-            df.reset_index(drop=True, inplace=True)
-            df["Date"] = (
-                pd.to_datetime(df["Timestamp"])
-                .dt.tz_convert("Asia/Manila")
-                .dt.strftime("%b %-d %-I %P")
-            )
-            df["Vmax"] = df["Vmax"].apply(vmax_10min_to_1min)
-            df["Cat"] = df["Vmax"].apply(knots_to_cat)
-            df["Vmax"] = df["Vmax"].apply(knots_to_kph)
-            df["Center"] = centers[i]
-            df["PosType"] = "f"
-            df.loc[0, "PosType"] = "c"
-            out_df = pd.concat([out_df, df], ignore_index=True)
-    return out_df[["Center", "Date", "Lat", "Lon", "PosType", "Vmax", "Cat"]]
+    out_df.sort_values(["Order", "Timestamp"], kind="stable", inplace=True)
+    out_df.reset_index(drop=True, inplace=True)
+
+    out_df["Timestamp"] = out_df["Timestamp"].dt.tz_convert(LOCAL_TZ)
+    out_df["Date"] = out_df["Timestamp"].dt.strftime("%b %-d %-I %P")
+    out_df["Vmax"] = vmax_10min_to_1min_array(out_df["Vmax"])
+    out_df["Cat"] = knots_to_cat_array(out_df["Vmax"])
+    out_df["Vmax"] = knots_to_kph_array(out_df["Vmax"])
+    out_df["PosType"] = "f"
+    is_first = out_df["Order"].ne(out_df["Order"].shift())
+    out_df.loc[is_first, "PosType"] = "c"
+
+    out_df = out_df[
+        ["Center", "Date", "Lat", "Lon", "PosType", "Vmax", "Cat", "Timestamp"]
+    ]
+    if cache is not None:
+        cache.store(in_file, out_df)
+    return out_df
@@ -0,0 +1,275 @@
+import argparse
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+from _archive_ import RawArchive
+from _helper_ import LOCAL_TZ
+from _merge_ import merge_positions
+from _store_ import TrackStore
+from cron_multi import (
+    CONFIG,
+    OUT_COLS,
+    SOURCE_ERRORS,
+    _to_bool,
+    make_products,
+    parse_storm,
+)
+from parse_jtwc import proc_tc_data as get_jtwc
+from parse_t2k import proc_tc_data as get_t2k
+
+# raw bulletin files saved by older versions of cron_multi, the time is the
+# local time of the run
+JTWC_FILE_RE = re.compile(r"^([a-z]{2}[0-9]{4})web_([0-9]{10})\.txt$")
+T2K_FILE_RE = re.compile(r"^([A-Z0-9-]+)_([0-9]{10})\.TXT$")
+
+SOURCES = ["JTWC", "Typhoon2k"]
+
+
+def storm_keys(tc_info):
+    """Archive key of the storm for every source"""
+    return {
+        "JTWC": f"{tc_info['basin']}{tc_info['cy']:02}{tc_info['yr'] % 100}",
+        "Typhoon2k": tc_info["name"].upper(),
+    }
+
+
+def import_files(archive, raw_dir, tc_info):
+    """Add the raw bulletin files of a storm to the archive
+
+    Input:
+    archive (RawArchive) -- archive of the raw bulletins
+    raw_dir (pathlib.Path) -- directory of the raw bulletin files
+    tc_info (dict) -- storm name, year, cyclone number and basin
+
+    Output:
+    n (int) -- number of files added
+    """
+    keys = storm_keys(tc_info)
+    n = 0
+    for f in raw_dir.iterdir():
+        m = JTWC_FILE_RE.match(f.name)
+        if m is not None and m.group(1) == keys["JTWC"]:
+            source = "JTWC"
+        else:
+            m = T2K_FILE_RE.match(f.name)
+            if m is None or m.group(1) != keys["Typhoon2k"]:
+                continue
+            source = "Typhoon2k"
+        run_time = pd.to_datetime(m.group(2), format="%Y%m%d%H")
+        archive.put(source, keys[source], run_time, f.read_text())
+        n += 1
+    return n
+
+
+def find_bulletins(archive, tc_info):
+    """Find the archived raw bulletins of a storm
+
+    Input:
+    archive (RawArchive) -- archive of the raw bulletins
+    tc_info (dict) -- storm name, year, cyclone number and basin
+
+    Output:
+    runs (dict) -- run time -> {source: hash}, sorted by run time
+    """
+    runs = {}
+    for source, key in storm_keys(tc_info).items():
+        for _, _, fetch_time, sha in archive.entries(source, key):
+            runs.setdefault(fetch_time, {})[source] = sha
+    return dict(sorted(runs.items()))
+
+
+def parse_bulletin(source, sha, tc_info, run_time, archive):
+    """Parse an archived bulletin like cron_multi did when it was downloaded"""
+    key = storm_keys(tc_info)[source]
+    if source == "JTWC":
+        return get_jtwc(sha, key, timestamp=run_time, mode="local", archive=archive)
+    return get_t2k(
+        sha,
+        tc_info["name"],
+        exclude="JTWC",
+        timestamp=run_time,
+        mode="local",
+        archive=archive,
+    )
+
+
+def replay_storm(tc_info, archive, out_dir, workers=1):
+    """Rebuild the products of every archived run of a storm
+
+    The bulletins are parsed in a process pool. The runs are then merged in
+    order into a fresh track store, each with the latest bulletin of every
+    source at that time (a source that did not change was not archived), and
+    the products of all runs are generated in the pool. RAMMB is not used, so
+    the history starts with the first archived bulletins.
+
+    Input:
+    tc_info (dict) -- storm name, year, cyclone number and basin
+    archive (RawArchive) -- archive of the raw bulletins
+    out_dir (pathlib.Path) -- output directory of the storm
+    workers (int) -- number of worker processes
+
+    Output:
+    summary (dict) -- number of runs and bulletins, failed runs and elapsed time
+    """
+    t0 = time.perf_counter()
+    runs = find_bulletins(archive, tc_info)
+    n_files = sum(len(files) for files in runs.values())
+    print(f"Found {n_files} bulletins of {tc_info['name']} in {len(runs)} runs")
+
+    # Parse all bulletins
+    parsed = {}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(parse_bulletin, source, sha, tc_info, run_time, archive): (
+                run_time,
+                source,
+            )
+            for run_time, shas in runs.items()
+            for source, sha in shas.items()
+        }
+        for future, (run_time, source) in futures.items():
+            try:
+                parsed[run_time, source] = future.result()
+            except SOURCE_ERRORS as e:
+                parsed[run_time, source] = None
+                print(f"Failed to parse {source} of {run_time:%Y%m%d%H}: {e}")
+
+    # Merge the runs in order
+    storm_id = f"{tc_info['basin']}{tc_info['cy']:02}{tc_info['yr']}"
+    empty_df = pd.DataFrame(columns=OUT_COLS)
+    latest = {}
+    out_dfs = {}
+    with TrackStore(":memory:") as store:
+        for run_time in runs:
+            new_dfs = []
+            for source in SOURCES:
+                df = parsed.get((run_time, source))
+                if isinstance(df, pd.DataFrame):
+                    latest[source] = df
+                    new_dfs.append(df)
+            init_df = store.history(storm_id) if store.has_fixes(storm_id) else empty_df
+            out_df, _ = merge_positions(init_df, [latest.get(s) for s in SOURCES])
+            out_dfs[run_time] = out_df.reindex(columns=OUT_COLS)
+            if len(new_dfs) > 0:
+                store.upsert(
+                    storm_id,
+                    pd.concat(new_dfs, ignore_index=True),
+                    run_time.tz_localize(LOCAL_TZ),
+                )
+        store.save(out_dir / f"store/{storm_id}.sqlite")
+
+    # Generate the products, appending to the same GeoPackage is sequential. A
+    # failed run does not stop the others, it is reported with the traceback
+    # of its worker process
+    if _to_bool(CONFIG.get("APPEND_RUNS", "false")):
+        workers = 1
+    failed = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(make_products, out_df, tc_info, out_dir, run_time): (
+                run_time
+            )
+            for run_time, out_df in out_dfs.items()
+        }
+        for future, run_time in futures.items():
+            e = future.exception()
+            if e is not None:
+                failed.append(run_time)
+                print(
+                    f"Failed to generate the products of {run_time:%Y%m%d%H}:\n"
+                    f"{e.__cause__ or repr(e)}"
+                )
+
+    return {
+        "name": tc_info["name"],
+        "runs": len(runs),
+        "bulletins": n_files,
+        "failed": len(failed),
+        "elapsed": time.perf_counter() - t0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the products of a storm from its archived raw bulletins"
+    )
+    parser.add_argument(
+        "--storm",
+        help="Storm to replay as NAME:CY:YEAR[:BASIN], can be repeated",
+        action="append",
+        type=parse_storm,
+        default=[],
+    )
+    parser.add_argument(
+        "--archive",
+        help="Archive of the raw bulletins, defaults to the 'raw' directory of "
+        "the storm",
+    )
+    parser.add_argument(
+        "--raw-dir",
+        help="Directory of raw bulletin files (as saved by older versions) to "
+        "add to the archive first",
+    )
+    parser.add_argument(
+        "--out-dir",
+        help="Output directory, defaults to OUT_DIR/replay/NAME",
+    )
+    parser.add_argument(
+        "--workers",
+        help="Number of worker processes",
+        type=int,
+        default=os.cpu_count(),
+    )
+    args = parser.parse_args()
+
+    out_dir = Path(CONFIG.get("OUT_DIR", "output"))
+    storms = list(args.storm)
+    if len(storms) == 0:
+        storms = [
+            {
+                "name": CONFIG.get("TC_NAME", ""),
+                "yr": int(CONFIG.get("TC_YEAR", f"{pd.Timestamp.now():%Y}")),
+                "cy": int(CONFIG.get("TC_CY", "1")),
+                "basin": CONFIG.get("TC_BASIN", "wp").lower(),
+            }
+        ]
+
+    summaries = []
+    for tc_info in storms:
+        if args.archive is not None:
+            archive = RawArchive(args.archive)
+        elif (out_dir / tc_info["name"] / "raw").is_dir():
+            archive = RawArchive(out_dir / tc_info["name"] / "raw")
+        else:
+            archive = RawArchive(out_dir / "raw")
+        if args.raw_dir is not None:
+            n = import_files(archive, Path(args.raw_dir), tc_info)
+            print(f"Added {n} raw bulletin files of {tc_info['name']} to the archive")
+        if args.out_dir is not None:
+            storm_out_dir = Path(args.out_dir)
+            if len(storms) > 1:
+                storm_out_dir = storm_out_dir / tc_info["name"]
+        else:
+            storm_out_dir = out_dir / "replay" / tc_info["name"]
+        summaries.append(
+            replay_storm(tc_info, archive, storm_out_dir, max(1, args.workers))
+        )
+
+    print("Summary:")
+    for s in summaries:
+        print(
+            f"  {s['name']:<12} {s['runs']:>5} runs {s['bulletins']:>5} bulletins"
+            f" {s['failed']:>3} failed {s['elapsed']:8.2f}s"
+        )
+    n_failed = sum(s["failed"] for s in summaries)
+    if n_failed > 0:
+        sys.exit(f"{n_failed} runs failed")
+
+
+if __name__ == "__main__":
+    main()
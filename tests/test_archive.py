@@ -0,0 +1,20 @@
+import pandas as pd
+from _archive_ import RawArchive, read_text
+
+
+def test_unchanged_bulletin_is_stored_once(tmp_path):
+    archive = RawArchive(tmp_path / "raw")
+    t1 = pd.Timestamp("2021-09-10 08:00")
+    t2 = pd.Timestamp("2021-09-10 14:00")
+    sha = archive.put("JTWC", "wp1821", t1, "bulletin")
+    assert archive.put("JTWC", "wp1821", t2, "bulletin") == sha
+    archive.put("Typhoon2k", "CONSON", t2, "multilog")
+
+    assert len(list((tmp_path / "raw/blobs").rglob("*.gz"))) == 2
+    assert archive.entries("JTWC") == [
+        ("JTWC", "wp1821", t1, sha),
+        ("JTWC", "wp1821", t2, sha),
+    ]
+    assert archive.latest("JTWC", "wp1821") == (t2, sha)
+    assert archive.latest("JTWC", "wp1921") is None
+    assert read_text(sha, archive) == "bulletin"
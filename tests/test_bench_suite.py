@@ -0,0 +1,21 @@
+from bench_suite import compare
+
+BASELINE = {
+    "calibration": {"time": 0.02, "peak_mb": 3.0},
+    "parse_jtwc": {"time": 0.01, "peak_mb": 0.1},
+}
+
+
+def test_compare_scales_by_the_calibration():
+    # the whole machine is twice as slow
+    results = {
+        "calibration": {"time": 0.04, "peak_mb": 3.0},
+        "parse_jtwc": {"time": 0.02, "peak_mb": 0.1},
+    }
+    assert compare(results, BASELINE) == []
+
+    results["parse_jtwc"] = {"time": 0.04, "peak_mb": 0.2}
+    assert compare(results, BASELINE) == [
+        "parse_jtwc: 0.0200s -> 0.0400s",
+        "parse_jtwc: 0.10MB -> 0.20MB",
+    ]
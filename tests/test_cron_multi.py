@@ -0,0 +1,114 @@
+import importlib.util
+
+import cron_multi
+import pandas as pd
+import pytest
+import stand_in_server
+from geopandas import read_file
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """Config of a run of CONSON against the stand-in server"""
+    server = stand_in_server.serve()
+    base = f"http://127.0.0.1:{server.server_port}/"
+    config = {
+        "TC_NAME": "CONSON",
+        "TC_CY": "18",
+        "TC_YEAR": "2021",
+        "TC_BASIN": "wp",
+        "MAIN_TRACK": "PAGASA",
+        "OUT_DIR": str(tmp_path / "output"),
+        "JTWC_BASE_URL": base,
+        "T2K_BASE_URL": base,
+        "RAMMB_BASE_URL": f"{base}storm.asp?storm_identifier=",
+        "RAMMB_BDECK_URL": f"{base}b{{tc_code}}.dat",
+        "CONSENSUS": "false",
+        "INTERP_FREQ": "",
+        "LAYER_WORKERS": "1",
+    }
+    monkeypatch.setattr(cron_multi, "CONFIG", config)
+    yield config
+    server.shutdown()
+
+
+def test_failed_run_is_not_skipped(config, tmp_path, capsys, monkeypatch):
+    def make_products(*args, **kwargs):
+        raise RuntimeError("no products")
+
+    with monkeypatch.context() as m:
+        m.setattr(cron_multi, "make_products", make_products)
+        with pytest.raises(RuntimeError):
+            cron_multi.main([])
+    assert not (tmp_path / "output/shp").exists()
+
+    # the sources did not change, but the failed run made no products
+    cron_multi.main([])
+    assert len(list((tmp_path / "output/shp").glob("CONSON_*"))) == 1
+
+    # now the unchanged sources are skipped
+    capsys.readouterr()
+    cron_multi.main([])
+    assert "No source has changed" in capsys.readouterr().out
+
+
+def test_first_run_layers(config, tmp_path):
+    """A first run starts from RAMMB's track history, whose last fix must not
+    stay a second JTWC current position"""
+    cron_multi.main([])
+    csv_df = pd.read_csv(next((tmp_path / "output/csv").glob("CONSON_*.csv")))
+    assert csv_df.groupby(["Center", "PosType"]).size().to_dict() == {
+        ("CMA", "c"): 1,
+        ("CMA", "f"): 4,
+        ("JMA", "c"): 1,
+        ("JMA", "f"): 3,
+        ("JTWC", "c"): 1,
+        ("JTWC", "f"): 7,
+        ("JTWC", "h"): 22,
+        ("PAGASA", "c"): 1,
+        ("PAGASA", "f"): 3,
+    }
+
+    run_dir = next((tmp_path / "output/shp").glob("CONSON_*/"))
+    rows = {
+        shp.parent.relative_to(run_dir).as_posix(): read_file(shp).shape[0]
+        for shp in run_dir.rglob("*.shp")
+    }
+    assert rows == {
+        "jtwc_rad/r34": 7,
+        "jtwc_rad/r50": 3,
+        "jtwc_rad/r64": 2,
+        "jtwc_rad2/r34": 1,
+        "jtwc_rad2/r50": 1,
+        "jtwc_rad2/r64": 1,
+        "track_bnds/line1": 2,
+        "track_bnds/line2": 2,
+        "track_bnds/poly1": 1,
+        "track_bnds/poly2": 1,
+        "track_line": 5,
+        "track_pts": 47,
+    }
+
+
+def test_fallback_run_is_not_skipped(config, capsys):
+    cron_multi.main([])
+
+    # JTWC is now missing, its last raw copy is used instead
+    config["JTWC_BASE_URL"] += "missing/"
+    capsys.readouterr()
+    cron_multi.main([])
+    out = capsys.readouterr().out
+    assert "No source has changed" not in out
+    assert "degraded (JTWC)" in out
+
+
+def test_out_format_is_checked_first(config, tmp_path):
+    config["OUT_FORMAT"] = "bogus"
+    with pytest.raises(ValueError):
+        cron_multi.main([])
+    if importlib.util.find_spec("pyarrow") is None:
+        config["OUT_FORMAT"] = "parquet"
+        with pytest.raises(ImportError, match="pyarrow"):
+            cron_multi.main([])
+    # nothing was fetched
+    assert not (tmp_path / "output/cache").exists()
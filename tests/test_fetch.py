@@ -0,0 +1,41 @@
+import os
+
+import pandas as pd
+import stand_in_server
+from _fetch_ import HttpCache
+
+
+def test_conditional_get(tmp_path):
+    serve_dir = tmp_path / "serve"
+    serve_dir.mkdir()
+    bulletin = serve_dir / "wp1821web.txt"
+    bulletin.write_text("first")
+    server = stand_in_server.serve(serve_dir)
+    url = f"http://127.0.0.1:{server.server_port}/wp1821web.txt"
+    df = pd.DataFrame({"Lat": [14.0]})
+    try:
+        cache = HttpCache(tmp_path / "cache")
+        r, parsed = cache.get(url)
+        assert r.status_code == 200 and parsed is None
+        assert cache.changed == {url}
+        cache.store(url, df)
+
+        # nothing is saved until the run commits
+        r, parsed = HttpCache(tmp_path / "cache").get(url)
+        assert parsed is None
+        cache.commit()
+
+        cache = HttpCache(tmp_path / "cache")
+        r, parsed = cache.get(url)
+        assert r.status_code == 304
+        pd.testing.assert_frame_equal(parsed, df)
+        assert cache.changed == set()
+
+        bulletin.write_text("second")
+        mtime = bulletin.stat().st_mtime + 60
+        os.utime(bulletin, (mtime, mtime))
+        r, parsed = cache.get(url)
+        assert r.text == "second" and parsed is None
+        assert cache.changed == {url}
+    finally:
+        server.shutdown()
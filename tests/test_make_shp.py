@@ -0,0 +1,88 @@
+import os
+import zipfile
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from _publish_ import ZipStream, publish, releases
+from geopandas import GeoDataFrame, list_layers, points_from_xy
+from make_shp import (
+    PROJ_CRS,
+    LayerWriter,
+    generate_radius,
+    generate_radius_envelope,
+    make_shp,
+)
+from parse_jtwc import proc_tc_data
+
+FIXTURE_DIR = Path(__file__).resolve().parents[1] / "benchmarks/fixtures"
+
+
+def _forecast_points():
+    df = proc_tc_data(
+        FIXTURE_DIR / "wp1821web.txt",
+        "wp1821",
+        mode="local",
+        timestamp=pd.Timestamp("2021-09-11 15:00"),
+    )
+    df["Center"] = "JTWC_forecast"
+    geom = points_from_xy(df["Lon"], df["Lat"], crs=PROJ_CRS)
+    return GeoDataFrame(df, crs=PROJ_CRS, geometry=geom)
+
+
+def test_radius_envelope():
+    pts_gdf = _forecast_points()
+    env = generate_radius_envelope(pts_gdf).set_index("name")
+    assert env.index.tolist() == ["R34", "R50", "R64"]
+    assert env.geometry.is_valid.all()
+
+
+def test_radius_envelope_of_a_single_point():
+    """A radius reported at a single point has the ring of that point"""
+    pts_gdf = _forecast_points()
+    single = pts_gdf["R64"].notna() & (pts_gdf["Timestamp"] > pts_gdf["Timestamp"][2])
+    pts_gdf.loc[single, ["R64", "R64_NE", "R64_SE", "R64_SW", "R64_NW"]] = np.nan
+    assert pts_gdf["R64"].notna().sum() == 1
+
+    env = generate_radius_envelope(pts_gdf).set_index("name")
+    ring = generate_radius(pts_gdf.loc[pts_gdf["R64"].notna()], "R64")
+    assert env.geometry.is_valid.all()
+    assert env.geometry["R64"].equals(ring.geometry.iloc[0])
+
+
+def test_appended_runs_keep_the_published_geopackage(tmp_path):
+    """Every run adds its layers to a new GeoPackage, the release of an
+    earlier run still has its own"""
+    pts_gdf = _forecast_points()
+    out_file = tmp_path / "gpkg/CONSON.gpkg"
+    publish_dir = tmp_path / "qgis"
+    for run_id in ["2021091108", "2021091114"]:
+        with LayerWriter(out_file, "gpkg", run_id=run_id) as writer:
+            writer.write("track_pts", pts_gdf)
+        publish(out_file, publish_dir, "CONSON", run_id)
+
+    first, second = releases(publish_dir, "CONSON")
+    assert list_layers(first / "CONSON.gpkg")["name"].tolist() == [
+        "track_pts_2021091108"
+    ]
+    assert list_layers(second / "CONSON.gpkg")["name"].tolist() == [
+        "track_pts_2021091108",
+        "track_pts_2021091114",
+    ]
+    assert os.path.samefile(out_file, second / "CONSON.gpkg")
+    assert not (tmp_path / "gpkg/.CONSON.append.gpkg").exists()
+
+
+def test_zip_members_in_step_order(tmp_path):
+    """The zip of concurrently written layers is the same as the sequential one"""
+    df = _forecast_points().drop(columns="geometry")
+    names = {}
+    for workers in [1, 4]:
+        with ZipStream(tmp_path / f"zip{workers}.zip") as zip_stream:
+            make_shp(
+                df, tmp_path / f"shp{workers}", workers=workers, zip_stream=zip_stream
+            )
+        with zipfile.ZipFile(tmp_path / f"zip{workers}.zip") as zf:
+            names[workers] = zf.namelist()
+    assert names[1][:2] == ["track_pts/", "track_pts/track_pts.cpg"]
+    assert names[4] == names[1]
@@ -0,0 +1,56 @@
+import pandas as pd
+from _merge_ import merge_positions
+
+
+def _positions(rows):
+    df = pd.DataFrame(rows, columns=["Center", "Timestamp", "PosType", "Lat"])
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"])
+    return df
+
+
+def test_current_position_replaces_history():
+    history = _positions(
+        [
+            ("JTWC", "2021-09-10 00:00", "h", 14.0),
+            ("JTWC", "2021-09-10 06:00", "h", 14.5),
+        ]
+    )
+    jtwc = _positions(
+        [
+            ("JTWC", "2021-09-10 06:00", "c", 14.6),
+            ("JTWC", "2021-09-10 18:00", "f", 15.0),
+        ]
+    )
+    out_df, counts = merge_positions(history, [jtwc])
+    assert out_df[["PosType", "Lat"]].values.tolist() == [
+        ["h", 14.0],
+        ["c", 14.6],
+        ["f", 15.0],
+    ]
+    assert counts == {"inserted": 2, "replaced": 1, "dropped": 0}
+
+
+def test_single_current_position_per_center():
+    """The last fix of RAMMB's track history is JTWC's current position, the
+    newer one of the warning supersedes it"""
+    rammb = _positions(
+        [
+            ("JTWC", "2021-09-10 00:00", "h", 14.0),
+            ("JTWC", "2021-09-10 06:00", "c", 14.5),
+        ]
+    )
+    jtwc = _positions([("JTWC", "2021-09-10 12:00", "c", 15.0)])
+    t2k = _positions([("JMA", "2021-09-10 12:00", "c", 15.1)])
+    out_df, _ = merge_positions(rammb, [jtwc, t2k])
+    current = out_df.loc[out_df["PosType"] == "c"]
+    assert current[["Center", "Lat"]].values.tolist() == [["JTWC", 15.0], ["JMA", 15.1]]
+    assert out_df.shape[0] == 4
+
+
+def test_latest_source_wins_and_failed_sources_are_skipped():
+    history = _positions([("JMA", "2021-09-10 06:00", "h", 14.0)])
+    first = _positions([("JMA", "2021-09-10 18:00", "f", 15.0)])
+    second = _positions([("JMA", "2021-09-10 18:00", "f", 15.5)])
+    out_df, counts = merge_positions(history, [first, None, second])
+    assert out_df["Lat"].tolist() == [14.0, 15.5]
+    assert counts == {"inserted": 1, "replaced": 0, "dropped": 1}
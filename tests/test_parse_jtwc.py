@@ -0,0 +1,61 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from _helper_ import LOCAL_TZ, QUADRANT_COLS
+from parse_jtwc import parse_warning, proc_tc_data
+
+FIXTURE_DIR = Path(__file__).resolve().parents[1] / "benchmarks/fixtures"
+IN_FILE = FIXTURE_DIR / "wp1821web.txt"
+
+NAN = np.nan
+# Tau, Lat, Lon, Vmax (kt), then the NE/SE/SW/NW radii (nm) of 34, 50, 64 kt
+WARNING = [
+    [0, 12.4, 121.9, 50, 60, 70, 50, 50, 20, 20, 15, 15, *[NAN] * 4],
+    [12, 12.9, 120.6, 55, 70, 70, 60, 60, 25, 25, 20, 20, *[NAN] * 4],
+    [24, 13.3, 119.5, 65, 80, 80, 70, 70, 30, 30, 25, 25, 15, 15, 10, 10],
+    [36, 13.8, 118.4, 70, 90, 90, 80, 80, *[NAN] * 4, 20, 20, 15, 15],
+    [48, 14.2, 117.1, 75, 100, 100, 90, 90, *[NAN] * 8],
+    [72, 15.0, 114.0, 80, 110, 110, 100, 100, *[NAN] * 8],
+    [96, 15.6, 111.2, 60, 90, 90, 80, 80, *[NAN] * 8],
+    [120, 15.9, 108.9, 35, *[NAN] * 12],
+]
+
+
+def _expected_warning():
+    df = pd.DataFrame(WARNING, columns=["Tau", "Lat", "Lon", "Vmax", *QUADRANT_COLS])
+    df = df.astype(float)
+    for wrad in ["R34", "R50", "R64"]:
+        quads = df[[col for col in QUADRANT_COLS if col.startswith(wrad)]]
+        df[wrad] = quads.max(axis=1)
+    return df
+
+
+def test_parse_warning():
+    warn_time, cols = parse_warning(IN_FILE.read_text())
+    assert warn_time == "110600"
+    expected = _expected_warning()
+    pd.testing.assert_frame_equal(pd.DataFrame(cols)[expected.columns], expected)
+
+
+def test_proc_tc_data():
+    df = proc_tc_data(
+        IN_FILE, "wp1821", mode="local", timestamp=pd.Timestamp("2021-09-11 15:00")
+    )
+    expected = _expected_warning()
+    timestamps = pd.Timestamp("2021-09-11 06:00", tz="UTC") + pd.to_timedelta(
+        expected["Tau"], unit="h"
+    )
+    assert df["Center"].unique().tolist() == ["JTWC"]
+    assert df["PosType"].tolist() == ["c"] + ["f"] * 7
+    pd.testing.assert_series_equal(
+        df["Timestamp"], timestamps.dt.tz_convert(LOCAL_TZ), check_names=False
+    )
+    assert df["Date"].tolist()[:2] == ["Sep 11 2 pm", "Sep 12 2 am"]
+    assert df["Cat"].tolist() == ["TS", "TS", "1", "1", "1", "1", "TS", "TS"]
+    pd.testing.assert_frame_equal(
+        df[["Lat", "Lon"]], expected[["Lat", "Lon"]], check_names=False
+    )
+    np.testing.assert_allclose(df["Vmax"], expected["Vmax"] * 1.852)
+    radii_cols = ["R34", "R50", "R64", *QUADRANT_COLS]
+    np.testing.assert_allclose(df[radii_cols], expected[radii_cols] * 1.852)
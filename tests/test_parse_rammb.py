@@ -0,0 +1,15 @@
+from pathlib import Path
+
+import pandas as pd
+from parse_rammb import parse_track_history
+
+FIXTURE_DIR = Path(__file__).resolve().parents[1] / "benchmarks/fixtures"
+
+
+def test_track_history_header_cells():
+    """The header row is dropped whether it has 'th' or 'td' cells"""
+    th_df = parse_track_history((FIXTURE_DIR / "wp182021.html").read_text())
+    td_df = parse_track_history((FIXTURE_DIR / "wp182021_td_header.html").read_text())
+    assert th_df.shape[0] == 22
+    assert th_df["PosType"].iloc[-1] == "c"
+    pd.testing.assert_frame_equal(th_df, td_df)
@@ -0,0 +1,79 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from _helper_ import LOCAL_TZ
+from parse_t2k import parse_multilog, proc_tc_data
+
+FIXTURE_DIR = Path(__file__).resolve().parents[1] / "benchmarks/fixtures"
+IN_FILE = FIXTURE_DIR / "CONSON.TXT"
+
+# Center, Tau, Lat, Lon, Vmax (10-min, kt) of the multilog without JTWC
+MULTILOG = [
+    ("PAGASA", 0, 12.4, 121.9, 45),
+    ("PAGASA", 24, 13.4, 119.6, 55),
+    ("PAGASA", 48, 14.3, 117.0, 60),
+    ("PAGASA", 72, 15.1, 114.1, 65),
+    ("JMA", 0, 12.5, 121.8, 45),
+    ("JMA", 24, 13.5, 119.4, 50),
+    ("JMA", 48, 14.4, 116.8, 60),
+    ("JMA", 72, 15.3, 113.8, np.nan),
+    ("CMA", 0, 12.3, 122.0, 45),
+    ("CMA", 24, 13.2, 119.8, 50),
+    ("CMA", 48, 14.0, 117.4, 55),
+    ("CMA", 72, 14.9, 114.6, 60),
+    ("CMA", 96, 15.4, 111.5, 55),
+]
+
+
+def _expected():
+    return pd.DataFrame(MULTILOG, columns=["Center", "Tau", "Lat", "Lon", "Vmax"])
+
+
+def test_parse_multilog():
+    update_time, centers, cols = parse_multilog(IN_FILE.read_text(), ["JTWC"])
+    assert update_time == pd.Timestamp("2021-09-11 06:00", tz="UTC")
+    assert centers == ["PAGASA", "JMA", "CMA"]
+    expected = _expected()
+    assert [centers[i] for i in cols["Center"]] == expected["Center"].tolist()
+    for col in ["Tau", "Lat", "Lon", "Vmax"]:
+        np.testing.assert_array_equal(cols[col], expected[col])
+    # only the first row of a center has its start time
+    assert cols["Start"][[0, 4, 8]].tolist() == ["1106"] * 3
+    assert pd.isna(cols["Start"][[1, 5, 9]]).all()
+
+
+def test_proc_tc_data():
+    df = proc_tc_data(
+        IN_FILE,
+        "CONSON",
+        exclude="JTWC",
+        mode="local",
+        timestamp=pd.Timestamp("2021-09-11 15:00"),
+    )
+    expected = _expected()
+    assert df.columns.tolist() == [
+        "Center",
+        "Date",
+        "Lat",
+        "Lon",
+        "PosType",
+        "Vmax",
+        "Cat",
+        "Timestamp",
+    ]
+    assert df["Center"].tolist() == expected["Center"].tolist()
+    assert df["PosType"].tolist() == ["c", "f", "f", "f"] * 2 + ["c"] + ["f"] * 4
+    timestamps = pd.Timestamp("2021-09-11 06:00", tz="UTC") + pd.to_timedelta(
+        expected["Tau"], unit="h"
+    )
+    pd.testing.assert_series_equal(
+        df["Timestamp"], timestamps.dt.tz_convert(LOCAL_TZ), check_names=False
+    )
+    np.testing.assert_array_equal(df[["Lat", "Lon"]], expected[["Lat", "Lon"]])
+    np.testing.assert_allclose(df["Vmax"], expected["Vmax"] * 1.14 * 1.852)
+    assert df["Cat"].tolist() == [
+        *["TS", "TS", "1", "1"],
+        *["TS", "TS", "1", ""],
+        *["TS", "TS", "TS", "1", "TS"],
+    ]
@@ -0,0 +1,42 @@
+import os
+
+from _publish_ import publish, releases
+
+
+def _run(src, text):
+    (src / "track_pts").mkdir(parents=True, exist_ok=True)
+    (src / "track_pts/track_pts.shp").write_text(text)
+
+
+def test_publish_swaps_the_link(tmp_path):
+    src, publish_dir = tmp_path / "shp", tmp_path / "qgis"
+    _run(src / "run1", "run1")
+    first = publish(src / "run1", publish_dir, "CONSON", "2021091008")
+    _run(src / "run2", "run2")
+    second = publish(src / "run2", publish_dir, "CONSON", "2021091014")
+
+    assert os.readlink(publish_dir / "CONSON") == ".releases/CONSON_2021091014"
+    assert (publish_dir / "CONSON/track_pts/track_pts.shp").read_text() == "run2"
+    assert (first / "track_pts/track_pts.shp").read_text() == "run1"
+    # hardlinks, not copies
+    src_file = src / "run2/track_pts/track_pts.shp"
+    assert os.path.samefile(src_file, second / "track_pts/track_pts.shp")
+
+
+def test_publish_keeps_the_latest_runs(tmp_path):
+    src, publish_dir = tmp_path / "shp", tmp_path / "qgis"
+    _run(src, "run")
+    for run_id in ["2021091008", "2021091014", "2021091014", "2021091020"]:
+        publish(src, publish_dir, "CONSON", run_id, keep=2)
+    names = [p.name for p in releases(publish_dir, "CONSON")]
+    assert names == ["CONSON_2021091014.1", "CONSON_2021091020"]
+
+
+def test_publish_moves_a_directory_aside(tmp_path):
+    src, publish_dir = tmp_path / "shp", tmp_path / "qgis"
+    _run(src, "run")
+    (publish_dir / "CONSON").mkdir(parents=True)
+    (publish_dir / "CONSON/old.shp").write_text("old")
+    publish(src, publish_dir, "CONSON", "2021091008")
+    assert (publish_dir / "CONSON.orig/old.shp").read_text() == "old"
+    assert (publish_dir / "CONSON").is_symlink()
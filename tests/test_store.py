@@ -0,0 +1,80 @@
+import pandas as pd
+from _helper_ import LOCAL_TZ
+from _store_ import TrackStore
+from cron_multi import SOURCES
+
+STORM = "wp182021"
+
+
+def _positions(rows):
+    df = pd.DataFrame(
+        rows, columns=["Center", "Timestamp", "PosType", "Lat", "Lon", "Vmax"]
+    )
+    df["Timestamp"] = pd.to_datetime(df["Timestamp"]).dt.tz_localize(LOCAL_TZ)
+    return df
+
+
+def test_same_bulletin_is_replaced():
+    with TrackStore(":memory:") as store:
+        assert not store.has_fixes(STORM)
+        bulletin = _positions(
+            [
+                ("JTWC", "2021-09-10 08:00", "c", 14.0, 125.0, 50),
+                ("JTWC", "2021-09-10 20:00", "f", 15.0, 124.0, 55),
+            ]
+        )
+        assert store.upsert(STORM, bulletin) == 2
+        bulletin.loc[0, "Vmax"] = 60
+        store.upsert(STORM, bulletin)
+        n = store.con.execute("SELECT COUNT(*) FROM fixes").fetchone()[0]
+        assert n == 2
+        latest = store.latest(STORM, "JTWC")
+        assert latest[["PosType", "Vmax"]].values.tolist() == [["c", 60]]
+
+
+def test_history_keeps_the_latest_analysis():
+    with TrackStore(":memory:") as store:
+        store.upsert(
+            STORM,
+            _positions(
+                [
+                    ("JMA", "2021-09-10 08:00", "c", 14.0, 125.0, 45),
+                    ("JMA", "2021-09-10 20:00", "f", 15.0, 124.0, 50),
+                ]
+            ),
+        )
+        store.upsert(
+            STORM,
+            _positions(
+                [
+                    ("JMA", "2021-09-10 08:00", "h", 14.1, 125.1, 45),
+                    ("JMA", "2021-09-10 14:00", "c", 14.5, 124.5, 50),
+                ]
+            ),
+        )
+        history = store.history(STORM)
+        assert history["PosType"].unique().tolist() == ["h"]
+        assert history["Lat"].tolist() == [14.1, 14.5]
+        assert store.latest(STORM)["Lat"].tolist() == [14.5]
+
+
+def test_later_source_wins_a_collision():
+    """RAMMB's track history and JTWC's warning have the same fix of JTWC,
+    stored in the order of cron_multi's SOURCES"""
+    rammb = _positions(
+        [
+            ("JTWC", "2021-09-10 02:00", "h", 13.9, 125.2, 45),
+            ("JTWC", "2021-09-10 08:00", "c", 14.0, 125.0, 50),
+        ]
+    )
+    jtwc = _positions(
+        [
+            ("JTWC", "2021-09-10 08:00", "c", 14.1, 125.1, 55),
+            ("JTWC", "2021-09-10 20:00", "f", 15.0, 124.0, 60),
+        ]
+    )
+    src_dfs = {"JTWC": jtwc, "RAMMB": rammb}
+    with TrackStore(":memory:") as store:
+        store.upsert(STORM, pd.concat([src_dfs[s] for s in SOURCES if s in src_dfs]))
+        latest = store.latest(STORM, "JTWC")
+        assert latest[["Lat", "Vmax"]].values.tolist() == [[14.1, 55]]